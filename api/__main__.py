@@ -0,0 +1,40 @@
+"""
+命令行入口
+
+用法: python -m api bulk requests.jsonl -o results.jsonl [--workers 8] [--window 32] [--body digest]
+                        [--host localhost] [--port 8080] [--protocol http] [--no-resume]
+"""
+
+import argparse
+import json
+import sys
+
+from api.bulk import BODY_DIGEST, BODY_MODES, BulkRunner
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m api')
+    commands = parser.add_subparsers(dest='command', required=True)
+    bulk = commands.add_parser('bulk', help='send requests from a JSONL file and write results as JSONL')
+    bulk.add_argument('input', help='JSONL file of request specs')
+    bulk.add_argument('-o', '--output', required=True, help='JSONL file to append results to')
+    bulk.add_argument('--workers', type=int, default=8)
+    bulk.add_argument('--window', type=int, default=None, help='max requests in flight, default 4 * workers')
+    bulk.add_argument('--body', choices=BODY_MODES, default=BODY_DIGEST)
+    bulk.add_argument('--host', help='default host for specs without url or env')
+    bulk.add_argument('--port', type=int)
+    bulk.add_argument('--protocol', default='http')
+    bulk.add_argument('--no-resume', action='store_true', help='overwrite the output instead of resuming')
+    args = parser.parse_args(argv)
+
+    from api.api import Env
+
+    env = Env(host=args.host, port=args.port, protocol=args.protocol) if args.host else None
+    runner = BulkRunner(workers=args.workers, window=args.window, body_mode=args.body, env=env)
+    summary = runner.run(args.input, args.output, resume=not args.no_resume)
+    print(json.dumps(summary), file=sys.stderr)
+    return 1 if summary['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
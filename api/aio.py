@@ -0,0 +1,179 @@
+"""
+异步HTTP传输模块
+
+基于aiohttp为Api.send_async提供请求发送和连接池，aiohttp为可选依赖，首次发送异步请求时才导入。
+响应会被转换为requests.Response对象，同步和异步请求的callback可以使用相同的处理逻辑。
+"""
+
+import mmap
+import time
+import weakref
+from collections.abc import Iterator
+from datetime import timedelta
+from urllib.parse import urlparse
+
+from api.session_pool import DEFAULT_POOL_CONFIG
+
+
+def _import_aiohttp():
+    """导入aiohttp
+
+    Returns:
+        module: aiohttp模块
+
+    Raises:
+        ImportError: 未安装aiohttp
+    """
+    try:
+        import aiohttp
+    except ImportError as e:
+        raise ImportError('send_async requires aiohttp, install it with `pip install aiohttp`') from e
+    return aiohttp
+
+
+async def maybe_await(value):
+    """如果值可等待则等待它
+
+    用于同时支持普通函数和async def函数作为callback/before_send
+
+    Args:
+        value: 函数的返回值
+
+    Returns:
+        等待后的结果或原值
+    """
+    import inspect
+
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+async def _iterate(iterator):
+    """把同步迭代器转换为异步生成器
+
+    Args:
+        iterator: 产出bytes的同步迭代器
+
+    Yields:
+        bytes: 数据块
+    """
+    for chunk in iterator:
+        yield chunk
+
+
+def _async_body(data):
+    """把请求体转换为aiohttp支持的形式
+
+    Args:
+        data: 请求体
+
+    Returns:
+        aiohttp可以发送的请求体
+    """
+    if isinstance(data, mmap.mmap):
+        return memoryview(data)
+    if isinstance(data, Iterator) and not hasattr(data, 'read'):
+        return _iterate(data)
+    return data
+
+
+class AsyncSessionPool:
+    """aiohttp.ClientSession注册表
+
+    ClientSession绑定在创建它的事件循环上，因此以事件循环和(协议, 主机, 端口, SSL验证, 连接池配置)为键缓存。
+    """
+
+    def __init__(self):
+        """初始化注册表"""
+        self.__sessions = weakref.WeakKeyDictionary()
+
+    def get_session(self, protocol, host, port=None, verify=True, config=None):
+        """获取(必要时创建)当前事件循环上的ClientSession
+
+        Args:
+            protocol: 协议(http/https)
+            host: 主机名
+            port: 端口
+            verify: SSL验证开关
+            config: PoolConfig对象，为None时使用默认配置
+
+        Returns:
+            aiohttp.ClientSession: 可复用的ClientSession对象
+        """
+        import asyncio
+
+        aiohttp = _import_aiohttp()
+        config = config or DEFAULT_POOL_CONFIG
+        sessions = self.__sessions.setdefault(asyncio.get_running_loop(), {})
+        key = (protocol, host, port, verify, config.key())
+        session = sessions.get(key)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=config.pool_connections * config.pool_maxsize,
+                                             limit_per_host=config.pool_maxsize,
+                                             force_close=not config.keep_alive,
+                                             ssl=None if verify else False)
+            # 与requests保持一致，Session之间不共享也不保存响应Cookie
+            session = aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar())
+            sessions[key] = session
+        return session
+
+    async def close(self):
+        """关闭当前事件循环上的所有ClientSession"""
+        import asyncio
+
+        sessions = self.__sessions.pop(asyncio.get_running_loop(), {})
+        for session in sessions.values():
+            await session.close()
+
+
+default_async_session_pool = AsyncSessionPool()
+
+
+async def close_all():
+    """关闭默认注册表中当前事件循环上的所有ClientSession"""
+    await default_async_session_pool.close()
+
+
+async def request(method, url, headers=None, data=None, verify=True, cookies=None, proxies=None, config=None,
+                  session_pool=None):
+    """异步发送HTTP请求
+
+    Args:
+        method: HTTP方法
+        url: 完整URL
+        headers: HTTP头字典
+        data: 请求体
+        verify: SSL验证开关
+        cookies: Cookie字典
+        proxies: requests格式的代理字典
+        config: PoolConfig对象
+        session_pool: AsyncSessionPool对象，默认使用模块级的共享注册表
+
+    Returns:
+        requests.Response: 已读取完整响应体的Response对象，elapsed为收到响应头的耗时
+    """
+    import requests
+    from requests.structures import CaseInsensitiveDict
+    from requests.utils import get_encoding_from_headers
+
+    parsed_url = urlparse(url)
+    session = (session_pool or default_async_session_pool).get_session(parsed_url.scheme, parsed_url.hostname,
+                                                                       parsed_url.port, verify, config)
+    proxy = proxies.get(parsed_url.scheme) if proxies else None
+    start = time.perf_counter()
+    async with session.request(method.upper(), url, headers=headers, data=_async_body(data), cookies=cookies,
+                               proxy=proxy) as aio_resp:
+        # elapsed与requests一致，为收到响应头的耗时
+        elapsed = time.perf_counter() - start
+        content = await aio_resp.read()
+        resp = requests.Response()
+        resp.status_code = aio_resp.status
+        resp.reason = aio_resp.reason
+        resp.headers = CaseInsensitiveDict(aio_resp.headers)
+        resp.url = str(aio_resp.url)
+        resp.encoding = get_encoding_from_headers(resp.headers)
+        resp._content = content
+        resp._content_consumed = True
+        resp.elapsed = timedelta(seconds=elapsed)
+    return resp
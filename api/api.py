@@ -5,44 +5,115 @@ API请求处理模块
 包含ApiResult、Proxy、Env和Api四个主要类。
 """
 
-import json
-
-from bs4 import BeautifulSoup
-from requests import Response
-
+import copy
+import mmap
 import time
-from typing import Callable
-from urllib.parse import urlparse, urlunparse
-from concurrent.futures import ThreadPoolExecutor
-import requests
+from types import MappingProxyType
+
+from typing import TYPE_CHECKING, Callable, Iterator, Mapping, NamedTuple
+from urllib.parse import parse_qsl, urlparse
 import api.json_util as json_util
+import api.aio as aio
+import api.cassette as cassette_util
+from api.cache import CACHE_HIT, ResponseCache
+from api.cassette import Cassette
+from api.codec import get_codec, get_default_codec
+from api.log import RequestLogger, default_request_logger, new_chain_id
+from api.retention import RETAIN_FULL, check_retention, get_default_retention, retain
+from api.retry import CircuitBreakerRegistry, RetryBudget, RetryPolicy, default_circuit_breakers, default_retry_budget
+from api.session_pool import PoolConfig, SessionPool, default_session_pool, get_connect_time, reset_connect_time
+from api.singleflight import SingleFlight, default_single_flight
+from api.streaming import DEFAULT_CHUNK_SIZE, STREAM_CHUNKS, STREAM_MODES, ResponseStream
+from api.url import compile_path, encode_query, join_url
+
+# requests、bs4、concurrent.futures和asyncio在首次使用时才导入，缩短import api.api的耗时
+if TYPE_CHECKING:
+    import requests
+
+# 请求组默认的并发数
+DEFAULT_GROUP_WORKERS = 8
+# 请求组失败处理方式：fail_fast遇到第一个失败立即抛出，collect_all等待全部完成并收集失败
+GROUP_MODE_FAIL_FAST = 'fail_fast'
+GROUP_MODE_COLLECT_ALL = 'collect_all'
+# Api.with_()可以设置的字段，与同名的setter对应
+CLONE_FIELDS = frozenset(('url', 'env', 'path', 'path_params', 'port', 'host', 'protocol', 'method', 'query',
+                          'fragment', 'headers', 'verify', 'proxy', 'body', 'cookie', 'stream', 'callback',
+                          'before_send', 'prev_result', 'codec', 'pool_config', 'session_pool', 'cache',
+                          'single_flight', 'retry', 'retry_budget', 'circuit_breaker', 'cassette', 'retention',
+                          'logger', 'group_workers', 'group_mode'))
+
+
+class Timing:
+    """请求耗时
+
+    所有耗时单位为秒，无法获取时为None
+
+    Attributes:
+        queue_wait: 压测时请求从计划发送到实际开始发送的等待时间
+        connect: 建立连接(包括TLS握手)的耗时，复用连接时为0
+        ttfb: 从开始发送到收到响应头的耗时
+        total: 从开始发送到读取完响应体的耗时，重试时包括所有尝试和等待的时间
+        retries: 重试次数
+    """
+    __slots__ = ('queue_wait', 'connect', 'ttfb', 'total', 'retries')
+
+    def __init__(self, queue_wait=None, connect=None, ttfb=None, total=None, retries=0):
+        """初始化请求耗时
+
+        Args:
+            queue_wait: 排队等待时间
+            connect: 建立连接耗时
+            ttfb: 首字节耗时
+            total: 总耗时
+            retries: 重试次数
+        """
+        self.queue_wait = queue_wait
+        self.connect = connect
+        self.ttfb = ttfb
+        self.total = total
+        self.retries = retries
+
+    def __repr__(self):
+        return f'Timing(queue_wait={self.queue_wait}, connect={self.connect}, ttfb={self.ttfb}, total={self.total}, ' \
+               f'retries={self.retries})'
 
 
 class ApiResult:
     """API请求结果封装类
 
-    用于封装HTTP响应和回调函数处理结果。
+    用于封装HTTP响应和回调函数处理结果。使用__slots__，每个结果不再有属性字典
 
     Attributes:
-        __resp: 存储HTTP响应对象
+        __resp: 存储HTTP响应对象，按保留策略可能是精简的ResponseSummary
         __callback_result: 存储回调函数处理结果
+        __errors: 请求组中失败的成员，(序号, 异常)列表
+        __timing: 请求耗时
+        __cache_status: 响应缓存状态
+        __chain_id: 请求链ID
     """
+    __slots__ = ('__resp', '__callback_result', '__errors', '__timing', '__cache_status', '__chain_id')
 
-    def __init__(self, resp, callback_result):
+    def __init__(self, resp, callback_result, errors=None, timing=None):
         """初始化ApiResult
 
         Args:
             resp: requests.Response对象或None
             callback_result: 回调函数处理结果或None
+            errors: 请求组中失败成员的(序号, 异常)列表或None
+            timing: Timing对象或None
         """
         self.__resp = resp
         self.__callback_result = callback_result
+        self.__errors = errors or []
+        self.__timing = timing
+        self.__cache_status = None
+        self.__chain_id = None
 
     def get_resp(self):
         """获取HTTP响应对象
 
         Returns:
-            requests.Response对象或None
+            requests.Response对象，保留策略不是'full'时为ResponseSummary，请求组为响应列表，没有发送请求时为None
         """
         return self.__resp
 
@@ -54,6 +125,74 @@ class ApiResult:
         """
         return self.__callback_result
 
+    def get_errors(self):
+        """获取请求组中失败的成员
+
+        Returns:
+            list: (序号, 异常)列表，按序号排列
+        """
+        return self.__errors
+
+    def get_timing(self):
+        """获取请求耗时
+
+        Returns:
+            Timing对象，没有发送请求或为请求组合并结果时为None
+        """
+        return self.__timing
+
+    def timing(self, timing):
+        """设置请求耗时
+
+        Args:
+            timing: Timing对象
+
+        Returns:
+            self: 支持链式调用
+        """
+        self.__timing = timing
+        return self
+
+    def get_cache_status(self):
+        """获取响应缓存状态
+
+        Returns:
+            str: 'hit'缓存未过期直接返回，'revalidated'条件请求验证后返回缓存，'miss'从网络获取，未使用缓存时为None
+        """
+        return self.__cache_status
+
+    def cache_status(self, cache_status):
+        """设置响应缓存状态
+
+        Args:
+            cache_status: 缓存状态
+
+        Returns:
+            self: 支持链式调用
+        """
+        self.__cache_status = cache_status
+        return self
+
+    def get_chain_id(self):
+        """获取请求链ID
+
+        Returns:
+            str: 同一次send()中的请求链和请求组共享的ID，没有发送请求时为None
+        """
+        return self.__chain_id
+
+    def chain_id(self, chain_id):
+        """设置请求链ID
+
+        Args:
+            chain_id: 请求链ID
+
+        Returns:
+            self: 支持链式调用
+        """
+        self.__chain_id = chain_id
+        return self
+
     def resp(self, resp):
         """设置HTTP响应对象
 
@@ -79,6 +218,79 @@ class ApiResult:
         return self
 
 
+def merge_results(results, errors=None):
+    """按顺序合并多个请求的结果
+
+    用于请求组和依赖多个前置请求的场景
+
+    Args:
+        results: ApiResult列表，失败的请求为None
+        errors: 失败请求的(序号, 异常)列表
+
+    Returns:
+        ApiResult: 响应列表和合并后的回调结果
+    """
+    response_list = []
+    combined_result = {}
+    chain_id = None
+    for each_result in results:
+        if each_result is None:
+            response_list.append(None)
+            continue
+        if each_result.get_callback_result():
+            combined_result.update(each_result.get_callback_result())
+        response_list.append(each_result.get_resp())
+        chain_id = chain_id or each_result.get_chain_id()
+    return ApiResult(response_list, combined_result, errors).chain_id(chain_id)
+
+
+def is_stream_body(body):
+    """是否为流式请求体
+
+    Args:
+        body: 请求体
+
+    Returns:
+        bool: 生成器/迭代器、文件对象或mmap对象返回True
+    """
+    return isinstance(body, (Iterator, mmap.mmap)) or hasattr(body, 'read')
+
+
+class RequestSnapshot(NamedTuple):
+    """一次发送的请求快照
+
+    发送时由Api的属性解析得到，不可修改，发送过程只读取快照，不会写回Api对象
+    """
+    method: str
+    url: str
+    protocol: str
+    host: str
+    port: int
+    headers: Mapping
+    body: object
+    verify: bool
+    cookies: object
+    proxies: dict
+    stream: bool
+
+    def request_kwargs(self):
+        """转换为requests.Session.request的参数
+
+        Returns:
+            dict: 请求参数
+        """
+        return {
+            'method': self.method,
+            'url': self.url,
+            'headers': self.headers,
+            'data': self.body,
+            'verify': self.verify,
+            'cookies': self.cookies,
+            'proxies': self.proxies,
+            'stream': self.stream
+        }
+
+
 class Proxy:
     """代理服务器配置类
 
@@ -108,19 +320,29 @@ class Env:
         host: API主机名
         port: API端口
         protocol: API协议(http/https)
+        pool_config: 连接池配置
+        retry_policy: 重试策略
+        circuit_breaker: 熔断器注册表
     """
 
-    def __init__(self, host='localhost', port=None, protocol='http'):
+    def __init__(self, host='localhost', port=None, protocol='http', pool_config=None, retry_policy=None,
+                 circuit_breaker=None):
         """初始化环境配置
 
         Args:
             host: API主机，默认为'localhost'
             port: API端口，默认为None
             protocol: API协议，默认为'http'
+            pool_config: PoolConfig对象，默认为None表示使用默认连接池配置
+            retry_policy: RetryPolicy对象，默认为None表示不重试
+            circuit_breaker: CircuitBreakerRegistry对象，默认为None表示不熔断
         """
         self.host = host
         self.port = port
         self.protocol = protocol
+        self.pool_config = pool_config
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
 
     def get_env(self):
         """获取完整的环境URL
@@ -170,15 +392,31 @@ class Api:
         self.__protocol = 'http'
         self.__method = 'get'
         self.__path = ''  # path优先级比url高，会覆盖url中的path
+        self.__path_params = None
         self.__query = ''
         self.__fragment = ''
         self.__headers = {'Content-Type': 'application/json'}
+        self.__headers_shared = False  # HTTP头字典与副本共享，修改前需要复制
         self.__verify = True
         self.__env = None
         self.__proxy = None
         self.__body = None
         self.__cookie = None
         self.__stream = False
+        self.__stream_mode = None
+        self.__stream_chunk_size = DEFAULT_CHUNK_SIZE
+        self.__codec = None
+        self.__pool_config = None
+        self.__session_pool = default_session_pool
+        self.__cache = None
+        self.__single_flight = None
+        self.__logger = default_request_logger
+        self.__retry_policy = None
+        self.__retry_budget = default_retry_budget
+        self.__circuit_breaker = None
+        self.__cassette = None
+        self.__retention = None
+        self.__prepared = None
 
         # 初始化可调用属性
         self.__callable_port = None
@@ -200,12 +438,11 @@ class Api:
         # 初始化请求链相关属性
         self.__next_api = None
         self.__next_api_list = None
+        self.__group_workers = DEFAULT_GROUP_WORKERS
+        self.__group_mode = GROUP_MODE_FAIL_FAST
         self.__callback = None
         self.__before_send = None
         self.__prev_result = None
-        self.__count_sent = None
-        self.__interval = None
-        self.__count_request = None
 
         # 根据参数初始化属性
         if isinstance(url, Env):
@@ -229,6 +466,97 @@ class Api:
         self.callback(callback)
         self.before_send(before_send)
 
+    def __clone(self):
+        """直接复制属性字典，不经过__init__和setter，也不修改本Api
+
+        Returns:
+            Api: 副本，与本Api共享HTTP头字典
+        """
+        clone = object.__new__(type(self))
+        clone.__dict__ = self.__dict__.copy()
+        return clone
+
+    def __copy__(self):
+        """浅拷贝
+
+        HTTP头字典写时复制，副本和原Api都通过headers()修改时才复制，因此原Api也会被标记为共享HTTP头
+
+        Returns:
+            Api: 副本
+        """
+        clone = self.__clone()
+        self.__headers_shared = clone.__headers_shared = True
+        return clone
+
+    def with_(self, **fields):
+        """以本Api为模板派生一个请求
+
+        没有修改的字段与模板共享，比新建Api快得多，适合为大量数据逐个生成请求。模板不会被修改，
+        派生的Api保留模板的请求链和请求组
+
+        Args:
+            **fields: 字段名与同名setter相同，如path、query、headers、body，值的含义也与setter完全相同：
+                      多数setter忽略None和空值，保留模板中的值；retry、circuit_breaker、cassette、retention和logger
+                      直接赋值，传入None会清除模板中的值。headers与模板的HTTP头合并
+
+        Returns:
+            Api: 派生的Api
+
+        Raises:
+            TypeError: 字段名不在CLONE_FIELDS中
+        """
+        clone = self.__clone()
+        # 派生的Api长期存在，模板之后修改HTTP头时也要先复制
+        self.__headers_shared = clone.__headers_shared = True
+        for name, value in fields.items():
+            if name not in CLONE_FIELDS:
+                raise TypeError(f'with_() got an unexpected field {name!r}')
+            getattr(clone, name)(value)
+        return clone
+
+    def expand(self, params=None, **kwargs):
+        """用参数展开本Api，派生一个请求
+
+        路径模板中有占位符的参数替换到路径中，其余参数作为查询参数，与模板中同名的查询参数被覆盖
+
+        Args:
+            params: 参数字典
+            **kwargs: 参数，与params合并
+
+        Returns:
+            Api: 派生的Api，模板不会被修改
+        """
+        params = {**params, **kwargs} if params and kwargs else params or kwargs
+        fields = compile_path(self.__path).fields
+        path_params = {key: value for key, value in params.items() if key in fields}
+        query = {key: value for key, value in params.items() if key not in fields}
+        clone = self.__copy__()
+        if path_params:
+            clone.path_params({**self.__path_params, **path_params} if self.__path_params else path_params)
+        if query:
+            if clone.__query:
+                # 模板的查询参数保持顺序，同名的被覆盖
+                clone.__query = encode_query([(key, value) for key, value in
+                                              parse_qsl(clone.__query, keep_blank_values=True) if key not in query])
+            clone.query('&'.join(part for part in (clone.__query, encode_query(query)) if part))
+        return clone
+
+    def sweep(self, params, max_workers=8, window=None):
+        """用一组参数逐个展开本Api并发送
+
+        参数惰性读取，可以是生成器甚至无限序列，同一时刻最多只有window个请求在途，结果按参数的顺序产出
+
+        Args:
+            params: 参数字典的可迭代对象
+            max_workers: 并发数
+            window: 在途请求上限，默认为max_workers的4倍
+
+        Returns:
+            generator: (参数, ApiResult, 异常)的生成器，请求成功时异常为None，失败时ApiResult为None
+        """
+        from api.sweep import sweep
+        return sweep(self, params, max_workers, window)
+
     def __get_value_ignore_case(self, dictionary, key):
         """忽略大小写从字典中获取值
 
@@ -248,7 +576,8 @@ class Api:
         """设置请求发送前的回调函数
 
         Args:
-            before_send: 回调函数，接收两个参数(上一步结果，本Api对象)
+            before_send: 回调函数，接收两个参数(上一步结果，本次发送使用的Api副本)，
+                         对副本的修改只影响本次发送
 
         Returns:
             self: 支持链式调用
@@ -265,7 +594,7 @@ class Api:
         """
         return self.__before_send
 
-    def callback(self, callback: Callable[[requests.Response, ApiResult], object]):
+    def callback(self, callback: Callable[['requests.Response', ApiResult], object]):
         """设置请求完成后的回调函数
 
         Args:
@@ -350,6 +679,51 @@ class Api:
         """
         return self.__next_api_list
 
+    def group_workers(self, group_workers):
+        """设置请求组的并发数
+
+        Args:
+            group_workers: 同时发送的请求组成员个数，为1时顺序发送
+
+        Returns:
+            self: 支持链式调用
+        """
+        if group_workers:
+            self.__group_workers = group_workers
+        return self
+
+    def get_group_workers(self):
+        """获取请求组的并发数
+
+        Returns:
+            int: 并发数
+        """
+        return self.__group_workers
+
+    def group_mode(self, group_mode):
+        """设置请求组的失败处理方式
+
+        Args:
+            group_mode: 'fail_fast'在第一个成员失败时取消未开始的成员并抛出异常；
+                        'collect_all'等待所有成员完成，失败成员的响应为None，异常记录在ApiResult.get_errors()中
+
+        Returns:
+            self: 支持链式调用
+        """
+        if group_mode:
+            if group_mode not in (GROUP_MODE_FAIL_FAST, GROUP_MODE_COLLECT_ALL):
+                raise ValueError(f'unknown group mode: {group_mode}')
+            self.__group_mode = group_mode
+        return self
+
+    def get_group_mode(self):
+        """获取请求组的失败处理方式
+
+        Returns:
+            str: 'fail_fast'或'collect_all'
+        """
+        return self.__group_mode
+
     def stream(self, stream):
         """设置是否为流式响应
 
@@ -360,6 +734,7 @@ class Api:
             self: 支持链式调用
         """
         if stream:
+            self.__prepared = None
             if callable(stream):
                 self.__callable_stream = stream
             else:
@@ -374,6 +749,59 @@ class Api:
         """
         return self.__stream
 
+    def stream_mode(self, stream_mode, chunk_size=DEFAULT_CHUNK_SIZE):
+        """设置流式处理响应
+
+        设置后请求以流式响应发送，callback的第一个参数为ResponseStream对象而不是Response对象，
+        迭代它可以边接收边处理数据，callback返回后连接被释放
+
+        Args:
+            stream_mode: 'chunks'产出bytes数据块，'lines'产出文本行，'ndjson'产出解析后的JSON记录
+            chunk_size: 每次从网络读取的字节数
+
+        Returns:
+            self: 支持链式调用
+        """
+        if stream_mode:
+            if stream_mode not in STREAM_MODES:
+                raise ValueError(f'unknown stream mode: {stream_mode}')
+            self.__prepared = None
+            self.__stream_mode = stream_mode
+            self.__stream_chunk_size = chunk_size
+        return self
+
+    def get_stream_mode(self):
+        """获取流式处理方式
+
+        Returns:
+            str: 'chunks'、'lines'、'ndjson'，未设置时为None
+        """
+        return self.__stream_mode
+
+    def codec(self, codec):
+        """设置JSON编解码器
+
+        用于编码JSON请求体、send_and_get_json解析响应和解析NDJSON记录
+
+        Args:
+            codec: JsonCodec对象或名称('json'/'orjson'/'ujson'/'auto')
+
+        Returns:
+            self: 支持链式调用
+        """
+        if codec:
+            self.__prepared = None
+            self.__codec = get_codec(codec)
+        return self
+
+    def get_codec(self):
+        """获取JSON编解码器
+
+        Returns:
+            JsonCodec: Api上设置的编解码器，未设置时为全局默认的编解码器
+        """
+        return self.__codec or get_default_codec()
+
     def cookie(self, cookie):
         """设置Cookie
 
@@ -384,6 +812,7 @@ class Api:
             self: 支持链式调用
         """
         if cookie:
+            self.__prepared = None
             if callable(cookie):
                 self.__callable_cookie = cookie
             else:
@@ -401,6 +830,9 @@ class Api:
     def body(self, body):
         """设置请求体
 
+        请求体可以是生成器/迭代器(以chunked方式发送)、文件对象或mmap对象，这些流式请求体不会被JSON编码，
+        直接边读取边发送，只能发送一次。大列表可以用json_util.iter_json_array增量编码
+
         Args:
             body: 请求体或返回请求体的函数
 
@@ -408,6 +840,7 @@ class Api:
             self: 支持链式调用
         """
         if body:
+            self.__prepared = None
             if callable(body):
                 self.__callable_body = body
             else:
@@ -432,6 +865,7 @@ class Api:
             self: 支持链式调用
         """
         if proxy:
+            self.__prepared = None
             if callable(proxy):
                 self.__callable_proxy = proxy
             else:
@@ -462,6 +896,7 @@ class Api:
             self: 支持链式调用
         """
         if port:
+            self.__prepared = None
             if callable(port):
                 self.__callable_port = port
             else:
@@ -486,6 +921,7 @@ class Api:
             self: 支持链式调用
         """
         if host:
+            self.__prepared = None
             if callable(host):
                 self.__callable_host = host
             else:
@@ -510,6 +946,7 @@ class Api:
             self: 支持链式调用
         """
         if protocol:
+            self.__prepared = None
             if callable(protocol):
                 self.__callable_protocol = protocol
             else:
@@ -536,6 +973,7 @@ class Api:
             self: 支持链式调用
         """
         if url:
+            self.__prepared = None
             if callable(url):
                 self.__callable_url = url
             else:
@@ -551,6 +989,8 @@ class Api:
     def get_url(self):
         """获取完整URL
 
+        设置了path_params时展开路径模板
+
         Returns:
             str: 完整URL或None
         """
@@ -559,9 +999,10 @@ class Api:
         host = self.get_host()
         if self.get_port():
             host = f'{host}:{self.get_port()}'
-        data = [self.get_protocol(), host, self.get_path(), '', self.get_query(),
-                self.get_fragment()]
-        return urlunparse(data)
+        path = self.get_path()
+        if self.__path_params is not None:
+            path = compile_path(path).expand(self.__path_params)
+        return join_url(self.get_protocol(), host, path, self.get_query(), self.get_fragment())
 
     def method(self, method):
         """设置HTTP方法
@@ -573,6 +1014,7 @@ class Api:
             self: 支持链式调用
         """
         if method:
+            self.__prepared = None
             if callable(method):
                 self.__callable_method = method
             else:
@@ -597,6 +1039,7 @@ class Api:
             self: 支持链式调用
         """
         if path:
+            self.__prepared = None
             if callable(path):
                 self.__callable_path = path
             else:
@@ -607,10 +1050,34 @@ class Api:
         """获取路径
 
         Returns:
-            str: 路径
+            str: 路径，可能是'/users/{id}'形式的路径模板
         """
         return self.__path
 
+    def path_params(self, path_params):
+        """设置路径模板参数
+
+        路径中的{name}占位符在生成URL时替换为编码后的参数值，路径模板只解析一次
+
+        Args:
+            path_params: 参数字典，如{'id': 1}
+
+        Returns:
+            self: 支持链式调用
+        """
+        if path_params is not None:
+            self.__prepared = None
+            self.__path_params = path_params
+        return self
+
+    def get_path_params(self):
+        """获取路径模板参数
+
+        Returns:
+            dict: 参数字典或None
+        """
+        return self.__path_params
+
     def fragment(self, fragment):
         """设置URL片段
 
@@ -621,6 +1088,7 @@ class Api:
             self: 支持链式调用
         """
         if fragment:
+            self.__prepared = None
             if callable(fragment):
                 self.__callable_fragment = fragment
             else:
@@ -645,15 +1113,21 @@ class Api:
             self: 支持链式调用
         """
         if headers:
+            self.__prepared = None
             if callable(headers):
                 self.__callable_headers = headers
             else:
+                if self.__headers_shared:
+                    self.__headers = dict(self.__headers)
+                    self.__headers_shared = False
                 self.__headers.update(headers)
         return self
 
     def get_headers(self):
         """获取HTTP头
 
+        复制出的Api与原Api共享HTTP头字典，直到一方通过headers()修改，因此不要直接修改返回的字典
+
         Returns:
             dict: HTTP头字典
         """
@@ -663,22 +1137,20 @@ class Api:
         """设置查询参数
 
         Args:
-            query: 查询参数字符串/字典或返回查询参数的函数
+            query: 查询参数字符串、字典、(键, 值)列表或返回查询参数的函数。字典和列表按URL编码，
+                   值为列表或元组时展开为同名的多个参数；字符串原样使用
 
         Returns:
             self: 支持链式调用
         """
         if query:
+            self.__prepared = None
             if callable(query):
                 self.__callable_query = query
+            elif isinstance(query, str):
+                self.__query = query
             else:
-                if isinstance(query, dict):
-                    temp_query_arr = []
-                    for key in query:
-                        temp_query_arr.append(f'{key}={query.get(key)}')
-                    self.__query = '&'.join(temp_query_arr)
-                else:
-                    self.__query = query
+                self.__query = encode_query(query)
         return self
 
     def get_query(self):
@@ -699,6 +1171,7 @@ class Api:
             self: 支持链式调用
         """
         if isinstance(verify, bool):
+            self.__prepared = None
             if callable(verify):
                 self.__callable_verify = verify
             else:
@@ -723,7 +1196,9 @@ class Api:
             self: 支持链式调用
         """
         if env:
+            self.__prepared = None
             if isinstance(env, Env):
+                self.__env = env
                 self.port(env.port)
                 self.host(env.host)
                 self.protocol(env.protocol)
@@ -739,155 +1214,974 @@ class Api:
         """
         return self.__env
 
-    def get_desc(self):
-        """获取API描述信息
+    def pool_config(self, pool_config: PoolConfig):
+        """设置连接池配置
+
+        优先级高于Env中的连接池配置
+
+        Args:
+            pool_config: PoolConfig对象
 
         Returns:
-            dict: 包含url、method、header等信息的字典
+            self: 支持链式调用
         """
-        return {
-            'url': self.get_url(),
-            'method': self.get_method(),
-            'header': self.get_headers(),
-            'verify': self.get_verify(),
-            'proxy': self.get_proxy()
-        }
+        if pool_config:
+            self.__pool_config = pool_config
+        return self
 
-    def set_attr(self):
-        """动态设置属性
+    def get_pool_config(self):
+        """获取连接池配置
 
-        如果属性被设置为函数，则调用函数获取实际值
+        Returns:
+            PoolConfig: Api上的配置，其次是Env上的配置，都没有则为None
         """
-        if callable(self.__callable_url):
-            self.url(self.__callable_url(self.get_prev_result()))
-        if callable(self.__callable_port):
-            self.port(self.__callable_port(self.get_prev_result()))
-        if callable(self.__callable_host):
-            self.host(self.__callable_host(self.get_prev_result()))
-        if callable(self.__callable_protocol):
-            self.protocol(self.__callable_protocol(self.get_prev_result()))
-        if callable(self.__callable_method):
-            self.method(self.__callable_method(self.get_prev_result()))
-        if callable(self.__callable_path):
-            self.path(self.__callable_path(self.get_prev_result()))
-        if callable(self.__callable_query):
-            self.query(self.__callable_query(self.get_prev_result()))
-        if callable(self.__callable_fragment):
-            self.fragment(self.__callable_fragment(self.get_prev_result()))
-        if callable(self.__callable_headers):
-            self.headers(self.__callable_headers(self.get_prev_result()))
-        if callable(self.__callable_verify):
-            self.verify(self.__callable_verify(self.get_prev_result()))
-        if callable(self.__callable_env):
-            self.env(self.__callable_env(self.get_prev_result()))
-        if callable(self.__callable_proxy):
-            self.proxy(self.__callable_proxy(self.get_prev_result()))
-        if callable(self.__callable_body):
-            self.body(self.__callable_body(self.get_prev_result()))
-        if callable(self.__callable_cookie):
-            self.cookie(self.__callable_cookie(self.get_prev_result()))
-        if callable(self.__callable_stream):
-            self.stream(self.__callable_stream(self.get_prev_result()))
+        if self.__pool_config:
+            return self.__pool_config
+        if self.get_env():
+            return self.get_env().pool_config
+        return None
 
-    def send_and_get_json(self):
-        """发送请求并返回JSON响应
+    def session_pool(self, session_pool: SessionPool):
+        """设置Session注册表
+
+        Args:
+            session_pool: SessionPool对象，默认使用模块级的共享注册表
 
         Returns:
-            dict: 响应的JSON内容
+            self: 支持链式调用
         """
-        return self.send().get_resp().json()
+        if session_pool is not None:
+            self.__session_pool = session_pool
+        return self
 
-    def send_and_print(self):
-        """发送请求并打印响应
+    def get_session_pool(self):
+        """获取Session注册表
+
+        Returns:
+            SessionPool: Session注册表
+        """
+        return self.__session_pool
 
-        尝试以JSON、HTML或纯文本格式美化输出
+    def get_session(self):
+        """获取本次请求使用的Session
 
         Returns:
-            ApiResult: 请求结果对象
+            requests.Session: 按协议、主机、端口、代理和SSL验证复用的Session
         """
-        api_result = self.send()
-        try:
-            print(json_util.format_json(api_result.get_resp().text))
-            return api_result
-        except Exception:
-            pass
-        try:
-            api_result.get_resp().encoding = "utf-8"
-            soup = BeautifulSoup(api_result.get_resp().text, features="html.parser")
-            print(soup.prettify())
-            return api_result
-        except Exception:
-            pass
-        print(api_result.get_resp().text)
-        return api_result
+        return self.get_session_pool().get_session(self.get_protocol(), self.get_host(), self.get_port(),
+                                                   self.get_proxy(), self.get_verify(), self.get_pool_config())
 
-    def send(self):
-        """发送API请求
+    def cache(self, cache: ResponseCache):
+        """设置响应缓存
+
+        GET/HEAD请求按Cache-Control、ETag和Last-Modified使用缓存
 
-        处理请求链、回调函数等逻辑
+        Args:
+            cache: ResponseCache对象，可以在多个Api之间共享
 
         Returns:
-            ApiResult: 请求结果对象
+            self: 支持链式调用
         """
-        # 执行发送前回调
-        if self.get_before_send():
-            self.get_before_send()(self.get_prev_result(), self)
+        if cache is not None:
+            self.__cache = cache
+        return self
 
-        # 动态设置属性
-        self.set_attr()
+    def get_cache(self):
+        """获取响应缓存
 
-        this_result = ApiResult(None, None)
-        resp = None
+        Returns:
+            ResponseCache: 响应缓存，未设置时为None
+        """
+        return self.__cache
 
-        # 发送请求
-        if self.get_url():
-            print(f'{self.get_method()} {self.get_url()}')
-
-            # 处理请求体和Content-Type
-            if self.get_headers() and self.__get_value_ignore_case(self.get_headers(), 'Content-Type'):
-                if self.get_body() and 'application/json' in self.__get_value_ignore_case(self.get_headers(),
-                                                                                          'Content-Type'):
-                    self.body(json.dumps(self.get_body()))
-
-            # 发送实际请求
-            resp = requests.request(
-                method=self.get_method(),
-                url=self.get_url(),
-                headers=self.get_headers(),
-                data=self.get_body(),
-                verify=self.get_verify(),
-                cookies=self.get_cookie(),
-                proxies=self.get_proxy(),
-                stream=self.get_stream()
-            )
-            this_result.resp(resp)
+    def single_flight(self, single_flight: SingleFlight):
+        """设置相同请求合并
 
-        # 执行回调函数
-        # 如果有callback就执行它然后把结果暂存在自己这
-        if self.get_callback():
-            prev_result = self.get_prev_result() or this_result
-            this_callback_result = this_result.callback_result(self.get_callback()(resp, prev_result))
-            this_result.callback_result(this_callback_result.get_callback_result())
+        同时发起的相同GET/HEAD请求只发送一次，共享同一个响应，每个调用方仍然执行自己的callback
 
-        # 处理并行请求链
+        Args:
+            single_flight: True使用模块级共享的合并器，或SingleFlight对象
+
+        Returns:
+            self: 支持链式调用
+        """
+        if single_flight is True:
+            self.__single_flight = default_single_flight
+        elif single_flight:
+            self.__single_flight = single_flight
+        return self
+
+    def get_single_flight(self):
+        """获取相同请求合并器
+
+        Returns:
+            SingleFlight: 合并器，未设置时为None
+        """
+        return self.__single_flight
+
+    def retry(self, retry_policy: RetryPolicy):
+        """设置重试策略
+
+        连接失败、超时和502/503/504等响应按指数退避加随机抖动重试，默认只重试幂等方法，流式请求体不重试
+
+        Args:
+            retry_policy: RetryPolicy对象，True使用默认策略
+
+        Returns:
+            self: 支持链式调用
+        """
+        self.__retry_policy = RetryPolicy() if retry_policy is True else retry_policy
+        return self
+
+    def get_retry_policy(self):
+        """获取重试策略
+
+        Returns:
+            RetryPolicy: Api上的策略，其次是Env上的策略，都没有则为None
+        """
+        if self.__retry_policy:
+            return self.__retry_policy
+        if self.get_env():
+            return self.get_env().retry_policy
+        return None
+
+    def retry_budget(self, retry_budget: RetryBudget):
+        """设置重试预算
+
+        Args:
+            retry_budget: RetryBudget对象，默认使用模块级共享的预算
+
+        Returns:
+            self: 支持链式调用
+        """
+        if retry_budget is not None:
+            self.__retry_budget = retry_budget
+        return self
+
+    def get_retry_budget(self):
+        """获取重试预算
+
+        Returns:
+            RetryBudget: 重试预算
+        """
+        return self.__retry_budget
+
+    def circuit_breaker(self, circuit_breaker: CircuitBreakerRegistry):
+        """设置按主机熔断
+
+        Args:
+            circuit_breaker: CircuitBreakerRegistry对象，True使用模块级共享的注册表
+
+        Returns:
+            self: 支持链式调用
+        """
+        self.__circuit_breaker = default_circuit_breakers if circuit_breaker is True else circuit_breaker
+        return self
+
+    def get_circuit_breaker(self):
+        """获取熔断器注册表
+
+        Returns:
+            CircuitBreakerRegistry: Api上的注册表，其次是Env上的注册表，都没有则为None
+        """
+        if self.__circuit_breaker:
+            return self.__circuit_breaker
+        if self.get_env():
+            return self.get_env().circuit_breaker
+        return None
+
+    def cassette(self, cassette: Cassette):
+        """设置录制回放磁带
+
+        回放时直接返回录制的响应，不访问网络；录制时把请求和响应写入磁带
+
+        Args:
+            cassette: Cassette对象
+
+        Returns:
+            self: 支持链式调用
+        """
+        self.__cassette = cassette
+        return self
+
+    def get_cassette(self):
+        """获取录制回放磁带
+
+        Returns:
+            Cassette: Api上的磁带，其次是cassette.use()设置的全局磁带，都没有则为None
+        """
+        if self.__cassette is not None:
+            return self.__cassette
+        return cassette_util.get_active()
+
+    def retention(self, retention):
+        """设置响应保留策略
+
+        callback仍然收到完整的响应，执行完后按保留策略精简ApiResult中的响应并释放响应体和连接
+
+        Args:
+            retention: 'full'保留完整响应，'headers'只保留状态码和响应头，'digest'另外保留响应体大小和摘要，
+                       'none'只保留状态码，为None时使用全局默认策略
+
+        Returns:
+            self: 支持链式调用
+        """
+        self.__retention = retention if retention is None else check_retention(retention)
+        return self
+
+    def get_retention(self):
+        """获取响应保留策略
+
+        Returns:
+            str: 保留策略，没有单独设置时为全局默认策略
+        """
+        return self.__retention or get_default_retention()
+
+    def logger(self, logger: RequestLogger):
+        """设置请求日志记录器
+
+        每次请求的方法、URL、状态码、耗时和请求链ID由记录器在后台线程中输出
+
+        Args:
+            logger: RequestLogger对象，为None时不记录
+
+        Returns:
+            self: 支持链式调用
+        """
+        self.__logger = logger
+        return self
+
+    def get_logger(self):
+        """获取请求日志记录器
+
+        Returns:
+            RequestLogger: 日志记录器，未设置时为模块级的默认记录器
+        """
+        return self.__logger
+
+    def __log_request(self, snapshot, result, error=None):
+        """记录一次请求
+
+        Args:
+            snapshot: 发送的RequestSnapshot对象
+            result: 本次请求的ApiResult
+            error: 发送时出现的异常
+        """
+        logger = self.get_logger()
+        if logger is None:
+            return
+        resp = result.get_resp()
+        timing = result.get_timing() or Timing()
+        logger.log({
+            'method': snapshot.method.upper(),
+            'url': snapshot.url,
+            'status': resp.status_code if resp is not None else None,
+            'connect': timing.connect,
+            'ttfb': timing.ttfb,
+            'total': timing.total,
+            'retries': timing.retries,
+            'cache': result.get_cache_status(),
+            'error': repr(error) if error is not None else None,
+            'chain_id': result.get_chain_id()
+        })
+
+    def get_desc(self):
+        """获取API描述信息
+
+        Returns:
+            dict: 包含url、method、header等信息的字典
+        """
+        return {
+            'url': self.get_url(),
+            'method': self.get_method(),
+            'header': self.get_headers(),
+            'verify': self.get_verify(),
+            'proxy': self.get_proxy()
+        }
+
+    def set_attr(self):
+        """动态设置属性
+
+        如果属性被设置为函数，则调用函数获取实际值
+        """
+        if callable(self.__callable_url):
+            self.url(self.__callable_url(self.get_prev_result()))
+        if callable(self.__callable_port):
+            self.port(self.__callable_port(self.get_prev_result()))
+        if callable(self.__callable_host):
+            self.host(self.__callable_host(self.get_prev_result()))
+        if callable(self.__callable_protocol):
+            self.protocol(self.__callable_protocol(self.get_prev_result()))
+        if callable(self.__callable_method):
+            self.method(self.__callable_method(self.get_prev_result()))
+        if callable(self.__callable_path):
+            self.path(self.__callable_path(self.get_prev_result()))
+        if callable(self.__callable_query):
+            self.query(self.__callable_query(self.get_prev_result()))
+        if callable(self.__callable_fragment):
+            self.fragment(self.__callable_fragment(self.get_prev_result()))
+        if callable(self.__callable_headers):
+            self.headers(self.__callable_headers(self.get_prev_result()))
+        if callable(self.__callable_verify):
+            self.verify(self.__callable_verify(self.get_prev_result()))
+        if callable(self.__callable_env):
+            self.env(self.__callable_env(self.get_prev_result()))
+        if callable(self.__callable_proxy):
+            self.proxy(self.__callable_proxy(self.get_prev_result()))
+        if callable(self.__callable_body):
+            self.body(self.__callable_body(self.get_prev_result()))
+        if callable(self.__callable_cookie):
+            self.cookie(self.__callable_cookie(self.get_prev_result()))
+        if callable(self.__callable_stream):
+            self.stream(self.__callable_stream(self.get_prev_result()))
+
+    def send_and_get_json(self):
+        """发送请求并返回JSON响应，本次发送保留完整响应，不受保留策略影响
+
+        Returns:
+            dict: 响应的JSON内容
+        """
+        return self.get_codec().loads(self.with_(retention=RETAIN_FULL).send().get_resp().content)
+
+    def send_and_print(self):
+        """发送请求并打印响应
+
+        尝试以JSON、HTML或纯文本格式美化输出，设置了stream_mode时边接收边逐条输出，不执行callback
+
+        Returns:
+            ApiResult: 请求结果对象，流式输出时响应体已被读取，状态码、响应头和耗时仍然可用
+        """
+        if self.get_stream_mode():
+            streaming = self.__streaming_copy(self.get_stream_mode(), self.__stream_chunk_size)
+            api_result = streaming.send_single()
+            for record in ResponseStream(api_result.get_resp(), streaming.get_stream_mode(),
+                                         streaming.__stream_chunk_size, streaming.get_codec().loads):
+                print(record)
+            return api_result
+        api_result = self.with_(retention=RETAIN_FULL).send()
+        try:
+            print(json_util.format_json(api_result.get_resp().text, self.get_codec()))
+            return api_result
+        except Exception:
+            pass
+        try:
+            from bs4 import BeautifulSoup
+            api_result.get_resp().encoding = "utf-8"
+            soup = BeautifulSoup(api_result.get_resp().text, features="html.parser")
+            print(soup.prettify())
+            return api_result
+        except Exception:
+            pass
+        print(api_result.get_resp().text)
+        return api_result
+
+    def __is_dynamic(self):
+        """是否有需要在发送时解析的属性
+
+        Returns:
+            bool: 设置了before_send或以函数形式设置了属性时返回True
+        """
+        return bool(self.__before_send or self.__callable_url or self.__callable_port or self.__callable_host
+                    or self.__callable_protocol or self.__callable_method or self.__callable_path
+                    or self.__callable_query or self.__callable_fragment or self.__callable_headers
+                    or self.__callable_verify or self.__callable_env or self.__callable_proxy
+                    or self.__callable_body or self.__callable_cookie or self.__callable_stream)
+
+    def __working_copy(self, prev_result):
+        """创建本次发送使用的副本
+
+        before_send和动态属性只作用于副本，模板Api不会被修改
+
+        Args:
+            prev_result: 上一步结果
+
+        Returns:
+            Api: 浅拷贝的副本，HTTP头字典单独复制
+        """
+        # 不经过__copy__，发送线程不写模板Api的任何属性
+        working = self.__clone()
+        # before_send可能直接修改get_headers()返回的字典
+        working.__headers = dict(self.__headers)
+        working.__headers_shared = False
+        working.__prev_result = prev_result
+        return working
+
+    def snapshot(self):
+        """根据当前属性生成不可变的请求快照，不会修改Api对象
+
+        JSON类型的请求体在快照中由编解码器编码为bytes，因此多次发送不会重复编码
+
+        Returns:
+            RequestSnapshot: 请求快照，没有URL时为None
+        """
+        url = self.get_url()
+        if not url:
+            return None
+        body = self.get_body()
+        content_type = self.__get_value_ignore_case(self.get_headers(), 'Content-Type') if self.get_headers() else None
+        # 处理请求体和Content-Type，流式请求体原样发送
+        if body and content_type and 'application/json' in content_type and not is_stream_body(body):
+            body = self.get_codec().dumps(body)
+        return RequestSnapshot(self.get_method(), url, self.get_protocol(), self.get_host(), self.get_port(),
+                               MappingProxyType(dict(self.get_headers())), body, self.get_verify(),
+                               self.get_cookie(), self.get_proxy(), bool(self.get_stream() or self.get_stream_mode()))
+
+    def prepare(self):
+        """编译请求
+
+        缓存最终URL、HTTP头和编码后的请求体，重复发送时直接使用，通过setter修改属性时缓存自动失效。
+        直接修改get_headers()返回的字典不会使缓存失效，需要通过headers()修改
+
+        Returns:
+            RequestSnapshot: 请求快照，没有URL时为None
+        """
+        prepared = self.__prepared
+        if prepared is None:
+            prepared = self.__prepared = self.snapshot()
+        return prepared
+
+    def __resolve(self, prev_result):
+        """执行before_send并解析动态属性，生成本次发送的请求快照
+
+        Args:
+            prev_result: 上一步结果
+
+        Returns:
+            tuple: (本次发送使用的Api对象, RequestSnapshot或None)
+        """
+        if not self.__is_dynamic():
+            return self, self.prepare()
+        working = self.__working_copy(prev_result)
+        # 执行发送前回调
+        if working.get_before_send():
+            working.get_before_send()(prev_result, working)
+        # 动态设置属性
+        working.set_attr()
+        return working, working.snapshot()
+
+    async def __resolve_async(self, prev_result):
+        """异步执行before_send并解析动态属性，生成本次发送的请求快照
+
+        Args:
+            prev_result: 上一步结果
+
+        Returns:
+            tuple: (本次发送使用的Api对象, RequestSnapshot或None)
+        """
+        if not self.__is_dynamic():
+            return self, self.prepare()
+        working = self.__working_copy(prev_result)
+        if working.get_before_send():
+            await aio.maybe_await(working.get_before_send()(prev_result, working))
+        working.set_attr()
+        return working, working.snapshot()
+
+    def __transport(self, snapshot):
+        """通过网络发送请求快照，复用按主机缓存的Session，设置了磁带时先回放、发送后录制
+
+        Args:
+            snapshot: RequestSnapshot对象
+
+        Returns:
+            tuple: (requests.Response, Timing)
+        """
+        cassette = self.get_cassette()
+        start = time.perf_counter()
+        if cassette is not None:
+            resp = cassette.play(snapshot)
+            if resp is not None:
+                return resp, Timing(connect=0, ttfb=0, total=time.perf_counter() - start)
+        session = self.get_session_pool().get_session(snapshot.protocol, snapshot.host, snapshot.port,
+                                                      snapshot.proxies, snapshot.verify, self.get_pool_config())
+        reset_connect_time()
+        resp = session.request(**snapshot.request_kwargs())
+        timing = Timing(connect=get_connect_time(), ttfb=resp.elapsed.total_seconds(),
+                        total=time.perf_counter() - start)
+        if cassette is not None:
+            cassette.record(snapshot, resp)
+        return resp, timing
+
+    async def __transport_async(self, snapshot):
+        """通过aiohttp发送请求快照，设置了磁带时先回放、发送后录制
+
+        Args:
+            snapshot: RequestSnapshot对象
+
+        Returns:
+            tuple: (requests.Response, Timing)
+        """
+        cassette = self.get_cassette()
+        start = time.perf_counter()
+        if cassette is not None:
+            resp = cassette.play(snapshot)
+            if resp is not None:
+                return resp, Timing(connect=0, ttfb=0, total=time.perf_counter() - start)
+        request_kwargs = snapshot.request_kwargs()
+        del request_kwargs['stream']
+        resp = await aio.request(config=self.get_pool_config(), **request_kwargs)
+        timing = Timing(ttfb=resp.elapsed.total_seconds(), total=time.perf_counter() - start)
+        if cassette is not None:
+            cassette.record(snapshot, resp)
+        return resp, timing
+
+    def __retry_plan(self, snapshot):
+        """获取本次请求的重试策略、重试预算和熔断器
+
+        Args:
+            snapshot: RequestSnapshot对象
+
+        Returns:
+            tuple: (RetryPolicy或None, RetryBudget, CircuitBreaker或None)
+        """
+        policy = self.get_retry_policy()
+        if policy is not None and (not policy.is_retryable_method(snapshot.method) or is_stream_body(snapshot.body)):
+            # 流式请求体已被读取，无法重新发送
+            policy = None
+        budget = self.get_retry_budget()
+        if policy is not None:
+            budget.deposit()
+        registry = self.get_circuit_breaker()
+        breaker = registry.get(snapshot.protocol, snapshot.host, snapshot.port) if registry is not None else None
+        return policy, budget, breaker
+
+    @staticmethod
+    def __retry_delay(policy, budget, breaker, probe, attempt, resp=None, error=None):
+        """记录一次尝试的结果并计算重试等待时间
+
+        Args:
+            policy: RetryPolicy对象或None
+            budget: RetryBudget对象
+            breaker: CircuitBreaker对象或None
+            probe: 熔断器的试探令牌
+            attempt: 已经重试的次数
+            resp: 响应对象
+            error: 请求时出现的异常
+
+        Returns:
+            float: 重试前的等待时间(秒)，不重试时为None
+        """
+        if breaker is not None:
+            breaker.record(resp, error, probe)
+        if policy is None or not policy.should_retry(attempt, resp, error) or not budget.withdraw():
+            return None
+        return policy.get_backoff(attempt, resp)
+
+    def __transport_retry(self, snapshot):
+        """发送请求快照，按重试策略重试，熔断器打开时直接失败
+
+        Args:
+            snapshot: RequestSnapshot对象
+
+        Returns:
+            tuple: (requests.Response, Timing)
+
+        Raises:
+            CircuitOpenError: 主机的熔断器打开
+        """
+        policy, budget, breaker = self.__retry_plan(snapshot)
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            probe = breaker.before_call() if breaker is not None else None
+            try:
+                resp, timing = self.__transport(snapshot)
+            except Exception as e:
+                delay = self.__retry_delay(policy, budget, breaker, probe, attempt, error=e)
+                if delay is None:
+                    raise
+            else:
+                delay = self.__retry_delay(policy, budget, breaker, probe, attempt, resp)
+                if delay is None:
+                    timing.retries = attempt
+                    timing.total = time.perf_counter() - start
+                    return resp, timing
+                resp.close()
+            attempt += 1
+            time.sleep(delay)
+
+    async def __transport_retry_async(self, snapshot):
+        """异步发送请求快照，按重试策略重试，熔断器打开时直接失败
+
+        Args:
+            snapshot: RequestSnapshot对象
+
+        Returns:
+            tuple: (requests.Response, Timing)
+
+        Raises:
+            CircuitOpenError: 主机的熔断器打开
+        """
+        import asyncio
+
+        policy, budget, breaker = self.__retry_plan(snapshot)
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            probe = breaker.before_call() if breaker is not None else None
+            try:
+                resp, timing = await self.__transport_async(snapshot)
+            except Exception as e:
+                delay = self.__retry_delay(policy, budget, breaker, probe, attempt, error=e)
+                if delay is None:
+                    raise
+            else:
+                delay = self.__retry_delay(policy, budget, breaker, probe, attempt, resp)
+                if delay is None:
+                    timing.retries = attempt
+                    timing.total = time.perf_counter() - start
+                    return resp, timing
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def __fetch(self, snapshot):
+        """发送请求快照，开启请求合并时相同的并发请求只发送一次
+
+        Args:
+            snapshot: RequestSnapshot对象
+
+        Returns:
+            tuple: (requests.Response, Timing)
+        """
+        single_flight = self.get_single_flight()
+        if single_flight is None or not single_flight.is_coalescable(snapshot):
+            return self.__transport_retry(snapshot)
+        (resp, timing), shared = single_flight.do(single_flight.key(snapshot),
+                                                  lambda: self.__transport_retry(snapshot))
+        return resp, copy.copy(timing) if shared else timing
+
+    async def __fetch_async(self, snapshot):
+        """异步发送请求快照，开启请求合并时相同的并发请求只发送一次
+
+        Args:
+            snapshot: RequestSnapshot对象
+
+        Returns:
+            tuple: (requests.Response, Timing)
+        """
+        single_flight = self.get_single_flight()
+        if single_flight is None or not single_flight.is_coalescable(snapshot):
+            return await self.__transport_retry_async(snapshot)
+        (resp, timing), shared = await single_flight.do_async(single_flight.key(snapshot),
+                                                              lambda: self.__transport_retry_async(snapshot))
+        return resp, copy.copy(timing) if shared else timing
+
+    def send_single(self, prev_result=None):
+        """只发送本Api，不处理请求组和后续请求
+
+        执行before_send、发送请求并执行callback。before_send和动态属性作用于本次发送的副本，
+        同一个Api对象可以同时在多个线程中发送
+
+        Args:
+            prev_result: 上一步结果，默认为prev_result设置的值
+
+        Returns:
+            ApiResult: 本次请求的结果
+        """
+        prev_result = prev_result or self.get_prev_result()
+        working, snapshot = self.__resolve(prev_result)
+
+        this_result = ApiResult(None, None).chain_id(prev_result and prev_result.get_chain_id() or new_chain_id())
+        resp = None
+
+        if snapshot:
+            try:
+                cache = working.get_cache()
+                if cache is not None and cache.is_cacheable(snapshot):
+                    start = time.perf_counter()
+                    entry, fresh = cache.lookup(snapshot)
+                    if fresh:
+                        # 未过期的缓存直接返回，不访问网络
+                        resp, timing, cache_status = entry.to_response(), Timing(), CACHE_HIT
+                    else:
+                        resp, timing = working.__fetch(cache.conditional(snapshot, entry))
+                        resp, cache_status = cache.update(snapshot, entry, resp)
+                    timing.total = time.perf_counter() - start
+                    this_result.cache_status(cache_status)
+                else:
+                    resp, timing = working.__fetch(snapshot)
+            except Exception as e:
+                working.__log_request(snapshot, this_result, e)
+                raise
+            this_result.resp(resp).timing(timing)
+            working.__log_request(snapshot, this_result)
+
+        # 执行回调函数
+        # 如果有callback就执行它然后把结果暂存在自己这
+        if working.get_callback():
+            if resp is not None and working.get_stream_mode():
+                with ResponseStream(resp, working.get_stream_mode(), working.__stream_chunk_size,
+                                    working.get_codec().loads) as resp_stream:
+                    this_result.callback_result(working.get_callback()(resp_stream, prev_result or this_result))
+            else:
+                this_result.callback_result(working.get_callback()(resp, prev_result or this_result))
+        if resp is not None and working.get_retention() != RETAIN_FULL:
+            this_result.resp(retain(resp, working.get_retention()))
+        return this_result
+
+    def __streaming_copy(self, stream_mode, chunk_size):
+        """创建逐块读取响应使用的副本，不执行callback，模板Api不会被修改
+
+        Args:
+            stream_mode: 'chunks'、'lines'或'ndjson'
+            chunk_size: 每次从网络读取的字节数
+
+        Returns:
+            Api: 副本
+        """
+        streaming = self.__clone()
+        streaming.__headers_shared = True
+        streaming.__callback = None
+        # 响应要交给ResponseStream逐块读取，不能被保留策略精简
+        streaming.__retention = RETAIN_FULL
+        return streaming.stream_mode(stream_mode, chunk_size)
+
+    def iter_stream(self, stream_mode=None, chunk_size=None, prev_result=None):
+        """发送请求并逐个产出响应数据，不执行callback
+
+        提前结束迭代时剩余的响应不会被读取，连接被释放
+
+        Args:
+            stream_mode: 'chunks'、'lines'或'ndjson'，默认为stream_mode设置的值，都没有时为'chunks'
+            chunk_size: 每次从网络读取的字节数
+            prev_result: 上一步结果
+
+        Yields:
+            bytes数据块、文本行或JSON记录
+        """
+        streaming = self.__streaming_copy(stream_mode or self.get_stream_mode() or STREAM_CHUNKS,
+                                          chunk_size or self.__stream_chunk_size)
+        resp = streaming.send_single(prev_result).get_resp()
+        yield from ResponseStream(resp, streaming.get_stream_mode(), streaming.__stream_chunk_size,
+                                  streaming.get_codec().loads)
+
+    def __send_step(self, prev_result):
+        """发送本Api及其请求组
+
+        Args:
+            prev_result: 上一步结果
+
+        Returns:
+            ApiResult: 有请求组时为请求组的合并结果，否则为本次请求的结果
+        """
+        this_result = self.send_single(prev_result)
+        # 处理并行请求链
         # 如果next_request_list有值需要把自己的ApiResult给next_request_list中的每个Api，然后发送他们，把他们的结果汇总给下一个Api
         if self.get_next_api_list() and len(self.get_next_api_list()) > 0:
-            response_list = []
-            combined_result = {}
-            for each_req in self.get_next_api_list():
-                each_req.prev_result(this_result)
-                each_result = each_req.send()
-                combined_result.update(each_result.get_callback_result())
-                response_list.append(each_result.get_resp())
-            this_result = ApiResult(response_list, combined_result)
+            this_result = self.__send_group(this_result)
+        return this_result
+
+    def send(self, prev_result=None, step_results=None):
+        """发送API请求
+
+        处理请求链、回调函数等逻辑，串行请求链循环发送，不受递归深度限制。
+        上一步结果作为参数在请求链中传递，不会写回后续的Api对象
+
+        Args:
+            prev_result: 上一步结果，默认为prev_result设置的值
+            step_results: 列表，传入时按顺序追加请求链每一步的结果
+
+        Returns:
+            ApiResult: 请求结果对象
+        """
+        this_result = self.__send_step(prev_result)
+        if step_results is not None:
+            step_results.append(this_result)
 
         # 处理串行请求链
-        if self.get_next_api() and isinstance(self.get_next_api(), Api):
-            self.get_next_api().prev_result(this_result)
-            self.get_next_api().send()
+        prev_result = this_result
+        current = self
+        while current.get_next_api() and isinstance(current.get_next_api(), Api):
+            current = current.get_next_api()
+            prev_result = current.__send_step(prev_result)
+            if step_results is not None:
+                step_results.append(prev_result)
 
         return this_result
 
+    async def send_single_async(self, prev_result=None):
+        """异步地只发送本Api，不处理请求组和后续请求
+
+        Args:
+            prev_result: 上一步结果，默认为prev_result设置的值
+
+        Returns:
+            ApiResult: 本次请求的结果
+        """
+        prev_result = prev_result or self.get_prev_result()
+        working, snapshot = await self.__resolve_async(prev_result)
+
+        this_result = ApiResult(None, None).chain_id(prev_result and prev_result.get_chain_id() or new_chain_id())
+        resp = None
+
+        if snapshot:
+            try:
+                cache = working.get_cache()
+                if cache is not None and cache.is_cacheable(snapshot):
+                    start = time.perf_counter()
+                    entry, fresh = cache.lookup(snapshot)
+                    if fresh:
+                        resp, timing, cache_status = entry.to_response(), Timing(), CACHE_HIT
+                    else:
+                        resp, timing = await working.__fetch_async(cache.conditional(snapshot, entry))
+                        resp, cache_status = cache.update(snapshot, entry, resp)
+                    timing.total = time.perf_counter() - start
+                    this_result.cache_status(cache_status)
+                else:
+                    resp, timing = await working.__fetch_async(snapshot)
+            except Exception as e:
+                working.__log_request(snapshot, this_result, e)
+                raise
+            this_result.resp(resp).timing(timing)
+            working.__log_request(snapshot, this_result)
+
+        if working.get_callback():
+            if resp is not None and working.get_stream_mode():
+                # aiohttp已读取完整响应体，ResponseStream从内存中切分数据
+                resp = ResponseStream(resp, working.get_stream_mode(), working.__stream_chunk_size,
+                                      working.get_codec().loads)
+            this_result.callback_result(await aio.maybe_await(working.get_callback()(resp, prev_result or this_result)))
+        if this_result.get_resp() is not None and working.get_retention() != RETAIN_FULL:
+            this_result.resp(retain(this_result.get_resp(), working.get_retention()))
+        return this_result
+
+    async def __send_step_async(self, prev_result):
+        """异步发送本Api及其请求组
+
+        Args:
+            prev_result: 上一步结果
+
+        Returns:
+            ApiResult: 有请求组时为请求组的合并结果，否则为本次请求的结果
+        """
+        this_result = await self.send_single_async(prev_result)
+        if self.get_next_api_list() and len(self.get_next_api_list()) > 0:
+            this_result = await self.__send_group_async(this_result)
+        return this_result
+
+    async def send_async(self, prev_result=None):
+        """异步发送API请求
+
+        与send的请求链、请求组逻辑相同，callback和before_send可以是普通函数或async def函数。
+        需要安装aiohttp，响应体会被完整读取，stream设置不生效
+
+        Args:
+            prev_result: 上一步结果，默认为prev_result设置的值
+
+        Returns:
+            ApiResult: 请求结果对象
+        """
+        this_result = await self.__send_step_async(prev_result)
+
+        prev_result = this_result
+        current = self
+        while current.get_next_api() and isinstance(current.get_next_api(), Api):
+            current = current.get_next_api()
+            prev_result = await current.__send_step_async(prev_result)
+
+        return this_result
+
+    def send_dag(self, max_workers=8):
+        """把请求链编译为依赖图并发送
+
+        请求链的每一步与send()一样各发送一次，所有依赖已完成的Api立即发送，同时发送的个数不超过max_workers
+
+        Args:
+            max_workers: 全局并发数
+
+        Returns:
+            DagResult: 各Api的结果及关键路径耗时
+        """
+        from api.dag import Dag
+        return Dag.from_chain(self).run(max_workers)
+
+    def __send_group(self, prev_result):
+        """并发发送请求组
+
+        成员按group_workers限制并发发送，结果按成员在列表中的顺序合并，与完成先后无关
+
+        Args:
+            prev_result: 传给每个成员的上一步结果
+
+        Returns:
+            ApiResult: 响应列表和合并后的回调结果
+        """
+        api_list = self.get_next_api_list()
+        results = [None] * len(api_list)
+        errors = []
+        workers = min(self.get_group_workers(), len(api_list))
+        collect_all = self.get_group_mode() == GROUP_MODE_COLLECT_ALL
+
+        if workers <= 1:
+            for index, each_req in enumerate(api_list):
+                try:
+                    results[index] = each_req.send(prev_result)
+                except Exception as e:
+                    if not collect_all:
+                        raise
+                    errors.append((index, e))
+        else:
+            from concurrent.futures import ThreadPoolExecutor, ALL_COMPLETED, FIRST_EXCEPTION, wait
+            executor = ThreadPoolExecutor(max_workers=workers)
+            futures = [executor.submit(each_req.send, prev_result) for each_req in api_list]
+            done, not_done = wait(futures, return_when=ALL_COMPLETED if collect_all else FIRST_EXCEPTION)
+            if not_done:
+                # fail_fast: 取消还未开始的成员，正在执行的成员在后台结束，结果被丢弃
+                executor.shutdown(wait=False, cancel_futures=True)
+                failed = [future for future in futures if future in done and future.exception()]
+                raise failed[0].exception()
+            executor.shutdown(wait=True)
+            for index, future in enumerate(futures):
+                if future.exception():
+                    if not collect_all:
+                        raise future.exception()
+                    errors.append((index, future.exception()))
+                else:
+                    results[index] = future.result()
+
+        return merge_results(results, errors)
+
+    async def __send_group_async(self, prev_result):
+        """异步并发发送请求组
+
+        语义与__send_group相同，并发数由group_workers限制
+
+        Args:
+            prev_result: 传给每个成员的上一步结果
+
+        Returns:
+            ApiResult: 响应列表和合并后的回调结果
+        """
+        import asyncio
+
+        api_list = self.get_next_api_list()
+        collect_all = self.get_group_mode() == GROUP_MODE_COLLECT_ALL
+        semaphore = asyncio.Semaphore(self.get_group_workers())
+
+        async def send_member(each_req):
+            async with semaphore:
+                return await each_req.send_async(prev_result)
+
+        tasks = [asyncio.ensure_future(send_member(each_req)) for each_req in api_list]
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.ALL_COMPLETED if collect_all
+                                           else asyncio.FIRST_EXCEPTION)
+        if pending:
+            # fail_fast: 取消其余成员
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            raise [task for task in tasks if task in done and task.exception()][0].exception()
+
+        results = [None] * len(api_list)
+        errors = []
+        for index, task in enumerate(tasks):
+            if task.exception():
+                if not collect_all:
+                    raise task.exception()
+                errors.append((index, task.exception()))
+            else:
+                results[index] = task.result()
+        return merge_results(results, errors)
+
     def get(self):
         """发送GET请求
 
@@ -895,6 +2189,7 @@ class Api:
             ApiResult: 请求结果对象
         """
         self.__method = 'get'
+        self.__prepared = None
         return self.send()
 
     def post(self):
@@ -904,64 +2199,145 @@ class Api:
             ApiResult: 请求结果对象
         """
         self.__method = 'post'
+        self.__prepared = None
         return self.send()
 
-    def then(self, param):
+    def then(self, param, group_workers=None, group_mode=None):
         """设置下一步请求
 
         Args:
             param: 可以是单个Api对象或Api对象列表
+            group_workers: param为列表时，请求组的并发数
+            group_mode: param为列表时，请求组的失败处理方式('fail_fast'/'collect_all')
 
         Returns:
             self: 支持链式调用
         """
-        if self.get_next_api():
-            self.get_next_api().then(param)
+        tail = self
+        while tail.get_next_api():
+            tail = tail.get_next_api()
+        if isinstance(param, list):
+            tail.next_api_list(param)
+            tail.group_workers(group_workers)
+            tail.group_mode(group_mode)
         else:
-            if isinstance(param, list):
-                self.next_api_list(param)
-                return self
-            else:
-                self.next_api(param)
+            tail.next_api(param)
         return self
 
-    def __send_loop(self):
-        """内部循环发送方法
+    def __copy_chain(self, update):
+        """复制整个请求链(包括请求组)，模板请求链不会被修改
 
-        用于并行发送请求
+        Args:
+            update: 接收(复制的Api, 原Api)的函数，修改复制的Api
+
+        Returns:
+            Api: 复制的请求链的第一个Api
         """
-        while True:
-            if self.__count_sent >= self.__count_request:
-                return
-            self.__count_sent += 1
-            time.sleep(self.__interval)
-            self.send()
+        head = None
+        prev = None
+        node = self
+        while node is not None:
+            clone = copy.copy(node)
+            update(clone, node)
+            if node.__next_api_list:
+                clone.__next_api_list = [member.__copy_chain(update) for member in node.__next_api_list]
+            if prev is None:
+                head = clone
+            else:
+                prev.__next_api = clone
+            prev = clone
+            node = node.__next_api
+        return head
 
-    def send_parallel(self, count_request=1, count_thread=1, interval=0, all_done_callback=None, future_callback=None):
-        """并行发送请求
+    def for_env(self, env):
+        """复制整个请求链(包括请求组)，把使用Env的Api切换到另一个环境
+
+        没有使用Env的Api(例如完整URL指向第三方服务)保持不变，模板请求链不会被修改
 
         Args:
-            count_request: 总发送次数
-            count_thread: 线程个数
-            interval: 每个请求的间隔时间(秒)
-            all_done_callback: 所有任务完成后回调(无参数)
-            future_callback: 每个任务完成后回调(1个参数，表示一个future对象)
+            env: Env对象
+
+        Returns:
+            Api: 复制的请求链的第一个Api
         """
-        self.__count_request = count_request
-        self.__interval = interval
-        self.__count_sent = 0
+        def switch(clone, node):
+            if node.__env is not None:
+                clone.env(env)
+                # port()会忽略None，新环境没有端口时需要清掉原环境的端口
+                clone.__port = env.port
 
-        with ThreadPoolExecutor() as executor:
-            for i in range(count_thread):
-                future = executor.submit(self.__send_loop)
-                if future_callback:
-                    future.add_done_callback(future_callback)
+        return self.__copy_chain(switch)
 
-            # 等待所有任务完成
-            executor.shutdown(wait=True)
+    def fan_out(self, envs, max_workers=None, ignore=()):
+        """把请求链同时发送到多个环境并比较结果
+
+        Args:
+            envs: Env对象列表，第一个作为比较的基准
+            max_workers: 并发数，默认为环境个数
+            ignore: 比较响应体时忽略的JSON路径，如'$.timestamp'
+
+        Returns:
+            Comparison: 按envs顺序排列的结果、相对基准的延迟差和响应差异
+        """
+        from api.compare import fan_out
+        return fan_out(self, envs, max_workers, ignore)
+
+    def paginate(self, paginator, prefetch=1, max_pages=None, items=False):
+        """逐页发送请求
+
+        调用方处理当前页时在后台预取之后的页，提前结束迭代时不会再发送新的请求
+
+        Args:
+            paginator: CursorPaginator、OffsetPaginator或LinkPaginator对象
+            prefetch: 预取的页数，为0时不预取
+            max_pages: 最多发送的页数
+            items: 为True时逐条产出每页中的数据，否则产出每页的ApiResult
 
-            if all_done_callback:
-                all_done_callback()
+        Returns:
+            generator: ApiResult或数据的生成器
+        """
+        from api.paginate import paginate
+        return paginate(self, paginator, prefetch, max_pages, items)
+
+    def send_parallel(self, count_request=None, count_thread=1, interval=0, all_done_callback=None,
+                      future_callback=None, rate=None, duration=None, mode='closed', processes=None, retention=None):
+        """并行发送请求
+
+        Args:
+            count_request: 总发送次数，与duration都不设置时为1
+            count_thread: 线程个数
+            interval: 闭环模式下每个线程发送前的间隔时间(秒)
+            all_done_callback: 所有任务完成后回调(无参数)
+            future_callback: 每个请求完成后回调(1个参数，表示该请求的future对象)
+            rate: 目标速率(请求/秒)，按令牌桶限速
+            duration: 持续发送的时间(秒)，与count_request同时设置时先达到的为准
+            mode: 'closed'闭环，每个线程完成一个请求后才发送下一个；
+                  'open'开环，按rate的时间表派发请求，不受响应时间影响，必须设置rate
+            processes: 工作进程数，大于1时count_request和rate平均分给各个进程，每个进程使用count_thread个线程
+                       和自己的连接池，callback在工作进程中执行，不支持future_callback
+            retention: 本次压测中请求链每个Api的响应保留策略，为None时使用各Api自己的设置，
+                       future_callback收到的结果按此策略精简
+
+        Returns:
+            RunReport: 压测报告，包括延迟直方图和分位数、吞吐量时间线、状态码和错误计数，多进程时为合并后的报告
+        """
+        from api.load import LoadGenerator, ProcessLoadGenerator
+        api = self
+        if retention is not None:
+            check_retention(retention)
+            api = self.__copy_chain(lambda clone, node: clone.retention(retention))
+        if processes and processes > 1:
+            if future_callback:
+                raise ValueError('future_callback is not supported with multiple processes')
+            report = ProcessLoadGenerator(api.send, processes, count=count_request, duration=duration, rate=rate,
+                                          concurrency=count_thread, mode=mode, interval=interval).run()
+        else:
+            report = LoadGenerator(api.send, count=count_request, duration=duration, rate=rate,
+                                   concurrency=count_thread, mode=mode, interval=interval,
+                                   future_callback=future_callback).run()
+        if all_done_callback:
+            all_done_callback()
+        return report
 
 
 if __name__ == '__main__':
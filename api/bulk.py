@@ -0,0 +1,208 @@
+"""
+批量请求模块
+
+从JSONL文件逐行读取请求描述，用有界的线程池并发发送，按输入顺序把每个请求的结果写成一行JSONL。
+同一时刻只有window个请求在内存中，内存占用与文件大小无关；输出文件已有的结果行在重新运行时被跳过，可以断点续跑。
+
+请求描述的字段:
+    url: 完整URL，与env二选一
+    env: {"host": ..., "port": ..., "protocol": ...}，默认为BulkRunner的env
+    path、method、query、headers、body、cookie、verify: 与Api的同名设置相同，body为JSON值
+    id: 可选，原样写入结果行
+
+结果行的字段:
+    line: 输入文件中的序号(从0开始，不计空行)
+    id: 请求描述中的id
+    status: 响应状态码，请求失败时为None
+    timing: {"connect", "ttfb", "total", "retries"}
+    size: 响应体字节数
+    sha256: 响应体摘要(body_mode为digest或body时)
+    body: 响应体文本(body_mode为body时)
+    error: 请求失败时的异常描述
+"""
+
+import hashlib
+import json
+import os
+from collections import deque
+
+from api.api import Api, Env
+from api.retention import RETAIN_FULL
+
+BODY_DIGEST = 'digest'
+BODY_FULL = 'body'
+BODY_NONE = 'none'
+BODY_MODES = (BODY_DIGEST, BODY_FULL, BODY_NONE)
+
+# 计算摘要时每次读取的字节数
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def iter_lines(file):
+    """逐行读取请求描述
+
+    Args:
+        file: 文本文件对象
+
+    Yields:
+        str: 一行请求描述，跳过空行
+    """
+    for line in file:
+        if line.strip():
+            yield line
+
+
+def count_results(path):
+    """统计输出文件中完整的结果行数，末尾不完整的行会被截掉
+
+    Args:
+        path: 输出文件路径
+
+    Returns:
+        int: 完整的结果行数，文件不存在时为0
+    """
+    if not os.path.exists(path):
+        return 0
+    count = 0
+    end = 0
+    with open(path, 'rb') as file:
+        for line in file:
+            if not line.endswith(b'\n'):
+                break
+            count += 1
+            end += len(line)
+    if end != os.path.getsize(path):
+        # 上次运行中断时写了一半的行
+        with open(path, 'r+b') as file:
+            file.truncate(end)
+    return count
+
+
+class BulkRunner:
+    """批量请求执行器
+
+    Attributes:
+        workers: 并发发送的线程数
+        window: 同时在内存中的请求数上限，结果按输入顺序写出
+        body_mode: 'digest'只写响应体摘要，'body'写入响应体文本，'none'都不写
+        env: 请求描述中没有url和env时使用的Env对象
+        configure: 发送前对每个Api调用的函数，可以统一设置连接池、重试、日志等
+    """
+
+    def __init__(self, workers=8, window=None, body_mode=BODY_DIGEST, env=None, configure=None):
+        """初始化批量请求执行器
+
+        Args:
+            workers: 线程数，默认为8
+            window: 在途请求上限，默认为workers的4倍
+            body_mode: 'digest'、'body'或'none'，默认为'digest'
+            env: 默认Env对象
+            configure: 接收Api对象的函数
+        """
+        if body_mode not in BODY_MODES:
+            raise ValueError(f'unknown body mode: {body_mode}')
+        self.workers = workers
+        self.window = window or workers * 4
+        self.body_mode = body_mode
+        self.env = env
+        self.configure = configure
+
+    def build_api(self, spec):
+        """根据请求描述生成Api
+
+        Args:
+            spec: 请求描述字典
+
+        Returns:
+            Api: 请求对象，不输出请求日志，总是保留完整响应
+        """
+        env = Env(**spec['env']) if spec.get('env') else None
+        api = Api(url=spec.get('url'), env=env or (None if spec.get('url') else self.env), path=spec.get('path'),
+                  method=spec.get('method'), query=spec.get('query'), headers=spec.get('headers'),
+                  body=spec.get('body'), cookie=spec.get('cookie'), verify=spec.get('verify', True))
+        # 摘要模式边读取边计算，不在内存中保留完整的响应体
+        api.stream(self.body_mode != BODY_FULL).logger(None)
+        if self.configure:
+            self.configure(api)
+        # 结果行需要读取响应体计算大小和摘要
+        return api.retention(RETAIN_FULL)
+
+    def run_one(self, line, text):
+        """发送一个请求并生成结果行
+
+        Args:
+            line: 请求在输入中的序号
+            text: JSON格式的请求描述
+
+        Returns:
+            dict: 结果行，请求描述无法解析或请求失败时包含error
+        """
+        record = {'line': line, 'id': None, 'status': None}
+        try:
+            spec = json.loads(text)
+            record['id'] = spec.get('id')
+            result = self.build_api(spec).send()
+        except Exception as e:
+            record['error'] = repr(e)
+            return record
+        resp = result.get_resp()
+        timing = result.get_timing()
+        record['status'] = resp.status_code
+        record['timing'] = {'connect': timing.connect, 'ttfb': timing.ttfb, 'total': timing.total,
+                            'retries': timing.retries}
+        try:
+            if self.body_mode == BODY_FULL:
+                record['size'] = len(resp.content)
+                record['sha256'] = hashlib.sha256(resp.content).hexdigest()
+                record['body'] = resp.text
+            else:
+                digest = hashlib.sha256()
+                size = 0
+                for chunk in resp.iter_content(READ_CHUNK_SIZE):
+                    size += len(chunk)
+                    digest.update(chunk)
+                record['size'] = size
+                if self.body_mode == BODY_DIGEST:
+                    record['sha256'] = digest.hexdigest()
+        except Exception as e:
+            record['error'] = repr(e)
+        finally:
+            resp.close()
+        return record
+
+    def run(self, input_path, output_path, resume=True):
+        """执行输入文件中的所有请求
+
+        Args:
+            input_path: 请求描述的JSONL文件
+            output_path: 结果JSONL文件
+            resume: 是否跳过输出文件中已有结果的请求，为False时覆盖输出文件
+
+        Returns:
+            dict: {'skipped': 跳过数, 'sent': 发送数, 'errors': 失败数}
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        skipped = count_results(output_path) if resume else 0
+        summary = {'skipped': skipped, 'sent': 0, 'errors': 0}
+        pending = deque()
+
+        def write_oldest():
+            record = pending.popleft().result()
+            output.write(json.dumps(record, ensure_ascii=False) + '\n')
+            summary['sent'] += 1
+            if record.get('error') or record['status'] is None:
+                summary['errors'] += 1
+
+        with open(input_path, encoding='utf-8') as source, \
+                open(output_path, 'a' if resume else 'w', encoding='utf-8') as output, \
+                ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for line, text in enumerate(iter_lines(source)):
+                if line < skipped:
+                    continue
+                if len(pending) >= self.window:
+                    write_oldest()
+                pending.append(executor.submit(self.run_one, line, text))
+            while pending:
+                write_oldest()
+        return summary
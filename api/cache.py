@@ -0,0 +1,488 @@
+"""
+HTTP响应缓存模块
+
+按Cache-Control、Expires、ETag和Last-Modified缓存GET/HEAD请求的响应。内存中按LRU淘汰并限制总大小，
+可选地写入磁盘目录。未过期的缓存直接返回，不访问网络；过期但有校验信息的缓存通过条件请求重新验证。
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from datetime import timedelta
+
+CACHE_HIT = 'hit'
+CACHE_REVALIDATED = 'revalidated'
+CACHE_MISS = 'miss'
+
+# 可以缓存的请求方法和响应状态码
+CACHEABLE_METHODS = ('GET', 'HEAD')
+CACHEABLE_STATUS = (200, 203, 204, 300, 301, 404, 410)
+# 304响应中不能用来更新缓存条目的头：描述响应体的头和逐跳头
+NOT_UPDATED_HEADERS = frozenset(('content-length', 'content-encoding', 'transfer-encoding', 'content-range',
+                                 'connection', 'keep-alive', 'proxy-connection', 'te', 'trailer', 'upgrade'))
+
+
+def parse_cache_control(value):
+    """解析Cache-Control头
+
+    Args:
+        value: Cache-Control头的值或None
+
+    Returns:
+        dict: 指令名(小写)到值的映射，没有值的指令为True
+    """
+    directives = {}
+    for part in (value or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, arg = part.partition('=')
+        directives[name.strip().lower()] = arg.strip().strip('"') if arg else True
+    return directives
+
+
+def _header(headers, name):
+    """忽略大小写获取头的值
+
+    Args:
+        headers: 头字典
+        name: 头名称
+
+    Returns:
+        str: 头的值或None
+    """
+    name = name.lower()
+    for k, v in headers.items():
+        if k.lower() == name:
+            return v
+    return None
+
+
+def _parse_seconds(value):
+    """解析秒数
+
+    Args:
+        value: 字符串形式的秒数
+
+    Returns:
+        int: 秒数，无法解析时为None
+    """
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_http_date(value):
+    """解析HTTP日期
+
+    Args:
+        value: HTTP日期字符串
+
+    Returns:
+        float: 时间戳，无法解析时为None
+    """
+    from email.utils import parsedate_to_datetime
+
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+class CacheEntry:
+    """缓存条目
+
+    Attributes:
+        status_code: 响应状态码
+        reason: 响应状态描述
+        headers: 响应头字典
+        content: 响应体bytes
+        url: 响应URL
+        vary: Vary头指定的请求头及其请求时的值
+        stored_at: 存入或最近一次验证的时间戳
+    """
+
+    def __init__(self, status_code, reason, headers, content, url, vary=None, stored_at=None):
+        """初始化缓存条目
+
+        Args:
+            status_code: 响应状态码
+            reason: 响应状态描述
+            headers: 响应头字典
+            content: 响应体bytes
+            url: 响应URL
+            vary: {请求头名: 值}字典
+            stored_at: 时间戳，默认为当前时间
+        """
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = dict(headers)
+        self.content = content
+        self.url = url
+        self.vary = vary or {}
+        self.stored_at = stored_at or time.time()
+
+    @classmethod
+    def from_response(cls, resp, request_headers):
+        """从响应创建缓存条目
+
+        Args:
+            resp: requests.Response对象
+            request_headers: 请求头
+
+        Returns:
+            CacheEntry: 缓存条目
+        """
+        vary = {}
+        for name in resp.headers.get('Vary', '').split(','):
+            name = name.strip().lower()
+            if name:
+                vary[name] = _header(request_headers, name)
+        return cls(resp.status_code, resp.reason, resp.headers, resp.content, resp.url, vary)
+
+    def size(self):
+        """获取条目占用的大致字节数
+
+        Returns:
+            int: 字节数
+        """
+        return len(self.content) + sum(len(k) + len(str(v)) for k, v in self.headers.items())
+
+    def get_header(self, name):
+        """忽略大小写获取响应头
+
+        Args:
+            name: 头名称
+
+        Returns:
+            str: 头的值或None
+        """
+        return _header(self.headers, name)
+
+    def freshness_lifetime(self):
+        """计算新鲜期
+
+        Returns:
+            float: 新鲜期(秒)，no-cache时为0
+        """
+        directives = parse_cache_control(self.get_header('Cache-Control'))
+        if 'no-cache' in directives:
+            return 0
+        if 'max-age' in directives:
+            return _parse_seconds(directives['max-age']) or 0
+        expires = _parse_http_date(self.get_header('Expires'))
+        date = _parse_http_date(self.get_header('Date')) or self.stored_at
+        if expires is not None:
+            return max(0, expires - date)
+        return 0
+
+    def age(self):
+        """计算缓存年龄
+
+        Returns:
+            float: 年龄(秒)，包括服务端Age头的值
+        """
+        return time.time() - self.stored_at + (_parse_seconds(self.get_header('Age')) or 0)
+
+    def is_fresh(self):
+        """是否在新鲜期内
+
+        Returns:
+            bool: 新鲜返回True
+        """
+        return self.age() < self.freshness_lifetime()
+
+    def matches(self, request_headers):
+        """请求头是否与Vary记录的值一致
+
+        Args:
+            request_headers: 请求头
+
+        Returns:
+            bool: 一致返回True
+        """
+        if not self.vary:
+            return True
+        if '*' in self.vary:
+            return False
+        return all(_header(request_headers, name) == value for name, value in self.vary.items())
+
+    def to_response(self):
+        """还原为requests.Response对象
+
+        Returns:
+            requests.Response: 响应对象
+        """
+        import requests
+        from requests.structures import CaseInsensitiveDict
+
+        resp = requests.Response()
+        resp.status_code = self.status_code
+        resp.reason = self.reason
+        resp.headers = CaseInsensitiveDict(self.headers)
+        resp.url = self.url
+        resp.encoding = requests.utils.get_encoding_from_headers(resp.headers)
+        resp._content = self.content
+        resp._content_consumed = True
+        resp.elapsed = timedelta(0)
+        return resp
+
+    def to_dict(self):
+        """序列化元数据
+
+        Returns:
+            dict: 不包括响应体的元数据
+        """
+        return {
+            'status_code': self.status_code,
+            'reason': self.reason,
+            'headers': self.headers,
+            'url': self.url,
+            'vary': self.vary,
+            'stored_at': self.stored_at
+        }
+
+
+class ResponseCache:
+    """HTTP响应缓存
+
+    内存层按LRU淘汰，条目数和总字节数都有上限；设置directory时同时写入磁盘，内存未命中时从磁盘读取。线程安全。
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024, directory=None):
+        """初始化响应缓存
+
+        Args:
+            max_entries: 内存中最多缓存的条目数
+            max_bytes: 内存中缓存的最大总字节数
+            directory: 磁盘缓存目录，为None时不使用磁盘
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.__entries = OrderedDict()
+        self.__bytes = 0
+        self.__lock = threading.Lock()
+        _caches.add(self)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        return len(self.__entries)
+
+    @staticmethod
+    def key(snapshot):
+        """计算请求的缓存键
+
+        Args:
+            snapshot: RequestSnapshot对象
+
+        Returns:
+            str: 缓存键
+        """
+        return f'{snapshot.method.upper()} {snapshot.url}'
+
+    @staticmethod
+    def is_cacheable(snapshot):
+        """请求是否可以使用缓存
+
+        Args:
+            snapshot: RequestSnapshot对象
+
+        Returns:
+            bool: 可以缓存返回True
+        """
+        if snapshot.method.upper() not in CACHEABLE_METHODS or snapshot.stream:
+            return False
+        directives = parse_cache_control(_header(snapshot.headers, 'Cache-Control'))
+        return 'no-store' not in directives
+
+    def __path(self, key):
+        """计算磁盘缓存文件路径(不含扩展名)
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            str: 文件路径
+        """
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest())
+
+    def get(self, key):
+        """获取缓存条目
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            CacheEntry: 缓存条目，不存在时为None
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                self.__entries.move_to_end(key)
+                return entry
+        if not self.directory:
+            return None
+        path = self.__path(key)
+        try:
+            with open(path + '.json', encoding='utf-8') as meta_file:
+                meta = json.load(meta_file)
+            with open(path + '.body', 'rb') as body_file:
+                content = body_file.read()
+        except (OSError, ValueError):
+            return None
+        entry = CacheEntry(content=content, **meta)
+        self.__put_memory(key, entry)
+        return entry
+
+    def put(self, key, entry):
+        """存入缓存条目
+
+        Args:
+            key: 缓存键
+            entry: CacheEntry对象
+        """
+        self.__put_memory(key, entry)
+        if self.directory:
+            path = self.__path(key)
+            with open(path + '.body', 'wb') as body_file:
+                body_file.write(entry.content)
+            with open(path + '.json', 'w', encoding='utf-8') as meta_file:
+                json.dump(entry.to_dict(), meta_file)
+
+    def __put_memory(self, key, entry):
+        """存入内存层并按LRU淘汰
+
+        Args:
+            key: 缓存键
+            entry: CacheEntry对象
+        """
+        size = entry.size()
+        if size > self.max_bytes:
+            return
+        with self.__lock:
+            old = self.__entries.pop(key, None)
+            if old is not None:
+                self.__bytes -= old.size()
+            self.__entries[key] = entry
+            self.__bytes += size
+            while len(self.__entries) > self.max_entries or self.__bytes > self.max_bytes:
+                _, evicted = self.__entries.popitem(last=False)
+                self.__bytes -= evicted.size()
+
+    def remove(self, key):
+        """删除缓存条目
+
+        Args:
+            key: 缓存键
+        """
+        with self.__lock:
+            old = self.__entries.pop(key, None)
+            if old is not None:
+                self.__bytes -= old.size()
+        if self.directory:
+            for ext in ('.json', '.body'):
+                try:
+                    os.remove(self.__path(key) + ext)
+                except OSError:
+                    pass
+
+    def clear(self):
+        """清空内存和磁盘缓存"""
+        with self.__lock:
+            self.__entries.clear()
+            self.__bytes = 0
+        if self.directory:
+            for name in os.listdir(self.directory):
+                if name.endswith(('.json', '.body')):
+                    os.remove(os.path.join(self.directory, name))
+
+    def lookup(self, snapshot):
+        """查找请求对应的缓存
+
+        Args:
+            snapshot: RequestSnapshot对象
+
+        Returns:
+            tuple: (CacheEntry或None, 是否新鲜)
+        """
+        entry = self.get(self.key(snapshot))
+        if entry is None or not entry.matches(snapshot.headers):
+            return None, False
+        request_directives = parse_cache_control(_header(snapshot.headers, 'Cache-Control'))
+        if 'no-cache' in request_directives:
+            return entry, False
+        return entry, entry.is_fresh()
+
+    @staticmethod
+    def conditional(snapshot, entry):
+        """为过期的缓存生成条件请求
+
+        Args:
+            snapshot: RequestSnapshot对象
+            entry: 过期的CacheEntry对象或None
+
+        Returns:
+            RequestSnapshot: 加上If-None-Match/If-Modified-Since头的快照，没有校验信息时为原快照
+        """
+        if entry is None:
+            return snapshot
+        headers = dict(snapshot.headers)
+        if entry.get_header('ETag'):
+            headers['If-None-Match'] = entry.get_header('ETag')
+        if entry.get_header('Last-Modified'):
+            headers['If-Modified-Since'] = entry.get_header('Last-Modified')
+        if len(headers) == len(snapshot.headers):
+            return snapshot
+        return snapshot._replace(headers=headers)
+
+    def update(self, snapshot, entry, resp):
+        """根据网络响应更新缓存
+
+        Args:
+            snapshot: 原始RequestSnapshot对象
+            entry: 发送请求前找到的CacheEntry对象或None
+            resp: 网络响应
+
+        Returns:
+            tuple: (返回给调用方的requests.Response, 缓存状态)
+        """
+        key = self.key(snapshot)
+        if resp.status_code == 304 and entry is not None:
+            # 重新验证成功，用304中的头更新缓存并返回缓存内容，描述响应体的头和逐跳头不更新(RFC 9111 3.2)
+            headers = dict(entry.headers)
+            headers.update((name, value) for name, value in resp.headers.items()
+                           if name.lower() not in NOT_UPDATED_HEADERS)
+            refreshed = CacheEntry(entry.status_code, entry.reason, headers, entry.content, entry.url, entry.vary)
+            self.put(key, refreshed)
+            return refreshed.to_response(), CACHE_REVALIDATED
+        directives = parse_cache_control(resp.headers.get('Cache-Control'))
+        if resp.status_code in CACHEABLE_STATUS and 'no-store' not in directives:
+            new_entry = CacheEntry.from_response(resp, snapshot.headers)
+            if new_entry.freshness_lifetime() > 0 or new_entry.get_header('ETag') \
+                    or new_entry.get_header('Last-Modified'):
+                self.put(key, new_entry)
+        return resp, CACHE_MISS
+
+    def _reset_after_fork(self):
+        """在fork出的子进程中重新创建锁，fork时其他线程可能正持有锁"""
+        self.__lock = threading.Lock()
+
+
+# 所有ResponseCache，fork后在子进程中重置
+_caches = weakref.WeakSet()
+
+
+def _reset_caches_after_fork():
+    for cache in list(_caches):
+        cache._reset_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_caches_after_fork)
@@ -0,0 +1,286 @@
+"""
+录制回放模块
+
+录制模式下把Api发出的每个请求及其响应追加写入磁带文件(每行一个JSON)；回放模式下从内存索引中按请求查找响应，
+不访问网络，测试可以离线、快速、可重复地执行请求链。
+
+同一个请求录制了多次(例如重试)时按录制顺序回放，回放完后一直返回最后一次的响应，rewind()可以从头回放。
+"""
+
+import base64
+import hashlib
+import json
+import os
+import threading
+import weakref
+from contextlib import contextmanager
+
+# replay只回放，找不到时抛出CassetteMissError；record总是访问网络并录制；auto有录制的回放，没有的访问网络并录制
+MODE_REPLAY = 'replay'
+MODE_RECORD = 'record'
+MODE_AUTO = 'auto'
+CASSETTE_MODES = (MODE_REPLAY, MODE_RECORD, MODE_AUTO)
+
+
+class CassetteMissError(LookupError):
+    """回放模式下磁带中没有对应请求时抛出的异常"""
+
+
+def _body_digest(body):
+    """计算请求体摘要
+
+    Args:
+        body: 请求体
+
+    Returns:
+        str: sha256摘要，没有请求体时为''，流式请求体无法计算摘要时为None
+    """
+    if body is None or body == b'' or body == '':
+        return ''
+    if isinstance(body, str):
+        body = body.encode()
+    if isinstance(body, (bytes, bytearray)):
+        return hashlib.sha256(body).hexdigest()
+    if isinstance(body, dict):
+        return hashlib.sha256(json.dumps(body, sort_keys=True).encode()).hexdigest()
+    return None
+
+
+def _encode_content(content):
+    """把响应体编码为可写入JSON的形式
+
+    Args:
+        content: 响应体bytes
+
+    Returns:
+        dict: UTF-8文本为{'body': 文本}，否则为{'body_b64': base64文本}
+    """
+    try:
+        return {'body': content.decode('utf-8')}
+    except UnicodeDecodeError:
+        return {'body_b64': base64.b64encode(content).decode('ascii')}
+
+
+def _decode_content(response):
+    """还原响应体
+
+    Args:
+        response: 磁带中的响应字典
+
+    Returns:
+        bytes: 响应体
+    """
+    if 'body_b64' in response:
+        return base64.b64decode(response['body_b64'])
+    return response.get('body', '').encode('utf-8')
+
+
+class Cassette:
+    """录制回放磁带
+
+    磁带在内存中以请求键为索引，每次查找为O(1)。线程安全，同一个磁带可以在多个线程的请求链中共享。
+
+    Attributes:
+        path: 磁带文件路径，为None时只在内存中录制
+        mode: 'replay'、'record'或'auto'
+        match_headers: 参与匹配的请求头
+    """
+
+    def __init__(self, path=None, mode=MODE_REPLAY, match_headers=()):
+        """初始化磁带
+
+        Args:
+            path: 磁带文件路径，文件存在时加载其中的录制
+            mode: 'replay'、'record'或'auto'，默认为'replay'
+            match_headers: 参与匹配的请求头，默认只匹配方法、URL和请求体
+        """
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f'unknown cassette mode: {mode}')
+        self.path = path
+        self.mode = mode
+        self.match_headers = tuple(name.lower() for name in match_headers)
+        self.__index = {}
+        self.__cursors = {}
+        self.__lock = threading.Lock()
+        _cassettes.add(self)
+        if path and mode == MODE_RECORD:
+            # 重新录制，清空旧的磁带
+            open(path, 'w').close()
+        elif path and os.path.exists(path):
+            self.load(path)
+
+    def __len__(self):
+        return sum(len(interactions) for interactions in self.__index.values())
+
+    def key(self, method, url, headers, body_digest):
+        """计算请求键
+
+        Args:
+            method: HTTP方法
+            url: 完整URL
+            headers: 请求头字典
+            body_digest: 请求体摘要
+
+        Returns:
+            tuple: 请求键
+        """
+        lowered = {name.lower(): value for name, value in headers.items()} if self.match_headers else {}
+        return (method.upper(), url, body_digest) + tuple(lowered.get(name) for name in self.match_headers)
+
+    def __snapshot_key(self, snapshot):
+        """计算请求快照的键"""
+        return self.key(snapshot.method, snapshot.url, snapshot.headers, _body_digest(snapshot.body))
+
+    def load(self, path):
+        """加载磁带文件
+
+        Args:
+            path: 磁带文件路径
+        """
+        with open(path, encoding='utf-8') as file:
+            for line in file:
+                if line.strip():
+                    self.__add(json.loads(line))
+
+    def __add(self, interaction):
+        """把一条录制加入索引
+
+        Args:
+            interaction: {'request': ..., 'response': ...}字典
+        """
+        request = interaction['request']
+        key = self.key(request['method'], request['url'], request.get('headers', {}), request.get('body_sha256'))
+        with self.__lock:
+            self.__index.setdefault(key, []).append(interaction['response'])
+
+    def rewind(self):
+        """从头开始回放"""
+        with self.__lock:
+            self.__cursors.clear()
+
+    def play(self, snapshot):
+        """查找请求对应的录制响应
+
+        Args:
+            snapshot: RequestSnapshot对象
+
+        Returns:
+            requests.Response: 录制的响应，没有录制或为record模式时为None
+
+        Raises:
+            CassetteMissError: replay模式下没有对应的录制
+        """
+        if self.mode == MODE_RECORD:
+            return None
+        key = self.__snapshot_key(snapshot)
+        with self.__lock:
+            responses = self.__index.get(key)
+            if responses:
+                cursor = self.__cursors.get(key, 0)
+                self.__cursors[key] = cursor + 1
+                response = responses[min(cursor, len(responses) - 1)]
+        if not responses:
+            if self.mode == MODE_REPLAY:
+                raise CassetteMissError(f'no recorded response for {snapshot.method.upper()} {snapshot.url}')
+            return None
+        return self.to_response(response)
+
+    def record(self, snapshot, resp):
+        """录制一次请求，会读取完整的响应体
+
+        Args:
+            snapshot: RequestSnapshot对象
+            resp: requests.Response对象
+        """
+        if self.mode == MODE_REPLAY:
+            return
+        headers = dict(snapshot.headers)
+        request = {'method': snapshot.method.upper(), 'url': snapshot.url, 'body_sha256': _body_digest(snapshot.body)}
+        if self.match_headers:
+            request['headers'] = {name: value for name, value in headers.items()
+                                  if name.lower() in self.match_headers}
+        response = {'status': resp.status_code, 'reason': resp.reason, 'url': resp.url,
+                    'headers': dict(resp.headers), **_encode_content(resp.content)}
+        interaction = {'request': request, 'response': response}
+        self.__add(interaction)
+        if self.path:
+            line = json.dumps(interaction, ensure_ascii=False, separators=(',', ':')) + '\n'
+            with self.__lock:
+                with open(self.path, 'a', encoding='utf-8') as file:
+                    file.write(line)
+
+    @staticmethod
+    def to_response(response):
+        """把录制的响应还原为requests.Response对象
+
+        Args:
+            response: 磁带中的响应字典
+
+        Returns:
+            requests.Response: 响应对象
+        """
+        from datetime import timedelta
+
+        import requests
+        from requests.structures import CaseInsensitiveDict
+
+        resp = requests.Response()
+        resp.status_code = response['status']
+        resp.reason = response.get('reason')
+        resp.headers = CaseInsensitiveDict(response.get('headers', {}))
+        resp.url = response.get('url')
+        resp.encoding = requests.utils.get_encoding_from_headers(resp.headers)
+        resp._content = _decode_content(response)
+        resp._content_consumed = True
+        resp.elapsed = timedelta(0)
+        return resp
+
+    def _reset_after_fork(self):
+        """在fork出的子进程中重新创建锁，fork时其他线程可能正持有锁"""
+        self.__lock = threading.Lock()
+
+
+# 所有Cassette，fork后在子进程中重置
+_cassettes = weakref.WeakSet()
+
+
+def _reset_cassettes_after_fork():
+    for cassette in list(_cassettes):
+        cassette._reset_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_cassettes_after_fork)
+
+
+_active = None
+
+
+def get_active():
+    """获取当前全局生效的磁带
+
+    Returns:
+        Cassette: 磁带，没有时为None
+    """
+    return _active
+
+
+@contextmanager
+def use(path=None, mode=MODE_REPLAY, match_headers=()):
+    """在with块内让所有没有单独设置磁带的Api使用同一个磁带
+
+    Args:
+        path: 磁带文件路径或Cassette对象
+        mode: 'replay'、'record'或'auto'
+        match_headers: 参与匹配的请求头
+
+    Yields:
+        Cassette: 生效的磁带
+    """
+    global _active
+    cassette = path if isinstance(path, Cassette) else Cassette(path, mode, match_headers)
+    previous, _active = _active, cassette
+    try:
+        yield cassette
+    finally:
+        _active = previous
@@ -0,0 +1,137 @@
+"""
+JSON编解码模块
+
+提供可替换的JSON编解码器，安装了orjson或ujson时可以使用它们，否则使用标准库json。
+编码结果直接为bytes，可以作为请求体发送，不需要中间的str。
+"""
+
+import json
+
+
+class JsonCodec:
+    """JSON编解码器接口
+
+    Attributes:
+        name: 编解码器名称
+    """
+    name = None
+
+    def dumps(self, obj):
+        """编码为JSON
+
+        Args:
+            obj: 要编码的对象
+
+        Returns:
+            bytes: UTF-8编码的JSON
+        """
+        raise NotImplementedError
+
+    def loads(self, data):
+        """解析JSON
+
+        Args:
+            data: bytes或str形式的JSON
+
+        Returns:
+            解析得到的对象
+        """
+        raise NotImplementedError
+
+
+class StdlibCodec(JsonCodec):
+    """标准库json编解码器，输出与json.dumps默认参数一致"""
+    name = 'json'
+
+    def dumps(self, obj):
+        return json.dumps(obj).encode()
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonCodec(JsonCodec):
+    """orjson编解码器，输出紧凑格式的UTF-8 JSON"""
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self.__orjson = orjson
+
+    def dumps(self, obj):
+        return self.__orjson.dumps(obj)
+
+    def loads(self, data):
+        return self.__orjson.loads(data)
+
+
+class UjsonCodec(JsonCodec):
+    """ujson编解码器"""
+    name = 'ujson'
+
+    def __init__(self):
+        import ujson
+        self.__ujson = ujson
+
+    def dumps(self, obj):
+        return self.__ujson.dumps(obj, ensure_ascii=False).encode()
+
+    def loads(self, data):
+        return self.__ujson.loads(data)
+
+
+CODEC_CLASSES = {codec_class.name: codec_class for codec_class in (OrjsonCodec, UjsonCodec, StdlibCodec)}
+# 'auto'按顺序选择第一个已安装的编解码器
+AUTO_ORDER = ('orjson', 'ujson', 'json')
+
+_codecs = {}
+_default_codec = StdlibCodec()
+
+
+def get_codec(codec=None):
+    """获取编解码器
+
+    Args:
+        codec: JsonCodec对象、名称('json'/'orjson'/'ujson'/'auto')或None(默认编解码器)
+
+    Returns:
+        JsonCodec: 编解码器
+
+    Raises:
+        ImportError: 指定的编解码器未安装
+        ValueError: 未知的编解码器名称
+    """
+    if codec is None:
+        return _default_codec
+    if isinstance(codec, JsonCodec):
+        return codec
+    if codec == 'auto':
+        for name in AUTO_ORDER:
+            try:
+                return get_codec(name)
+            except ImportError:
+                continue
+    if codec not in CODEC_CLASSES:
+        raise ValueError(f'unknown json codec: {codec}')
+    if codec not in _codecs:
+        _codecs[codec] = CODEC_CLASSES[codec]()
+    return _codecs[codec]
+
+
+def set_default_codec(codec):
+    """设置全局默认的编解码器
+
+    Args:
+        codec: JsonCodec对象或名称('json'/'orjson'/'ujson'/'auto')
+    """
+    global _default_codec
+    _default_codec = get_codec(codec)
+
+
+def get_default_codec():
+    """获取全局默认的编解码器
+
+    Returns:
+        JsonCodec: 编解码器
+    """
+    return _default_codec
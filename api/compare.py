@@ -0,0 +1,266 @@
+"""
+多环境比较模块
+
+把同一个请求链同时发送到多个环境(例如开发、预发布和生产)，按环境顺序返回结果，
+并与第一个环境比较状态码、耗时和响应体，验证一次部署只需要一轮请求的时间。
+"""
+
+import hashlib
+import time
+
+# 每个环境最多报告的响应体差异条数
+MAX_DIFFERENCES = 50
+
+
+def _json_or_none(resp):
+    """解析JSON响应体
+
+    Args:
+        resp: requests.Response对象
+
+    Returns:
+        tuple: (是否为JSON, 解析结果)
+    """
+    try:
+        return True, resp.json()
+    except ValueError:
+        return False, None
+
+
+def diff_json(left, right, path='$', ignore=(), limit=MAX_DIFFERENCES):
+    """比较两个JSON值
+
+    Args:
+        left: 基准值
+        right: 比较值
+        path: 当前JSON路径
+        ignore: 忽略的JSON路径
+        limit: 最多返回的差异条数
+
+    Returns:
+        list: 差异列表，每项为{'path', 'kind'('added'/'removed'/'changed'), 'baseline', 'value'}
+    """
+    differences = []
+
+    def walk(a, b, current):
+        if len(differences) >= limit or current in ignore:
+            return
+        if isinstance(a, dict) and isinstance(b, dict):
+            for key in a:
+                if key not in b:
+                    if f'{current}.{key}' not in ignore:
+                        differences.append({'path': f'{current}.{key}', 'kind': 'removed', 'baseline': a[key],
+                                            'value': None})
+                else:
+                    walk(a[key], b[key], f'{current}.{key}')
+            for key in b:
+                if key not in a and f'{current}.{key}' not in ignore:
+                    differences.append({'path': f'{current}.{key}', 'kind': 'added', 'baseline': None,
+                                        'value': b[key]})
+        elif isinstance(a, list) and isinstance(b, list):
+            for index in range(max(len(a), len(b))):
+                item_path = f'{current}[{index}]'
+                if index >= len(b):
+                    differences.append({'path': item_path, 'kind': 'removed', 'baseline': a[index], 'value': None})
+                elif index >= len(a):
+                    differences.append({'path': item_path, 'kind': 'added', 'baseline': None, 'value': b[index]})
+                else:
+                    walk(a[index], b[index], item_path)
+        elif a != b or type(a) is not type(b):
+            differences.append({'path': current, 'kind': 'changed', 'baseline': a, 'value': b})
+
+    walk(left, right, path)
+    return differences[:limit]
+
+
+def diff_responses(baseline, other, ignore=()):
+    """比较两个响应
+
+    Args:
+        baseline: 基准环境的requests.Response或ResponseSummary对象
+        other: 比较环境的requests.Response或ResponseSummary对象
+        ignore: 忽略的JSON路径
+
+    Returns:
+        dict: {'status': (基准状态码, 状态码)或None, 'body': 响应体差异列表或None, 'same': 是否相同}
+    """
+    status = None
+    if baseline.status_code != other.status_code:
+        status = (baseline.status_code, other.status_code)
+    if not hasattr(baseline, 'content') or not hasattr(other, 'content'):
+        # 按保留策略精简过的响应只能比较摘要
+        baseline_digest, other_digest = getattr(baseline, 'digest', None), getattr(other, 'digest', None)
+        body = None if baseline_digest == other_digest else [
+            {'path': '$', 'kind': 'changed', 'baseline': baseline_digest, 'value': other_digest}]
+        return {'status': status, 'body': body, 'same': status is None and body is None}
+    baseline_is_json, baseline_json = _json_or_none(baseline)
+    other_is_json, other_json = _json_or_none(other)
+    if baseline_is_json and other_is_json:
+        body = diff_json(baseline_json, other_json, ignore=ignore) or None
+    elif baseline.content != other.content:
+        body = [{'path': '$', 'kind': 'changed', 'baseline': hashlib.sha256(baseline.content).hexdigest(),
+                 'value': hashlib.sha256(other.content).hexdigest()}]
+    else:
+        body = None
+    return {'status': status, 'body': body, 'same': status is None and body is None}
+
+
+class EnvResult:
+    """一个环境的结果
+
+    Attributes:
+        env: Env对象
+        results: 请求链每一步的ApiResult，出错时为出错前已完成的步骤
+        error: 发送时抛出的异常
+        elapsed: 整个请求链的耗时(秒)
+    """
+
+    def __init__(self, env, results=None, error=None, elapsed=0.0):
+        self.env = env
+        self.results = results or []
+        self.error = error
+        self.elapsed = elapsed
+
+    def get_responses(self):
+        """获取每一步的响应
+
+        Returns:
+            list: 每一步的响应列表，请求组为各成员的响应，单个请求为只有一个响应的列表
+        """
+        steps = []
+        for result in self.results:
+            resp = result.get_resp()
+            steps.append(list(resp) if isinstance(resp, list) else [resp])
+        return steps
+
+
+class Comparison:
+    """多环境比较结果
+
+    第一个环境为基准，其余环境按请求链的步骤与它逐个比较响应
+    """
+
+    def __init__(self, results, ignore=()):
+        """初始化比较结果
+
+        Args:
+            results: 按环境顺序排列的EnvResult列表
+            ignore: 比较响应体时忽略的JSON路径
+        """
+        self.__results = results
+        self.__ignore = tuple(ignore)
+
+    def get_results(self):
+        """获取每个环境的结果
+
+        Returns:
+            list: 与envs顺序一致的EnvResult列表
+        """
+        return self.__results
+
+    def get_baseline(self):
+        """获取基准环境的结果
+
+        Returns:
+            EnvResult: 第一个环境的结果
+        """
+        return self.__results[0]
+
+    def get_latency_deltas(self):
+        """获取每个环境相对基准的耗时差
+
+        Returns:
+            list: 耗时差(秒)，正数表示比基准慢
+        """
+        baseline = self.get_baseline().elapsed
+        return [each.elapsed - baseline for each in self.__results]
+
+    def get_diffs(self):
+        """获取每个环境相对基准的响应差异
+
+        Returns:
+            list: 每个环境的差异列表，只包括不同的响应，每项为diff_responses的结果加上step和index，
+                基准环境为空列表。某一步只在一边有响应时status和body为None
+        """
+        baseline = self.get_baseline().get_responses()
+        diffs = []
+        for each in self.__results:
+            items = []
+            if each is not self.get_baseline():
+                steps = each.get_responses()
+                for step in range(max(len(baseline), len(steps))):
+                    base_step = baseline[step] if step < len(baseline) else []
+                    this_step = steps[step] if step < len(steps) else []
+                    for index in range(max(len(base_step), len(this_step))):
+                        base = base_step[index] if index < len(base_step) else None
+                        resp = this_step[index] if index < len(this_step) else None
+                        if base is None or resp is None:
+                            item = {'status': None, 'body': None, 'same': base is resp}
+                        else:
+                            item = diff_responses(base, resp, self.__ignore)
+                        if not item['same']:
+                            items.append({'step': step, 'index': index, **item})
+            diffs.append(items)
+        return diffs
+
+    def is_consistent(self):
+        """所有环境是否都发送成功且响应与基准一致
+
+        Returns:
+            bool: 一致返回True
+        """
+        if any(each.error is not None for each in self.__results):
+            return False
+        return not any(self.get_diffs())
+
+    def summary(self):
+        """生成比较摘要
+
+        Returns:
+            dict: 每个环境的地址、每一步的状态码、耗时、耗时差、错误和响应差异，以及整体是否一致
+        """
+        deltas = self.get_latency_deltas()
+        diffs = self.get_diffs()
+        return {
+            'consistent': not any(diffs) and all(each.error is None for each in self.__results),
+            'envs': [{
+                'env': each.env.get_env(),
+                'status': [[getattr(resp, 'status_code', None) for resp in step] for step in each.get_responses()],
+                'elapsed': each.elapsed,
+                'delta': delta,
+                'error': repr(each.error) if each.error is not None else None,
+                'diff': diff
+            } for each, delta, diff in zip(self.__results, deltas, diffs)]
+        }
+
+
+def fan_out(api, envs, max_workers=None, ignore=()):
+    """把请求链同时发送到多个环境
+
+    Args:
+        api: 请求链的第一个Api，作为模板不会被修改
+        envs: Env对象列表，第一个作为基准
+        max_workers: 并发数，默认为环境个数
+        ignore: 比较响应体时忽略的JSON路径
+
+    Returns:
+        Comparison: 比较结果
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if not envs:
+        raise ValueError('fan_out requires at least one env')
+
+    def run(env):
+        chain = api.for_env(env)
+        steps = []
+        start = time.perf_counter()
+        try:
+            chain.send(step_results=steps)
+        except Exception as e:
+            return EnvResult(env, steps, e, time.perf_counter() - start)
+        return EnvResult(env, steps, elapsed=time.perf_counter() - start)
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(envs)) as executor:
+        results = list(executor.map(run, envs))
+    return Comparison(results, ignore)
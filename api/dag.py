@@ -0,0 +1,323 @@
+"""
+依赖图调度模块
+
+把then()构建的请求链或显式声明了依赖的Api集合编译为有向无环图，
+依赖全部完成的节点立即发送，同时发送的个数受全局并发数限制，并统计关键路径耗时。
+"""
+
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from api.api import GROUP_MODE_COLLECT_ALL, merge_results
+
+
+class DagNode:
+    """依赖图节点
+
+    Attributes:
+        api: 要发送的Api对象，为None时表示合并请求组结果的节点
+        depends_on: 依赖的节点列表，顺序即合并结果的顺序
+        collect_all: 合并节点是否允许依赖失败(请求组的collect_all模式)
+        result: 节点结果ApiResult
+        error: 节点发送失败时的异常
+        start: 相对调度开始的开始时间(秒)
+        end: 相对调度开始的结束时间(秒)
+    """
+
+    def __init__(self, api, depends_on, collect_all=False):
+        """初始化节点
+
+        Args:
+            api: Api对象或None
+            depends_on: 依赖的节点列表
+            collect_all: 是否允许依赖失败
+        """
+        self.api = api
+        self.depends_on = depends_on
+        self.collect_all = collect_all
+        self.result = None
+        self.error = None
+        self.start = None
+        self.end = None
+
+    def get_duration(self):
+        """获取节点耗时
+
+        Returns:
+            float: 耗时(秒)，未执行时为None
+        """
+        if self.start is None or self.end is None:
+            return None
+        return self.end - self.start
+
+
+class DagResult:
+    """依赖图执行结果
+
+    Attributes:
+        __nodes: 所有节点
+        __elapsed: 总耗时(秒)
+    """
+
+    def __init__(self, nodes, elapsed):
+        """初始化执行结果
+
+        Args:
+            nodes: 节点列表
+            elapsed: 总耗时(秒)
+        """
+        self.__nodes = nodes
+        self.__elapsed = elapsed
+
+    def get_nodes(self):
+        """获取所有节点
+
+        Returns:
+            list: DagNode列表
+        """
+        return self.__nodes
+
+    def get_result(self, api):
+        """获取某个Api的结果
+
+        Args:
+            api: Api对象
+
+        Returns:
+            ApiResult: 该Api的请求结果，Api出现多次时为第一个节点的结果，不在图中时为None
+        """
+        for node in self.__nodes:
+            if node.api is api:
+                return node.result
+        return None
+
+    def get_elapsed(self):
+        """获取总耗时
+
+        Returns:
+            float: 总耗时(秒)
+        """
+        return self.__elapsed
+
+    def get_critical_path(self):
+        """获取关键路径
+
+        从最后完成的节点开始，每一步回溯到最后完成的依赖，即决定总耗时的节点序列
+
+        Returns:
+            list: 按执行顺序排列的Api节点(DagNode)列表
+        """
+        finished = [node for node in self.__nodes if node.end is not None]
+        if not finished:
+            return []
+        node = max(finished, key=lambda each: each.end)
+        path = []
+        while node:
+            if node.api is not None:
+                path.append(node)
+            finished_deps = [dep for dep in node.depends_on if dep.end is not None]
+            node = max(finished_deps, key=lambda each: each.end) if finished_deps else None
+        path.reverse()
+        return path
+
+    def get_critical_path_time(self):
+        """获取关键路径上各请求耗时之和
+
+        Returns:
+            float: 耗时(秒)
+        """
+        return sum(node.get_duration() for node in self.get_critical_path())
+
+
+class Dag:
+    """请求依赖图
+
+    add()添加的每个Api只对应一个节点，只会发送一次；from_chain()按请求链中的位置建立节点，
+    同一个Api在请求链中出现多次时每次都是一个节点，与send()一样发送多次。节点的上一步结果为：没有依赖时是Api自身的prev_result，
+    一个依赖时是该依赖的结果，多个依赖时按声明顺序合并(与请求组的合并方式相同)。
+    """
+
+    def __init__(self):
+        """初始化空的依赖图"""
+        self.__nodes = []
+        self.__api_nodes = {}
+
+    def add(self, api, depends_on=None):
+        """添加一个Api节点
+
+        依赖必须先于自身添加，因此图中不会出现环
+
+        Args:
+            api: Api对象
+            depends_on: 依赖的Api对象列表
+
+        Returns:
+            self: 支持链式调用
+
+        Raises:
+            ValueError: Api已添加或依赖的Api未添加
+        """
+        dep_nodes = []
+        for dep in depends_on or []:
+            if id(dep) not in self.__api_nodes:
+                raise ValueError(f'dependency {dep.get_desc()} must be added before the api depending on it')
+            dep_nodes.append(self.__api_nodes[id(dep)])
+        self.__add_node(api, dep_nodes)
+        return self
+
+    def __add_node(self, api, dep_nodes, unique=True):
+        """添加节点
+
+        Args:
+            api: Api对象
+            dep_nodes: 依赖的节点列表
+            unique: 为True时Api只能添加一次，为False时按位置建立节点，同一个Api可以对应多个节点
+
+        Returns:
+            DagNode: 新节点
+        """
+        if unique and id(api) in self.__api_nodes:
+            raise ValueError(f'api {api.get_desc()} is already in the graph')
+        node = DagNode(api, dep_nodes)
+        self.__nodes.append(node)
+        self.__api_nodes.setdefault(id(api), node)
+        return node
+
+    def __add_step(self, api, upstream, pending):
+        """添加一个Api及其请求组
+
+        Args:
+            api: Api对象
+            upstream: 上一步的输出节点或None
+            pending: 待处理的(后续Api, 上一步输出节点)队列
+
+        Returns:
+            DagNode: 本步的输出节点，有请求组时为合并节点
+        """
+        # 请求链中的每个位置都是一个节点，例如then([api] * 5)发送5次
+        node = self.__add_node(api, [upstream] if upstream else [], unique=False)
+        output = node
+        if api.get_next_api_list():
+            member_outputs = [self.__add_step(member, node, pending) for member in api.get_next_api_list()]
+            output = DagNode(None, member_outputs, api.get_group_mode() == GROUP_MODE_COLLECT_ALL)
+            self.__nodes.append(output)
+        if api.get_next_api():
+            pending.append((api.get_next_api(), output))
+        return output
+
+    @classmethod
+    def from_chain(cls, api):
+        """把then()构建的请求链编译为依赖图
+
+        Args:
+            api: 请求链的第一个Api对象
+
+        Returns:
+            Dag: 依赖图
+        """
+        dag = cls()
+        pending = [(api, None)]
+        while pending:
+            each_api, upstream = pending.pop()
+            dag.__add_step(each_api, upstream, pending)
+        return dag
+
+    def __input_of(self, node):
+        """计算节点的上一步结果
+
+        Args:
+            node: DagNode对象
+
+        Returns:
+            ApiResult: 上一步结果
+        """
+        if not node.depends_on:
+            return node.api.get_prev_result() if node.api is not None else None
+        if len(node.depends_on) == 1 and node.api is not None:
+            return node.depends_on[0].result
+        errors = [(index, dep.error) for index, dep in enumerate(node.depends_on) if dep.error]
+        return merge_results([dep.result for dep in node.depends_on], errors)
+
+    def __send_node(self, node, origin):
+        """发送Api节点
+
+        Args:
+            node: DagNode对象
+            origin: 调度开始时间
+
+        Returns:
+            ApiResult: 请求结果
+        """
+        prev_result = self.__input_of(node)
+        node.start = time.perf_counter() - origin
+        try:
+            return node.api.send_single(prev_result)
+        finally:
+            node.end = time.perf_counter() - origin
+
+    def run(self, max_workers=8):
+        """执行依赖图
+
+        Args:
+            max_workers: 同时发送的请求个数上限
+
+        Returns:
+            DagResult: 执行结果
+
+        Raises:
+            Exception: 任一节点失败且没有以collect_all方式等待它的合并节点时，取消未开始的节点并抛出该异常
+        """
+        dependents = {id(node): [] for node in self.__nodes}
+        remaining = {}
+        for node in self.__nodes:
+            remaining[id(node)] = len(node.depends_on)
+            for dep in node.depends_on:
+                dependents[id(dep)].append(node)
+
+        origin = time.perf_counter()
+        ready = deque(node for node in self.__nodes if not node.depends_on)
+        running = {}
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            while ready or running:
+                while ready:
+                    node = ready.popleft()
+                    if node.api is None:
+                        # 合并节点不发送请求，直接合并依赖的结果
+                        node.start = node.end = max(dep.end for dep in node.depends_on)
+                        node.result = self.__input_of(node)
+                        self.__finish(node, dependents, remaining, ready)
+                    else:
+                        running[executor.submit(self.__send_node, node, origin)] = node
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    node = running.pop(future)
+                    if future.exception():
+                        node.error = future.exception()
+                        if not dependents[id(node)] or not all(each.collect_all for each in dependents[id(node)]):
+                            raise node.error
+                    else:
+                        node.result = future.result()
+                    self.__finish(node, dependents, remaining, ready)
+        except BaseException:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        executor.shutdown(wait=True)
+        return DagResult(self.__nodes, time.perf_counter() - origin)
+
+    def __finish(self, node, dependents, remaining, ready):
+        """标记节点完成，依赖全部完成的节点加入就绪队列
+
+        Args:
+            node: 完成的节点
+            dependents: 节点到依赖它的节点列表的映射
+            remaining: 节点到未完成依赖个数的映射
+            ready: 就绪队列
+        """
+        for each in dependents[id(node)]:
+            remaining[id(each)] -= 1
+            if remaining[id(each)] == 0:
+                ready.append(each)
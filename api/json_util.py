@@ -1,13 +1,50 @@
+"""
+JSON工具模块
+
+提供JSON美化输出和大列表的增量编码
+"""
+
 import json
 
+from api.codec import get_codec
 
-def format_json(inputs):
-    if isinstance(inputs, str):
-        return json.dumps(json.loads(inputs), indent=4, ensure_ascii=False)
+
+def format_json(inputs, codec=None):
+    if isinstance(inputs, (str, bytes)):
+        return json.dumps(get_codec(codec).loads(inputs), indent=4, ensure_ascii=False)
     else:
         return json.dumps(inputs, indent=4, ensure_ascii=False)
 
 
+def iter_json_array(records, chunk_size=64 * 1024, codec=None):
+    """把记录增量编码为JSON数组
+
+    逐条编码记录并按chunk_size合并为bytes数据块，不需要在内存中保存完整的列表和编码结果，
+    可以作为Api.body的流式请求体
+
+    Args:
+        records: 记录的可迭代对象，可以是生成器
+        chunk_size: 每个数据块的大致字节数
+        codec: JsonCodec对象或名称，默认为全局默认的编解码器
+
+    Yields:
+        bytes: JSON数组的一段
+    """
+    dumps = get_codec(codec).dumps
+    buffer = bytearray(b'[')
+    first = True
+    for record in records:
+        if not first:
+            buffer += b','
+        first = False
+        buffer += dumps(record)
+        if len(buffer) >= chunk_size:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += b']'
+    yield bytes(buffer)
+
+
 if __name__ == '__main__':
     print(format_json('{"test":2}'))
     print(format_json({'a': 1}))
@@ -0,0 +1,346 @@
+"""
+压测发送模块
+
+提供令牌桶限速和开环/闭环两种发送模式，用于按固定次数或持续时间、以目标速率发送请求。
+
+闭环(closed)模式下每个线程发送完一个请求才会发送下一个，请求速率受响应时间影响；
+开环(open)模式下请求按目标速率的时间表派发，与响应快慢无关，线程不够时请求在队列中等待。
+"""
+
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from api.stats import RunReport
+
+MODE_CLOSED = 'closed'
+MODE_OPEN = 'open'
+
+
+class TokenBucket:
+    """令牌桶
+
+    按rate每秒生成令牌，最多积累burst个。acquire时预约令牌，令牌不足时计算需要等待的时间并在锁外休眠，
+    因此多个线程同时获取时也能保持准确的总速率，发送耗时变长不会导致速率漂移。
+    """
+
+    def __init__(self, rate, burst=1):
+        """初始化令牌桶
+
+        Args:
+            rate: 每秒生成的令牌数
+            burst: 最多积累的令牌数，默认为1
+        """
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self.rate = rate
+        self.burst = burst
+        self.__tokens = burst
+        self.__last = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def reserve(self):
+        """预约一个令牌
+
+        Returns:
+            float: 可以使用该令牌的时间点(time.monotonic)
+        """
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(self.burst, self.__tokens + (now - self.__last) * self.rate)
+            self.__last = now
+            self.__tokens -= 1
+            if self.__tokens >= 0:
+                return now
+            return now - self.__tokens / self.rate
+
+    def acquire(self):
+        """获取一个令牌，令牌不足时阻塞
+
+        Returns:
+            float: 令牌的计划使用时间点(time.monotonic)
+        """
+        scheduled = self.reserve()
+        delay = scheduled - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return scheduled
+
+
+class LoadGenerator:
+    """压测发送器
+
+    按次数或持续时间发送请求，可以限制目标速率。线程安全地计数，保证恰好发送count个请求，
+    每个请求的耗时、排队时间、状态码和错误记录在RunReport中。
+    """
+
+    def __init__(self, send, count=None, duration=None, rate=None, concurrency=1, mode=MODE_CLOSED, interval=0,
+                 burst=1, future_callback=None):
+        """初始化压测发送器
+
+        Args:
+            send: 发送一个请求的函数(无参数)
+            count: 总发送次数，与duration同时设置时先达到的为准，都不设置时为1
+            duration: 持续时间(秒)
+            rate: 目标速率(请求/秒)，为None时不限速，开环模式必须设置
+            concurrency: 发送线程数
+            mode: 'closed'闭环或'open'开环
+            interval: 闭环模式下每个线程发送前的间隔时间(秒)
+            burst: 令牌桶最多积累的令牌数
+            future_callback: 每个请求完成后回调(1个参数，表示该请求的future对象)
+        """
+        if mode not in (MODE_CLOSED, MODE_OPEN):
+            raise ValueError(f'unknown load mode: {mode}')
+        if mode == MODE_OPEN and not rate:
+            raise ValueError('open loop mode requires a rate')
+        if count is None and duration is None:
+            count = 1
+        self.send = send
+        self.count = count
+        self.duration = duration
+        self.concurrency = concurrency
+        self.mode = mode
+        self.interval = interval
+        self.future_callback = future_callback
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.report = RunReport()
+        self.__issued = 0
+        self.__origin = None
+        self.__deadline = None
+        self.__lock = threading.Lock()
+
+    def __claim(self):
+        """领取一次发送名额
+
+        Returns:
+            bool: 是否还可以继续发送
+        """
+        with self.__lock:
+            if self.count is not None and self.__issued >= self.count:
+                return False
+            if self.__expired():
+                return False
+            self.__issued += 1
+            return True
+
+    def __expired(self):
+        """是否已超过持续时间
+
+        Returns:
+            bool: 超过返回True
+        """
+        return self.__deadline is not None and time.monotonic() >= self.__deadline
+
+    def __send_one(self, scheduled=None):
+        """发送一个请求，记录到报告中并执行future_callback
+
+        请求中的异常不会中断压测，通过future传给回调
+
+        Args:
+            scheduled: 请求的计划发送时间(time.monotonic)，用于计算排队时间
+        """
+        start = time.monotonic()
+        queue_wait = max(0.0, start - scheduled) if scheduled is not None else None
+        future = Future()
+        result = None
+        error = None
+        try:
+            result = self.send()
+            future.set_result(result)
+        except Exception as e:
+            error = e
+            future.set_exception(e)
+        end = time.monotonic()
+
+        status = None
+        if hasattr(result, 'get_timing'):
+            if result.get_timing():
+                result.get_timing().queue_wait = queue_wait
+            status = getattr(result.get_resp(), 'status_code', None)
+        self.report.record(end - start, end - self.__origin, status, error, queue_wait)
+        if self.future_callback:
+            self.future_callback(future)
+
+    def __closed_loop(self):
+        """闭环模式下每个线程的发送循环"""
+        while self.__claim():
+            scheduled = None
+            if self.bucket:
+                scheduled = self.bucket.acquire()
+                if self.__expired():
+                    return
+            if self.interval:
+                time.sleep(self.interval)
+            self.__send_one(scheduled)
+
+    def run(self):
+        """执行压测，所有请求完成后返回
+
+        Returns:
+            RunReport: 压测报告
+        """
+        self.__origin = time.monotonic()
+        if self.duration is not None:
+            self.__deadline = self.__origin + self.duration
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        try:
+            if self.mode == MODE_CLOSED:
+                for i in range(self.concurrency):
+                    executor.submit(self.__closed_loop)
+            else:
+                # 开环模式由当前线程按令牌桶派发请求，派发本身不会被响应阻塞
+                while self.__claim():
+                    scheduled = self.bucket.acquire()
+                    if self.__expired():
+                        break
+                    executor.submit(self.__send_one, scheduled)
+        finally:
+            executor.shutdown(wait=True)
+        self.report.elapsed = time.monotonic() - self.__origin
+        return self.report
+
+
+def split_evenly(total, parts):
+    """把总数尽量平均地分给多个部分
+
+    Args:
+        total: 总数
+        parts: 部分个数
+
+    Returns:
+        list: 每个部分的数量，之和等于total
+    """
+    share, remainder = divmod(total, parts)
+    return [share + (1 if index < remainder else 0) for index in range(parts)]
+
+
+def _run_worker(send, options, barrier, results):
+    """工作进程的入口，与其他进程同时开始压测，把序列化的报告放入结果队列
+
+    Args:
+        send: 发送一个请求的函数
+        options: LoadGenerator的参数
+        barrier: 所有工作进程和主进程共同等待的栅栏
+        results: 结果队列
+    """
+    from api import log
+
+    try:
+        generator = LoadGenerator(send, **options)
+        barrier.wait()
+        results.put(('report', generator.run().to_dict()))
+    except BaseException as e:
+        barrier.abort()
+        results.put(('error', repr(e)))
+    finally:
+        # multiprocessing的子进程不执行atexit，退出前输出剩余的请求日志
+        log.stop_all()
+
+
+class ProcessLoadGenerator:
+    """多进程压测发送器
+
+    把总次数和目标速率平均分给多个工作进程，每个进程用LoadGenerator以自己的线程和连接池发送，
+    请求构建、回调和JSON处理不再受单个进程GIL的限制。所有进程同时开始，结束后合并延迟直方图、状态码和错误计数。
+
+    支持fork的平台上工作进程直接继承send函数；其他平台上send函数必须可以pickle，例如模块级函数。
+    回调在工作进程中执行，回调结果和future_callback不会传回主进程。
+    """
+
+    def __init__(self, send, processes, count=None, duration=None, rate=None, concurrency=1, mode=MODE_CLOSED,
+                 interval=0, burst=1):
+        """初始化多进程压测发送器
+
+        Args:
+            send: 发送一个请求的函数(无参数)
+            processes: 工作进程数
+            count: 总发送次数，与duration同时设置时先达到的为准，都不设置时为1
+            duration: 持续时间(秒)
+            rate: 总目标速率(请求/秒)，平均分给每个进程
+            concurrency: 每个进程的发送线程数
+            mode: 'closed'闭环或'open'开环
+            interval: 闭环模式下每个线程发送前的间隔时间(秒)
+            burst: 每个进程的令牌桶最多积累的令牌数
+        """
+        if processes < 1:
+            raise ValueError('processes must be positive')
+        if mode == MODE_OPEN and not rate:
+            raise ValueError('open loop mode requires a rate')
+        if count is None and duration is None:
+            count = 1
+        self.send = send
+        self.processes = processes
+        self.count = count
+        self.duration = duration
+        self.rate = rate
+        self.concurrency = concurrency
+        self.mode = mode
+        self.interval = interval
+        self.burst = burst
+
+    def worker_options(self):
+        """计算每个工作进程的LoadGenerator参数
+
+        Returns:
+            list: 每个进程的参数dict
+        """
+        counts = split_evenly(self.count, self.processes) if self.count is not None else [None] * self.processes
+        return [{'count': count, 'duration': self.duration,
+                 'rate': self.rate / self.processes if self.rate else None, 'concurrency': self.concurrency,
+                 'mode': self.mode, 'interval': self.interval, 'burst': self.burst} for count in counts]
+
+    def run(self):
+        """执行压测，所有工作进程结束后返回
+
+        Returns:
+            RunReport: 合并后的压测报告
+
+        Raises:
+            RuntimeError: 工作进程出错或异常退出
+        """
+        import multiprocessing
+        import queue
+
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        barrier = context.Barrier(self.processes + 1)
+        results = context.Queue()
+        workers = [context.Process(target=_run_worker, args=(self.send, options, barrier, results), daemon=True)
+                   for options in self.worker_options()]
+        for worker in workers:
+            worker.start()
+
+        report = RunReport()
+        errors = []
+        try:
+            barrier.wait(timeout=60)
+            start = time.monotonic()
+            received = 0
+            while received < len(workers):
+                try:
+                    kind, data = results.get(timeout=0.5)
+                except queue.Empty:
+                    if not any(worker.is_alive() for worker in workers):
+                        errors.append('worker process exited without a report')
+                        break
+                    continue
+                received += 1
+                if kind == 'report':
+                    report.merge(RunReport.from_dict(data))
+                else:
+                    errors.append(data)
+            report.elapsed = time.monotonic() - start
+        except threading.BrokenBarrierError:
+            while not results.empty():
+                kind, data = results.get()
+                if kind == 'error':
+                    errors.append(data)
+            errors = errors or ['worker process failed to start']
+        finally:
+            for worker in workers:
+                worker.join(timeout=5)
+                if worker.is_alive():
+                    worker.terminate()
+        if errors:
+            raise RuntimeError(f'load worker failed: {errors[0]}')
+        return report
@@ -0,0 +1,231 @@
+"""
+请求日志模块
+
+把每次请求的方法、URL、状态码、耗时和请求链ID作为结构化事件记录下来。事件放入队列，由后台线程格式化和输出，
+发送请求的线程不会阻塞在stdout或文件I/O上。支持按级别过滤、按比例采样，输出到stdout是可选的。
+"""
+
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import weakref
+
+LOGGER_NAME = 'api.request'
+LOG_FORMAT_TEXT = 'text'
+LOG_FORMAT_JSON = 'json'
+
+
+def new_chain_id():
+    """生成请求链ID
+
+    一次send()发出的请求链、请求组成员共享同一个ID
+
+    Returns:
+        str: 16位十六进制ID
+    """
+    return os.urandom(8).hex()
+
+
+def event_level(event):
+    """计算事件的日志级别
+
+    Args:
+        event: 请求事件字典
+
+    Returns:
+        int: 出现异常为ERROR，状态码>=400为WARNING，否则为INFO
+    """
+    if event.get('error'):
+        return logging.ERROR
+    if (event.get('status') or 0) >= 400:
+        return logging.WARNING
+    return logging.INFO
+
+
+class EventFormatter(logging.Formatter):
+    """请求事件格式化器
+
+    text格式为`方法 URL 状态码 耗时 chain=ID`，json格式为每行一个JSON对象
+    """
+
+    def __init__(self, fmt=LOG_FORMAT_TEXT):
+        """初始化格式化器
+
+        Args:
+            fmt: 'text'或'json'
+        """
+        super().__init__()
+        self.fmt = fmt
+
+    def format(self, record):
+        event = getattr(record, 'event', None)
+        if event is None:
+            return super().format(record)
+        if self.fmt == LOG_FORMAT_JSON:
+            return json.dumps(event, ensure_ascii=False, default=str)
+        parts = [event['method'], event['url']]
+        if event.get('error'):
+            parts.append(f"error={event['error']}")
+        else:
+            parts.append(str(event.get('status')))
+            if event.get('total') is not None:
+                parts.append(f"{event['total'] * 1000:.1f}ms")
+            if event.get('cache'):
+                parts.append(f"cache={event['cache']}")
+        parts.append(f"chain={event['chain_id']}")
+        return ' '.join(parts)
+
+
+class RequestLogger:
+    """请求日志记录器
+
+    log()只做级别判断、采样和入队，格式化和I/O由QueueListener的后台线程完成。
+    第一次记录事件时才启动后台线程，进程退出时自动停止并输出队列中剩余的事件。线程安全。
+
+    Attributes:
+        level: 最低记录级别，低于它的事件被丢弃
+        sample_rate: INFO级别事件的采样比例(0~1)，WARNING及以上的事件总是记录
+        echo: 是否输出到stdout
+        fmt: 'text'或'json'
+    """
+
+    def __init__(self, level=logging.INFO, sample_rate=1.0, echo=True, fmt=LOG_FORMAT_TEXT, handlers=None):
+        """初始化请求日志记录器
+
+        Args:
+            level: 最低记录级别，默认为INFO
+            sample_rate: INFO级别事件的采样比例，默认全部记录
+            echo: 是否输出到stdout，默认为True
+            fmt: 'text'或'json'，用于stdout和没有设置格式化器的handler
+            handlers: 额外的logging.Handler列表，例如FileHandler，在后台线程中执行
+        """
+        self.level = level
+        self.sample_rate = sample_rate
+        self.echo = echo
+        self.fmt = fmt
+        self.__handlers = list(handlers or [])
+        self.__queue = queue.SimpleQueue()
+        self.__listener = None
+        self.__atexit_registered = False
+        self.__lock = threading.Lock()
+        _loggers.add(self)
+
+    def add_handler(self, handler):
+        """添加handler，在下一次启动后台线程时生效
+
+        Args:
+            handler: logging.Handler对象
+        """
+        self.__handlers.append(handler)
+
+    def is_enabled_for(self, level):
+        """指定级别的事件是否会被记录
+
+        Args:
+            level: 日志级别
+
+        Returns:
+            bool: 会被记录返回True
+        """
+        return level >= self.level and (self.echo or bool(self.__handlers))
+
+    def log(self, event):
+        """记录请求事件
+
+        Args:
+            event: 请求事件字典，包含method、url、status、connect、ttfb、total、cache、error和chain_id
+        """
+        level = event_level(event)
+        if not self.is_enabled_for(level):
+            return
+        if level == logging.INFO and self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+        if self.__listener is None:
+            self.start()
+        record = logging.LogRecord(LOGGER_NAME, level, '', 0, '%s %s', (event['method'], event['url']), None)
+        record.event = event
+        self.__queue.put_nowait(record)
+
+    def start(self):
+        """启动后台输出线程"""
+        import atexit
+        from logging.handlers import QueueListener
+
+        with self.__lock:
+            if self.__listener is not None:
+                return
+            handlers = list(self.__handlers)
+            if self.echo:
+                handlers.append(logging.StreamHandler(sys.stdout))
+            for handler in handlers:
+                if handler.formatter is None:
+                    handler.setFormatter(EventFormatter(self.fmt))
+            self.__listener = QueueListener(self.__queue, *handlers, respect_handler_level=True)
+            self.__listener.start()
+            if not self.__atexit_registered:
+                # 进程退出时输出队列中剩余的事件
+                atexit.register(self.stop)
+                self.__atexit_registered = True
+
+    def stop(self):
+        """停止后台线程，队列中剩余的事件输出后返回"""
+        with self.__lock:
+            if self.__listener is not None:
+                self.__listener.stop()
+                self.__listener = None
+
+    def flush(self):
+        """输出队列中已有的事件，之后的事件会重新启动后台线程"""
+        self.stop()
+
+    def _reset_after_fork(self):
+        """在fork出的子进程中重置，子进程没有父进程的后台线程，第一次记录时重新启动"""
+        self.__queue = queue.SimpleQueue()
+        self.__listener = None
+        self.__lock = threading.Lock()
+
+
+# 所有RequestLogger，fork后在子进程中重置
+_loggers = weakref.WeakSet()
+
+
+def _reset_loggers_after_fork():
+    for logger in list(_loggers):
+        logger._reset_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_loggers_after_fork)
+
+
+def stop_all():
+    """停止所有日志记录器并输出剩余的事件，用于不执行atexit的子进程退出前"""
+    for logger in list(_loggers):
+        logger.stop()
+
+
+default_request_logger = RequestLogger()
+
+
+def configure(level=None, sample_rate=None, echo=None, fmt=None):
+    """修改默认日志记录器的设置
+
+    Args:
+        level: 最低记录级别
+        sample_rate: INFO级别事件的采样比例
+        echo: 是否输出到stdout
+        fmt: 'text'或'json'
+    """
+    default_request_logger.stop()
+    if level is not None:
+        default_request_logger.level = level
+    if sample_rate is not None:
+        default_request_logger.sample_rate = sample_rate
+    if echo is not None:
+        default_request_logger.echo = echo
+    if fmt is not None:
+        default_request_logger.fmt = fmt
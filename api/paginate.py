@@ -0,0 +1,250 @@
+"""
+分页模块
+
+按游标、偏移量或Link响应头逐页发送请求。分页是惰性的：调用方处理当前页时，后台线程按顺序预取之后的prefetch页，
+下一页的请求由上一页的响应决定，因此预取总是串行的。提前结束迭代时取消还没有开始的预取，不会再发送新的请求。
+"""
+
+from collections import deque
+from urllib.parse import parse_qsl, urlencode, urljoin
+
+from api.retention import RETAIN_FULL
+
+
+def lookup(data, path):
+    """按点分隔的路径从JSON中取值
+
+    Args:
+        data: 解析后的JSON
+        path: 如'meta.next_cursor'，列表下标用数字，如'data.0.id'
+
+    Returns:
+        取到的值，路径不存在时为None
+    """
+    for key in path.split('.') if path else ():
+        if isinstance(data, dict):
+            data = data.get(key)
+        elif isinstance(data, list) and key.lstrip('-').isdigit() and -len(data) <= int(key) < len(data):
+            data = data[int(key)]
+        else:
+            return None
+    return data
+
+
+def with_query(api, params):
+    """复制Api并合并查询参数
+
+    Args:
+        api: Api对象
+        params: 要设置的查询参数字典，同名参数被覆盖
+
+    Returns:
+        Api: 派生的Api，查询参数经过URL编码
+    """
+    query = [(key, value) for key, value in parse_qsl(api.get_query() or '', keep_blank_values=True)
+             if key not in params]
+    query.extend(params.items())
+    return api.with_(query=urlencode(query))
+
+
+class Paginator:
+    """分页策略基类
+
+    Attributes:
+        items: 每页数据在JSON响应中的路径，或接收响应返回数据列表的函数，为None时整个响应是数据列表
+    """
+
+    def __init__(self, items=None):
+        self.items = items
+
+    def get_items(self, api, result):
+        """获取一页中的数据
+
+        Args:
+            api: 发送这一页的Api
+            result: 这一页的ApiResult
+
+        Returns:
+            list: 数据列表
+        """
+        resp = result.get_resp()
+        if callable(self.items):
+            return self.items(resp)
+        data = lookup(api.get_codec().loads(resp.content), self.items)
+        return data if isinstance(data, list) else []
+
+    def first(self, api):
+        """生成第一页的Api
+
+        Args:
+            api: 模板Api
+
+        Returns:
+            Api: 第一页的Api
+        """
+        return api
+
+    def next(self, api, result):
+        """根据这一页的响应生成下一页的Api
+
+        Args:
+            api: 发送这一页的Api
+            result: 这一页的ApiResult
+
+        Returns:
+            Api: 下一页的Api，没有下一页时为None
+        """
+        raise NotImplementedError
+
+
+class CursorPaginator(Paginator):
+    """游标分页：把响应中的下一页游标作为查询参数发送"""
+
+    def __init__(self, cursor_param='cursor', next_cursor='next_cursor', items=None):
+        """初始化游标分页
+
+        Args:
+            cursor_param: 游标的查询参数名
+            next_cursor: 下一页游标在JSON响应中的路径，或接收响应返回游标的函数
+            items: 每页数据的路径，设置时遇到空页也会结束
+        """
+        super().__init__(items)
+        self.cursor_param = cursor_param
+        self.next_cursor = next_cursor
+
+    def next(self, api, result):
+        resp = result.get_resp()
+        if resp.status_code >= 400:
+            return None
+        if self.items is not None and not self.get_items(api, result):
+            return None
+        if callable(self.next_cursor):
+            cursor = self.next_cursor(resp)
+        else:
+            cursor = lookup(api.get_codec().loads(resp.content), self.next_cursor)
+        if cursor is None or cursor == '':
+            return None
+        return with_query(api, {self.cursor_param: cursor})
+
+
+class OffsetPaginator(Paginator):
+    """偏移量分页：每页偏移limit条，数据少于limit条时结束"""
+
+    def __init__(self, offset_param='offset', limit_param='limit', limit=100, start=0, items=None):
+        """初始化偏移量分页
+
+        Args:
+            offset_param: 偏移量的查询参数名
+            limit_param: 每页条数的查询参数名，为None时不发送
+            limit: 每页条数
+            start: 第一页的偏移量
+            items: 每页数据的路径
+        """
+        super().__init__(items)
+        self.offset_param = offset_param
+        self.limit_param = limit_param
+        self.limit = limit
+        self.start = start
+
+    def __page(self, api, offset):
+        params = {self.offset_param: offset}
+        if self.limit_param:
+            params[self.limit_param] = self.limit
+        return with_query(api, params)
+
+    def first(self, api):
+        return self.__page(api, self.start)
+
+    def next(self, api, result):
+        if result.get_resp().status_code >= 400 or len(self.get_items(api, result)) < self.limit:
+            return None
+        offset = int(dict(parse_qsl(api.get_query())).get(self.offset_param, self.start))
+        return self.__page(api, offset + self.limit)
+
+
+class LinkPaginator(Paginator):
+    """Link响应头分页(RFC 8288)：跟随rel="next"的URL"""
+
+    def __init__(self, rel='next', items=None):
+        """初始化Link响应头分页
+
+        Args:
+            rel: 下一页链接的rel
+            items: 每页数据的路径
+        """
+        super().__init__(items)
+        self.rel = rel
+
+    def next(self, api, result):
+        resp = result.get_resp()
+        link = resp.links.get(self.rel) if resp.status_code < 400 else None
+        if not link or not link.get('url'):
+            return None
+        return api.with_(url=urljoin(resp.url, link['url']))
+
+
+def paginate(api, paginator, prefetch=1, max_pages=None, items=False):
+    """逐页发送请求
+
+    Args:
+        api: 模板Api，不会被修改，只发送它本身，不处理请求链和请求组
+        paginator: Paginator对象
+        prefetch: 调用方处理当前页时预取的页数，为0时不使用后台线程，只在需要时发送
+        max_pages: 最多发送的页数
+        items: 为True时逐条产出每页中的数据，否则产出每页的ApiResult
+
+    Yields:
+        ApiResult或数据，每页的响应总是完整保留，不受保留策略影响
+    """
+    # 分页需要读取响应体中的数据和游标
+    api = api.with_(retention=RETAIN_FULL)
+
+    def fetch(page_api):
+        result = page_api.send_single()
+        return page_api, result, paginator.next(page_api, result)
+
+    def pages():
+        page_api = paginator.first(api)
+        count = 0
+        if not prefetch:
+            while page_api is not None and (max_pages is None or count < max_pages):
+                page = fetch(page_api)
+                count += 1
+                yield page
+                page_api = page[2]
+            return
+        from concurrent.futures import ThreadPoolExecutor
+
+        # 单线程保证页按顺序发送，后一个任务开始时前一个任务已经完成
+        executor = ThreadPoolExecutor(max_workers=1)
+        pending = deque()
+
+        def fetch_after(previous):
+            if previous is None:
+                return fetch(page_api)
+            next_api = previous.result()[2]
+            return None if next_api is None else fetch(next_api)
+
+        previous = None
+        try:
+            while True:
+                while len(pending) <= prefetch and (max_pages is None or count < max_pages):
+                    previous = executor.submit(fetch_after, previous)
+                    pending.append(previous)
+                    count += 1
+                if not pending:
+                    return
+                page = pending.popleft().result()
+                if page is None:
+                    return
+                yield page
+                if page[2] is None:
+                    return
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    for page_api, result, next_api in pages():
+        if items:
+            yield from paginator.get_items(page_api, result)
+        else:
+            yield result
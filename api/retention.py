@@ -0,0 +1,127 @@
+"""
+响应保留模块
+
+ApiResult默认保留完整的requests.Response，包括响应体和连接。长时间压测、大量请求组成员或多环境对比时，
+可以只保留状态码和响应头、响应体摘要或只保留状态码，callback执行完后立即释放响应体和连接，内存占用不随请求数增长。
+"""
+
+import hashlib
+
+# full保留完整响应；headers保留状态码和响应头；digest另外保留响应体大小和sha256摘要；none只保留状态码
+RETAIN_FULL = 'full'
+RETAIN_HEADERS = 'headers'
+RETAIN_DIGEST = 'digest'
+RETAIN_NONE = 'none'
+RETENTION_POLICIES = (RETAIN_FULL, RETAIN_HEADERS, RETAIN_DIGEST, RETAIN_NONE)
+
+# 计算摘要时每次读取的字节数
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class ResponseSummary:
+    """精简的响应，属性与requests.Response的同名属性相同
+
+    Attributes:
+        status_code: 状态码
+        reason: 状态描述
+        url: 最终URL
+        headers: 响应头，RETAIN_NONE时为None
+        elapsed: 从发送到收到响应头的耗时(timedelta)
+        size: 响应体字节数，只在RETAIN_DIGEST时设置
+        digest: 响应体sha256摘要，只在RETAIN_DIGEST时设置，响应体已被流式读取时为None
+    """
+    __slots__ = ('status_code', 'reason', 'url', 'headers', 'elapsed', 'size', 'digest')
+
+    def __init__(self, status_code, reason=None, url=None, headers=None, elapsed=None, size=None, digest=None):
+        self.status_code = status_code
+        self.reason = reason
+        self.url = url
+        self.headers = headers
+        self.elapsed = elapsed
+        self.size = size
+        self.digest = digest
+
+    @property
+    def ok(self):
+        """状态码小于400时为True"""
+        return self.status_code < 400
+
+    def __repr__(self):
+        return f'<ResponseSummary [{self.status_code}]>'
+
+
+def check_retention(retention):
+    """检查保留策略
+
+    Args:
+        retention: 保留策略
+
+    Returns:
+        str: 保留策略
+
+    Raises:
+        ValueError: 未知的保留策略
+    """
+    if retention not in RETENTION_POLICIES:
+        raise ValueError(f'unknown retention policy: {retention}')
+    return retention
+
+
+def retain(resp, retention):
+    """按保留策略精简响应
+
+    除RETAIN_FULL外都会关闭原响应，连接归还连接池
+
+    Args:
+        resp: requests.Response对象或None
+        retention: 保留策略
+
+    Returns:
+        requests.Response或ResponseSummary: RETAIN_FULL时为原响应
+    """
+    if resp is None or retention == RETAIN_FULL or isinstance(resp, ResponseSummary):
+        return resp
+    try:
+        if retention == RETAIN_NONE:
+            return ResponseSummary(resp.status_code)
+        summary = ResponseSummary(resp.status_code, resp.reason, resp.url, resp.headers, resp.elapsed)
+        if retention == RETAIN_DIGEST:
+            from requests.exceptions import StreamConsumedError
+
+            digest = hashlib.sha256()
+            size = 0
+            try:
+                # 流式响应边读取边计算，不在内存中保留完整的响应体
+                for chunk in resp.iter_content(READ_CHUNK_SIZE):
+                    size += len(chunk)
+                    digest.update(chunk)
+                summary.size = size
+                summary.digest = digest.hexdigest()
+            except (RuntimeError, StreamConsumedError):
+                # callback已经以流的形式读取了响应体，大小和摘要未知，保持为None
+                pass
+        return summary
+    finally:
+        resp.close()
+
+
+_default_retention = RETAIN_FULL
+
+
+def set_default_retention(retention):
+    """设置全局默认的保留策略
+
+    Args:
+        retention: 'full'、'headers'、'digest'或'none'
+    """
+    global _default_retention
+    _default_retention = check_retention(retention)
+
+
+def get_default_retention():
+    """获取全局默认的保留策略
+
+    Returns:
+        str: 保留策略
+    """
+    return _default_retention
@@ -0,0 +1,409 @@
+"""
+重试和熔断模块
+
+RetryPolicy按请求方法、响应状态码和异常类型判断是否重试，重试间隔按指数退避并加上随机抖动；
+RetryBudget限制重试占请求总数的比例，避免后端故障时重试放大流量；
+CircuitBreaker按主机统计连续失败，后端不可用时直接失败，不再把请求压到后端。
+"""
+
+import random
+import sys
+import os
+import threading
+import time
+import weakref
+
+# 默认重试的幂等请求方法
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE', 'TRACE')
+# 默认重试的响应状态码
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+CIRCUIT_CLOSED = 'closed'
+CIRCUIT_OPEN = 'open'
+CIRCUIT_HALF_OPEN = 'half_open'
+
+# 所有RetryBudget、CircuitBreaker和CircuitBreakerRegistry，fork后在子进程中重置
+_lock_holders = weakref.WeakSet()
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开时发送请求抛出的异常
+
+    Attributes:
+        host: 熔断的主机，格式为(协议, 主机, 端口)
+        retry_after: 距离允许试探请求的秒数
+    """
+
+    def __init__(self, host, retry_after):
+        super().__init__(f'circuit open for {host[0]}://{host[1]}:{host[2]}, retry after {retry_after:.1f}s')
+        self.host = host
+        self.retry_after = retry_after
+
+
+def _default_exceptions():
+    """获取默认重试的异常类型
+
+    连接失败和超时，包括requests和已导入的aiohttp的对应异常
+
+    Returns:
+        tuple: 异常类型
+    """
+    from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout
+
+    exceptions = [ConnectionError, TimeoutError, RequestsConnectionError, Timeout]
+    aiohttp = sys.modules.get('aiohttp')
+    if aiohttp is not None:
+        exceptions.extend([aiohttp.ClientConnectionError, aiohttp.ServerTimeoutError])
+    return tuple(exceptions)
+
+
+class RetryPolicy:
+    """重试策略
+
+    Attributes:
+        max_retries: 最多重试次数，不包括第一次请求
+        backoff: 第一次重试的基础间隔(秒)，第n次重试的间隔上限为backoff * 2 ** (n - 1)
+        max_backoff: 重试间隔的最大值(秒)
+        jitter: 是否使用full jitter，在[0, 间隔上限]内随机取值，避免大量客户端同时重试
+        methods: 可以重试的请求方法
+        status_codes: 需要重试的响应状态码
+        exceptions: 需要重试的异常类型，为None时为连接失败和超时
+        respect_retry_after: 是否按响应的Retry-After头等待
+    """
+
+    def __init__(self, max_retries=3, backoff=0.1, max_backoff=10, jitter=True, methods=IDEMPOTENT_METHODS,
+                 status_codes=RETRY_STATUS_CODES, exceptions=None, respect_retry_after=True):
+        """初始化重试策略
+
+        Args:
+            max_retries: 最多重试次数，默认为3
+            backoff: 基础间隔(秒)，默认为0.1
+            max_backoff: 最大间隔(秒)，默认为10
+            jitter: 是否加随机抖动，默认为True
+            methods: 可以重试的请求方法，默认为幂等方法
+            status_codes: 需要重试的状态码，默认为429、502、503、504
+            exceptions: 需要重试的异常类型元组，默认为连接失败和超时
+            respect_retry_after: 是否遵循Retry-After头，默认为True
+        """
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.methods = tuple(method.upper() for method in methods)
+        self.status_codes = tuple(status_codes)
+        self.exceptions = exceptions
+        self.respect_retry_after = respect_retry_after
+
+    def is_retryable_method(self, method):
+        """请求方法是否可以重试
+
+        Args:
+            method: HTTP方法
+
+        Returns:
+            bool: 可以重试返回True
+        """
+        return method.upper() in self.methods
+
+    def should_retry(self, attempt, resp=None, error=None):
+        """判断一次请求的结果是否需要重试
+
+        Args:
+            attempt: 已经重试的次数
+            resp: 响应对象，出现异常时为None
+            error: 请求时出现的异常
+
+        Returns:
+            bool: 需要重试返回True
+        """
+        if attempt >= self.max_retries:
+            return False
+        if error is not None:
+            return isinstance(error, self.exceptions or _default_exceptions())
+        return resp is not None and resp.status_code in self.status_codes
+
+    def get_backoff(self, attempt, resp=None):
+        """计算下一次重试前的等待时间
+
+        Args:
+            attempt: 已经重试的次数
+            resp: 上一次请求的响应或None
+
+        Returns:
+            float: 等待时间(秒)
+        """
+        if resp is not None and self.respect_retry_after:
+            retry_after = _parse_retry_after(resp.headers.get('Retry-After'))
+            if retry_after is not None:
+                return min(retry_after, self.max_backoff)
+        ceiling = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return random.uniform(0, ceiling) if self.jitter else ceiling
+
+
+def _parse_retry_after(value):
+    """解析Retry-After头
+
+    Args:
+        value: 秒数或HTTP日期
+
+    Returns:
+        float: 等待时间(秒)，无法解析时为None
+    """
+    from email.utils import parsedate_to_datetime
+
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryBudget:
+    """重试预算
+
+    每个请求存入ratio个令牌，每次重试消耗一个令牌，令牌不足时不再重试；另外每秒补充min_per_second个令牌，
+    保证请求量很小时也可以重试。后端大面积失败时重试量最多为请求量的ratio倍。线程安全。
+
+    Attributes:
+        ratio: 重试数与请求数的最大比例
+        min_per_second: 每秒至少允许的重试数
+        max_tokens: 令牌上限，限制空闲之后突发的重试数
+    """
+
+    def __init__(self, ratio=0.2, min_per_second=10, max_tokens=100):
+        """初始化重试预算
+
+        Args:
+            ratio: 重试与请求的比例，默认为0.2
+            min_per_second: 每秒保底的重试数，默认为10
+            max_tokens: 令牌上限，默认为100
+        """
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.__tokens = float(max_tokens)
+        self.__last = time.monotonic()
+        self.__lock = threading.Lock()
+        _lock_holders.add(self)
+
+    def __refill(self, amount):
+        """补充令牌，调用方需要持有锁
+
+        Args:
+            amount: 额外存入的令牌数
+        """
+        now = time.monotonic()
+        self.__tokens = min(self.max_tokens, self.__tokens + (now - self.__last) * self.min_per_second + amount)
+        self.__last = now
+
+    def deposit(self):
+        """记录一次请求"""
+        with self.__lock:
+            self.__refill(self.ratio)
+
+    def withdraw(self):
+        """申请一次重试
+
+        Returns:
+            bool: 预算足够返回True
+        """
+        with self.__lock:
+            self.__refill(0)
+            if self.__tokens < 1:
+                return False
+            self.__tokens -= 1
+            return True
+
+    def get_tokens(self):
+        """获取当前令牌数
+
+        Returns:
+            float: 令牌数
+        """
+        with self.__lock:
+            self.__refill(0)
+            return self.__tokens
+
+    def _reset_after_fork(self):
+        """在fork出的子进程中重新创建锁，fork时其他线程可能正持有锁"""
+        self.__lock = threading.Lock()
+
+
+default_retry_budget = RetryBudget()
+
+
+class CircuitBreaker:
+    """熔断器
+
+    连续失败failure_threshold次后打开，打开期间的请求直接抛出CircuitOpenError；
+    经过recovery_timeout秒后进入半开状态，放行一个试探请求，成功则关闭，失败则重新打开。
+    打开和半开状态下只有试探请求的结果会改变状态，打开之前就已发出的请求的结果被忽略。线程安全。
+
+    Attributes:
+        host: 熔断器对应的主机，格式为(协议, 主机, 端口)
+        failure_threshold: 打开熔断器的连续失败次数
+        recovery_timeout: 打开后等待多久放行试探请求(秒)
+        failure_status: 视为失败的最小响应状态码
+    """
+
+    def __init__(self, host=None, failure_threshold=5, recovery_timeout=30, failure_status=500):
+        """初始化熔断器
+
+        Args:
+            host: (协议, 主机, 端口)
+            failure_threshold: 连续失败次数，默认为5
+            recovery_timeout: 恢复等待时间(秒)，默认为30
+            failure_status: 大于等于该值的状态码视为失败，默认为500
+        """
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.failure_status = failure_status
+        self.__state = CIRCUIT_CLOSED
+        self.__failures = 0
+        self.__opened_at = 0
+        self.__probe = None  # 半开状态下在途的试探请求的令牌
+        self.__lock = threading.Lock()
+        _lock_holders.add(self)
+
+    def get_state(self):
+        """获取熔断器状态
+
+        Returns:
+            str: 'closed'、'open'或'half_open'
+        """
+        with self.__lock:
+            if self.__state == CIRCUIT_OPEN and time.monotonic() - self.__opened_at >= self.recovery_timeout:
+                return CIRCUIT_HALF_OPEN
+            return self.__state
+
+    def before_call(self):
+        """发送请求前检查熔断器
+
+        Returns:
+            object: 放行试探请求时为试探令牌，需要传给record()；关闭状态下为None
+
+        Raises:
+            CircuitOpenError: 熔断器打开，或半开状态下已有试探请求在进行
+        """
+        with self.__lock:
+            if self.__state == CIRCUIT_CLOSED:
+                return None
+            remaining = self.recovery_timeout - (time.monotonic() - self.__opened_at)
+            if remaining <= 0 and self.__probe is None:
+                self.__state = CIRCUIT_HALF_OPEN
+                self.__probe = object()
+                return self.__probe
+            raise CircuitOpenError(self.host, max(0.0, remaining))
+
+    def is_failure(self, resp=None, error=None):
+        """一次请求的结果是否视为失败
+
+        Args:
+            resp: 响应对象
+            error: 请求时出现的异常
+
+        Returns:
+            bool: 失败返回True
+        """
+        return error is not None or resp is None or resp.status_code >= self.failure_status
+
+    def record(self, resp=None, error=None, probe=None):
+        """记录一次请求的结果
+
+        Args:
+            resp: 响应对象
+            error: 请求时出现的异常
+            probe: before_call()返回的试探令牌
+        """
+        failed = self.is_failure(resp, error)
+        with self.__lock:
+            if self.__state != CIRCUIT_CLOSED:
+                # 打开之前发出的请求和其他请求不能代替试探请求
+                if probe is None or probe is not self.__probe:
+                    return
+                self.__probe = None
+                if failed:
+                    self.__opened_at = time.monotonic()
+                    self.__state = CIRCUIT_OPEN
+                else:
+                    self.__state = CIRCUIT_CLOSED
+                    self.__failures = 0
+                return
+            if not failed:
+                self.__failures = 0
+                return
+            self.__failures += 1
+            if self.__failures >= self.failure_threshold:
+                self.__state = CIRCUIT_OPEN
+                self.__opened_at = time.monotonic()
+
+    def _reset_after_fork(self):
+        """在fork出的子进程中重置
+
+        试探请求属于父进程的线程，子进程中不会完成，丢弃试探令牌，子进程可以放行自己的试探请求，并重新创建锁
+        """
+        self.__probe = None
+        self.__lock = threading.Lock()
+
+
+class CircuitBreakerRegistry:
+    """按主机管理熔断器
+
+    以(协议, 主机, 端口)为键，同一个注册表可以在多个Api之间共享，线程安全。
+    """
+
+    def __init__(self, failure_threshold=5, recovery_timeout=30, failure_status=500):
+        """初始化熔断器注册表
+
+        Args:
+            failure_threshold: 新建熔断器的连续失败次数
+            recovery_timeout: 新建熔断器的恢复等待时间(秒)
+            failure_status: 新建熔断器视为失败的最小状态码
+        """
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.failure_status = failure_status
+        self.__breakers = {}
+        self.__lock = threading.Lock()
+        _lock_holders.add(self)
+
+    def get(self, protocol, host, port=None):
+        """获取(必要时创建)主机的熔断器
+
+        Args:
+            protocol: 协议
+            host: 主机名
+            port: 端口
+
+        Returns:
+            CircuitBreaker: 熔断器
+        """
+        key = (protocol, host, port)
+        breaker = self.__breakers.get(key)
+        if breaker is None:
+            with self.__lock:
+                breaker = self.__breakers.setdefault(key, CircuitBreaker(key, self.failure_threshold,
+                                                                         self.recovery_timeout, self.failure_status))
+        return breaker
+
+    def _reset_after_fork(self):
+        """在fork出的子进程中重新创建锁，fork时其他线程可能正持有锁"""
+        self.__lock = threading.Lock()
+
+
+def _reset_locks_after_fork():
+    for holder in list(_lock_holders):
+        holder._reset_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_locks_after_fork)
+
+
+default_circuit_breakers = CircuitBreakerRegistry()
@@ -0,0 +1,240 @@
+"""
+HTTP会话池模块
+
+按协议、主机、端口、代理和SSL验证设置复用requests.Session，
+避免每次请求都新建Session、重新建立TCP连接和TLS握手。
+"""
+
+import os
+import threading
+import time
+import weakref
+
+# 记录当前线程上一次请求建立连接的耗时
+_connect_timing = threading.local()
+# 首次创建Session时才导入requests/urllib3并生成TimingHTTPAdapter，加快import api.api
+_adapter_class = None
+
+
+def reset_connect_time():
+    """清零当前线程记录的建立连接耗时"""
+    _connect_timing.seconds = 0
+
+
+def get_connect_time():
+    """获取当前线程自上次清零以来建立连接的耗时
+
+    Returns:
+        float: 耗时(秒)，复用已有连接时为0
+    """
+    return getattr(_connect_timing, 'seconds', 0)
+
+
+class _TimedConnectMixin:
+    """记录connect耗时的连接类"""
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _connect_timing.seconds = get_connect_time() + time.perf_counter() - start
+
+
+def _timing_adapter_class():
+    """生成记录建立连接耗时的HTTPAdapter类
+
+    Returns:
+        type: TimingHTTPAdapter类
+    """
+    global _adapter_class
+    if _adapter_class is not None:
+        return _adapter_class
+
+    from requests.adapters import HTTPAdapter
+    from urllib3 import ProxyManager
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    class _TimedHTTPConnection(_TimedConnectMixin, HTTPConnection):
+        pass
+
+    class _TimedHTTPSConnection(_TimedConnectMixin, HTTPSConnection):
+        pass
+
+    class _TimedHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = _TimedHTTPConnection
+
+    class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = _TimedHTTPSConnection
+
+    timed_pool_classes = {'http': _TimedHTTPConnectionPool, 'https': _TimedHTTPSConnectionPool}
+
+    class TimingHTTPAdapter(HTTPAdapter):
+        """记录建立连接耗时的HTTPAdapter"""
+
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = timed_pool_classes
+
+        def proxy_manager_for(self, proxy, **proxy_kwargs):
+            manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+            # SOCKS代理使用自己的连接类，不记录耗时
+            if type(manager) is ProxyManager:
+                manager.pool_classes_by_scheme = timed_pool_classes
+            return manager
+
+    _adapter_class = TimingHTTPAdapter
+    return _adapter_class
+
+
+def __getattr__(name):
+    # 兼容直接导入TimingHTTPAdapter的代码
+    if name == 'TimingHTTPAdapter':
+        return _timing_adapter_class()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+class PoolConfig:
+    """连接池配置类
+
+    Attributes:
+        pool_connections: 每个Session缓存的连接池个数
+        pool_maxsize: 每个主机最多保持的连接数
+        keep_alive: 是否保持长连接
+        pool_block: 连接数达到上限时是否阻塞等待空闲连接
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, keep_alive=True, pool_block=False):
+        """初始化连接池配置
+
+        Args:
+            pool_connections: 缓存的连接池个数，默认为10
+            pool_maxsize: 每个主机最大连接数，默认为10
+            keep_alive: 是否保持长连接，默认为True
+            pool_block: 连接耗尽时是否阻塞，默认为False
+        """
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.keep_alive = keep_alive
+        self.pool_block = pool_block
+
+    def key(self):
+        """获取配置的唯一标识
+
+        Returns:
+            tuple: 可作为字典键的配置元组
+        """
+        return self.pool_connections, self.pool_maxsize, self.keep_alive, self.pool_block
+
+
+DEFAULT_POOL_CONFIG = PoolConfig()
+
+
+class SessionPool:
+    """Session注册表
+
+    以(协议, 主机, 端口, 代理, SSL验证, 连接池配置)为键缓存Session，线程安全。
+    """
+
+    def __init__(self):
+        """初始化Session注册表"""
+        self.__sessions = {}
+        self.__lock = threading.Lock()
+        _pools.add(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return len(self.__sessions)
+
+    def get_session(self, protocol, host, port=None, proxies=None, verify=True, config=None):
+        """获取(必要时创建)对应的Session
+
+        Args:
+            protocol: 协议(http/https)
+            host: 主机名
+            port: 端口
+            proxies: requests格式的代理字典或None
+            verify: SSL验证开关
+            config: PoolConfig对象，为None时使用默认配置
+
+        Returns:
+            requests.Session: 可复用的Session对象
+        """
+        config = config or DEFAULT_POOL_CONFIG
+        proxy_key = tuple(sorted(proxies.items())) if proxies else None
+        key = (protocol, host, port, proxy_key, verify, config.key())
+        session = self.__sessions.get(key)
+        if session is None:
+            with self.__lock:
+                session = self.__sessions.get(key)
+                if session is None:
+                    session = self.__new_session(config)
+                    self.__sessions[key] = session
+        return session
+
+    def __new_session(self, config):
+        """按配置创建Session
+
+        Args:
+            config: PoolConfig对象
+
+        Returns:
+            requests.Session: 新建的Session对象
+        """
+        from http.cookiejar import DefaultCookiePolicy
+
+        import requests
+
+        session = requests.Session()
+        # Session被多个Api共享，不保存响应中的Cookie，与每次新建Session的行为保持一致
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = _timing_adapter_class()(pool_connections=config.pool_connections,
+                                          pool_maxsize=config.pool_maxsize, pool_block=config.pool_block)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if not config.keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def close(self):
+        """关闭所有Session并释放连接"""
+        with self.__lock:
+            sessions = list(self.__sessions.values())
+            self.__sessions.clear()
+        for session in sessions:
+            session.close()
+
+    def _reset_after_fork(self):
+        """在fork出的子进程中丢弃继承的Session
+
+        继承的连接与父进程共享socket，子进程不能使用也不能关闭它们，只丢弃引用并重新创建锁
+        """
+        self.__sessions = {}
+        self.__lock = threading.Lock()
+
+
+# 所有SessionPool，fork后在子进程中重置
+_pools = weakref.WeakSet()
+
+
+def _reset_pools_after_fork():
+    for pool in list(_pools):
+        pool._reset_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_pools_after_fork)
+
+
+default_session_pool = SessionPool()
+
+
+def close_all():
+    """关闭默认注册表中的所有Session"""
+    default_session_pool.close()
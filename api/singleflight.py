@@ -0,0 +1,163 @@
+"""
+请求合并模块
+
+同一时刻发起的相同幂等请求(方法、URL和相关请求头相同)只有第一个真正发送，
+其余请求等待并共享它的响应，减轻并发扇出时后端的压力。
+"""
+
+import os
+import threading
+import weakref
+
+# 可以合并的请求方法
+COALESCING_METHODS = ('GET', 'HEAD')
+# 默认参与计算合并键的请求头
+DEFAULT_KEY_HEADERS = ('Accept', 'Accept-Encoding', 'Accept-Language', 'Authorization', 'Cookie')
+# 改变响应内容的条件请求头和Range头总是参与计算合并键，例如缓存的条件请求不会与普通请求合并而拿到空的304
+CONDITIONAL_HEADERS = ('If-None-Match', 'If-Modified-Since', 'If-Match', 'If-Unmodified-Since', 'Range')
+
+
+class _Call:
+    """正在进行的请求"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """相同请求合并器
+
+    线程安全，同一个SingleFlight对象可以在多个Api、多个线程和事件循环之间共享。
+    """
+
+    def __init__(self, key_headers=DEFAULT_KEY_HEADERS):
+        """初始化请求合并器
+
+        Args:
+            key_headers: 参与计算合并键的请求头，这些头不同的请求不会被合并，CONDITIONAL_HEADERS总是参与
+        """
+        self.key_headers = tuple(key_headers)
+        self.__calls = {}
+        self.__async_calls = {}
+        self.__lock = threading.Lock()
+        _single_flights.add(self)
+
+    def is_coalescable(self, snapshot):
+        """请求是否可以合并
+
+        Args:
+            snapshot: RequestSnapshot对象
+
+        Returns:
+            bool: 幂等且不是流式响应的请求返回True
+        """
+        return snapshot.method.upper() in COALESCING_METHODS and not snapshot.stream
+
+    def key(self, snapshot):
+        """计算合并键
+
+        Args:
+            snapshot: RequestSnapshot对象
+
+        Returns:
+            tuple: (方法, URL, 相关请求头的值, 条件请求头的值, Cookie)
+        """
+        from requests.structures import CaseInsensitiveDict
+
+        headers = CaseInsensitiveDict(snapshot.headers)
+        cookies = tuple(sorted(snapshot.cookies.items())) if isinstance(snapshot.cookies, dict) else snapshot.cookies
+        return (snapshot.method.upper(), snapshot.url, tuple(headers.get(name) for name in self.key_headers),
+                tuple(headers.get(name) for name in CONDITIONAL_HEADERS), cookies)
+
+    def do(self, key, fn):
+        """执行请求，相同键的并发调用只执行一次
+
+        Args:
+            key: 合并键
+            fn: 执行请求的函数(无参数)
+
+        Returns:
+            tuple: (fn的返回值, 是否共享了其他调用的结果)
+        """
+        with self.__lock:
+            call = self.__calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.__calls[key] = _Call()
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.__lock:
+                del self.__calls[key]
+            call.event.set()
+        return call.result, False
+
+    async def do_async(self, key, fn):
+        """异步执行请求，同一事件循环中相同键的并发调用只执行一次
+
+        Args:
+            key: 合并键
+            fn: 返回协程的函数(无参数)
+
+        Returns:
+            tuple: (协程的结果, 是否共享了其他调用的结果)
+        """
+        import asyncio
+
+        calls = self.__async_calls.setdefault(asyncio.get_running_loop(), {})
+        future = calls.get(key)
+        if future is not None:
+            return await asyncio.shield(future), True
+        future = calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # 没有其他调用等待时避免"exception was never retrieved"警告
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            del calls[key]
+            if not calls:
+                self.__async_calls.pop(asyncio.get_running_loop(), None)
+        return result, False
+
+    def _reset_after_fork(self):
+        """在fork出的子进程中重置
+
+        发送中的请求属于父进程的线程和事件循环，子进程中不会完成，丢弃它们并重新创建锁
+        """
+        self.__calls = {}
+        self.__async_calls = {}
+        self.__lock = threading.Lock()
+
+
+# 所有SingleFlight，fork后在子进程中重置
+_single_flights = weakref.WeakSet()
+
+
+def _reset_single_flights_after_fork():
+    for single_flight in list(_single_flights):
+        single_flight._reset_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_single_flights_after_fork)
+
+
+default_single_flight = SingleFlight()
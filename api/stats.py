@@ -0,0 +1,339 @@
+"""
+压测统计模块
+
+提供HDR风格的可合并延迟直方图和压测报告，报告包括延迟分位数、吞吐量时间线、状态码和错误计数。
+"""
+
+import math
+import threading
+from collections import Counter
+
+
+class LatencyHistogram:
+    """HDR风格的延迟直方图
+
+    以微秒为单位按对数分桶，每个桶再线性细分，在固定内存下保证significant_digits位有效数字的精度。
+    多个直方图可以合并，可以序列化为dict在进程间传递。
+    """
+
+    def __init__(self, significant_digits=2, highest_seconds=3600):
+        """初始化直方图
+
+        Args:
+            significant_digits: 有效数字位数，默认为2(误差小于1%)
+            highest_seconds: 可记录的最大值(秒)，超过的值按最大值记录
+        """
+        self.significant_digits = significant_digits
+        self.highest_seconds = highest_seconds
+        self.__sub_bucket_bits = math.ceil(math.log2(2 * 10 ** significant_digits))
+        self.__sub_bucket_count = 1 << self.__sub_bucket_bits
+        self.__sub_bucket_half = self.__sub_bucket_count >> 1
+        self.__highest = int(highest_seconds * 1000000)
+        self.__counts = [0] * (self.__index_of(self.__highest) + 1)
+        self.__total = 0
+        self.__sum = 0
+        self.__min = None
+        self.__max = None
+
+    def __index_of(self, value):
+        """计算微秒值所在的桶序号
+
+        Args:
+            value: 微秒值
+
+        Returns:
+            int: 桶序号
+        """
+        bucket = max(0, value.bit_length() - self.__sub_bucket_bits)
+        sub_index = value >> bucket
+        if bucket == 0:
+            return sub_index
+        return self.__sub_bucket_count + (bucket - 1) * self.__sub_bucket_half + sub_index - self.__sub_bucket_half
+
+    def __highest_value_of(self, index):
+        """计算桶内可表示的最大微秒值
+
+        Args:
+            index: 桶序号
+
+        Returns:
+            int: 微秒值
+        """
+        if index < self.__sub_bucket_count:
+            return index
+        bucket = (index - self.__sub_bucket_count) // self.__sub_bucket_half + 1
+        sub_index = (index - self.__sub_bucket_count) % self.__sub_bucket_half + self.__sub_bucket_half
+        return ((sub_index + 1) << bucket) - 1
+
+    def record(self, seconds, count=1):
+        """记录一个延迟值
+
+        Args:
+            seconds: 延迟(秒)
+            count: 记录次数
+        """
+        value = min(max(int(seconds * 1000000), 0), self.__highest)
+        self.__counts[self.__index_of(value)] += count
+        self.__total += count
+        self.__sum += value * count
+        self.__min = value if self.__min is None else min(self.__min, value)
+        self.__max = value if self.__max is None else max(self.__max, value)
+
+    def merge(self, other):
+        """合并另一个直方图
+
+        Args:
+            other: 相同精度和范围的LatencyHistogram对象
+
+        Returns:
+            self: 支持链式调用
+        """
+        if (other.significant_digits, other.highest_seconds) != (self.significant_digits, self.highest_seconds):
+            raise ValueError('can only merge histograms with the same precision and range')
+        for index, count in enumerate(other.__counts):
+            if count:
+                self.__counts[index] += count
+        self.__total += other.__total
+        self.__sum += other.__sum
+        if other.__min is not None:
+            self.__min = other.__min if self.__min is None else min(self.__min, other.__min)
+            self.__max = other.__max if self.__max is None else max(self.__max, other.__max)
+        return self
+
+    def get_count(self):
+        """获取记录的个数
+
+        Returns:
+            int: 记录个数
+        """
+        return self.__total
+
+    def get_min(self):
+        """获取最小值
+
+        Returns:
+            float: 最小值(秒)，没有记录时为None
+        """
+        return None if self.__min is None else self.__min / 1000000
+
+    def get_max(self):
+        """获取最大值
+
+        Returns:
+            float: 最大值(秒)，没有记录时为None
+        """
+        return None if self.__max is None else self.__max / 1000000
+
+    def get_mean(self):
+        """获取平均值
+
+        Returns:
+            float: 平均值(秒)，没有记录时为None
+        """
+        return None if not self.__total else self.__sum / self.__total / 1000000
+
+    def percentile(self, percent):
+        """获取分位数
+
+        Args:
+            percent: 百分位，例如99.9
+
+        Returns:
+            float: 分位数(秒)，为所在桶可表示的最大值且不超过记录的最大值，没有记录时为None
+        """
+        if not self.__total:
+            return None
+        target = max(1, math.ceil(percent / 100 * self.__total))
+        seen = 0
+        for index, count in enumerate(self.__counts):
+            seen += count
+            if seen >= target:
+                return min(self.__highest_value_of(index), self.__max) / 1000000
+        return self.get_max()
+
+    def to_dict(self):
+        """序列化为dict
+
+        Returns:
+            dict: 只包含非零桶的dict
+        """
+        return {
+            'significant_digits': self.significant_digits,
+            'highest_seconds': self.highest_seconds,
+            'counts': {index: count for index, count in enumerate(self.__counts) if count},
+            'sum': self.__sum,
+            'min': self.__min,
+            'max': self.__max
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """从to_dict的结果还原直方图
+
+        Args:
+            data: to_dict生成的dict
+
+        Returns:
+            LatencyHistogram: 直方图
+        """
+        histogram = cls(data['significant_digits'], data['highest_seconds'])
+        for index, count in data['counts'].items():
+            histogram.__counts[int(index)] = count
+            histogram.__total += count
+        histogram.__sum = data['sum']
+        histogram.__min = data['min']
+        histogram.__max = data['max']
+        return histogram
+
+
+class RunReport:
+    """压测报告
+
+    线程安全地记录每个请求的延迟、排队时间、完成时间、状态码和错误，多个报告可以合并。
+    """
+
+    PERCENTILES = (50, 90, 99, 99.9)
+
+    def __init__(self, significant_digits=2):
+        """初始化压测报告
+
+        Args:
+            significant_digits: 直方图的有效数字位数
+        """
+        self.latency = LatencyHistogram(significant_digits)
+        self.queue_wait = LatencyHistogram(significant_digits)
+        self.status_counts = Counter()
+        self.error_counts = Counter()
+        self.timeline = Counter()
+        self.elapsed = 0
+        self.__lock = threading.Lock()
+
+    def record(self, latency, offset, status=None, error=None, queue_wait=None):
+        """记录一个请求
+
+        Args:
+            latency: 请求耗时(秒)
+            offset: 请求完成时间相对压测开始的偏移(秒)，用于吞吐量时间线
+            status: HTTP状态码
+            error: 请求抛出的异常
+            queue_wait: 请求在队列中等待的时间(秒)
+        """
+        with self.__lock:
+            self.latency.record(latency)
+            if queue_wait is not None:
+                self.queue_wait.record(queue_wait)
+            if status is not None:
+                self.status_counts[status] += 1
+            if error is not None:
+                self.error_counts[type(error).__name__] += 1
+            self.timeline[int(offset)] += 1
+
+    def merge(self, other):
+        """合并另一个报告
+
+        Args:
+            other: RunReport对象
+
+        Returns:
+            self: 支持链式调用
+        """
+        with self.__lock:
+            self.latency.merge(other.latency)
+            self.queue_wait.merge(other.queue_wait)
+            self.status_counts.update(other.status_counts)
+            self.error_counts.update(other.error_counts)
+            self.timeline.update(other.timeline)
+            self.elapsed = max(self.elapsed, other.elapsed)
+        return self
+
+    def to_dict(self):
+        """序列化为dict，用于在进程间传递
+
+        Returns:
+            dict: 直方图、计数和耗时
+        """
+        with self.__lock:
+            return {
+                'latency': self.latency.to_dict(),
+                'queue_wait': self.queue_wait.to_dict(),
+                'status_counts': dict(self.status_counts),
+                'error_counts': dict(self.error_counts),
+                'timeline': dict(self.timeline),
+                'elapsed': self.elapsed
+            }
+
+    @classmethod
+    def from_dict(cls, data):
+        """从to_dict的结果还原报告
+
+        Args:
+            data: to_dict生成的dict
+
+        Returns:
+            RunReport: 压测报告
+        """
+        report = cls()
+        report.latency = LatencyHistogram.from_dict(data['latency'])
+        report.queue_wait = LatencyHistogram.from_dict(data['queue_wait'])
+        report.status_counts.update({int(status): count for status, count in data['status_counts'].items()})
+        report.error_counts.update(data['error_counts'])
+        report.timeline.update({int(offset): count for offset, count in data['timeline'].items()})
+        report.elapsed = data['elapsed']
+        return report
+
+    def get_count(self):
+        """获取请求个数
+
+        Returns:
+            int: 请求个数
+        """
+        return self.latency.get_count()
+
+    def get_error_count(self):
+        """获取失败的请求个数
+
+        Returns:
+            int: 抛出异常的请求个数
+        """
+        return sum(self.error_counts.values())
+
+    def get_throughput(self):
+        """获取平均吞吐量
+
+        Returns:
+            float: 请求/秒
+        """
+        return self.get_count() / self.elapsed if self.elapsed else 0
+
+    def get_timeline(self):
+        """获取吞吐量时间线
+
+        Returns:
+            list: 每秒完成的请求个数，下标为相对压测开始的秒数
+        """
+        if not self.timeline:
+            return []
+        return [self.timeline.get(second, 0) for second in range(max(self.timeline) + 1)]
+
+    def summary(self):
+        """生成报告摘要
+
+        Returns:
+            dict: 请求数、错误数、吞吐量、延迟分位数、状态码计数、错误计数和吞吐量时间线
+        """
+        return {
+            'count': self.get_count(),
+            'errors': self.get_error_count(),
+            'elapsed': self.elapsed,
+            'throughput': self.get_throughput(),
+            'latency': {
+                'min': self.latency.get_min(),
+                'mean': self.latency.get_mean(),
+                'max': self.latency.get_max(),
+                **{f'p{percent:g}': self.latency.percentile(percent) for percent in self.PERCENTILES}
+            },
+            'queue_wait': {f'p{percent:g}': self.queue_wait.percentile(percent) for percent in self.PERCENTILES},
+            'status_counts': dict(self.status_counts),
+            'error_counts': dict(self.error_counts),
+            'timeline': self.get_timeline()
+        }
@@ -0,0 +1,111 @@
+"""
+流式响应模块
+
+把流式响应按数据块、文本行或NDJSON记录逐个产出，处理大响应时内存占用不随响应大小增长。
+"""
+
+import codecs
+import json
+
+STREAM_CHUNKS = 'chunks'
+STREAM_LINES = 'lines'
+STREAM_NDJSON = 'ndjson'
+STREAM_MODES = (STREAM_CHUNKS, STREAM_LINES, STREAM_NDJSON)
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+def iter_lines(chunks, encoding='utf-8'):
+    """把bytes数据块切分为文本行
+
+    跨数据块的行和多字节字符都会被正确拼接，行尾的\\r\\n或\\n会被去掉
+
+    Args:
+        chunks: bytes数据块的可迭代对象
+        encoding: 文本编码
+
+    Yields:
+        str: 一行文本
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    pending = ''
+    for chunk in chunks:
+        pending += decoder.decode(chunk)
+        if '\n' not in pending:
+            continue
+        lines = pending.split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip('\r')
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending.rstrip('\r')
+
+
+def iter_ndjson(lines, loads=json.loads):
+    """把文本行解析为JSON记录，跳过空行
+
+    Args:
+        lines: 文本行的可迭代对象
+        loads: JSON解析函数
+
+    Yields:
+        object: 一条JSON记录
+    """
+    for line in lines:
+        if line.strip():
+            yield loads(line)
+
+
+class ResponseStream:
+    """流式响应
+
+    迭代时边接收边产出数据块(bytes)、文本行(str)或NDJSON记录，只能迭代一次。
+    迭代结束或调用close()后连接归还连接池。
+
+    Attributes:
+        resp: requests.Response对象，可以读取状态码和响应头
+        mode: 'chunks'、'lines'或'ndjson'
+        chunk_size: 每次从网络读取的字节数
+        loads: 解析NDJSON记录的函数
+    """
+
+    def __init__(self, resp, mode=STREAM_CHUNKS, chunk_size=DEFAULT_CHUNK_SIZE, loads=json.loads):
+        """初始化流式响应
+
+        Args:
+            resp: 以stream=True发送得到的requests.Response对象
+            mode: 'chunks'、'lines'或'ndjson'
+            chunk_size: 每次读取的字节数
+            loads: 解析NDJSON记录的函数
+        """
+        if mode not in STREAM_MODES:
+            raise ValueError(f'unknown stream mode: {mode}')
+        self.resp = resp
+        self.mode = mode
+        self.chunk_size = chunk_size
+        self.loads = loads
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __iter__(self):
+        try:
+            chunks = self.resp.iter_content(self.chunk_size)
+            if self.mode == STREAM_CHUNKS:
+                yield from chunks
+                return
+            lines = iter_lines(chunks, self.resp.encoding or 'utf-8')
+            if self.mode == STREAM_LINES:
+                yield from lines
+            else:
+                yield from iter_ndjson(lines, self.loads)
+        finally:
+            self.close()
+
+    def close(self):
+        """关闭响应，未读取的数据被丢弃"""
+        self.resp.close()
@@ -0,0 +1,44 @@
+"""
+参数扫描模块
+
+用一组参数逐个展开同一个Api模板并发送。参数惰性读取，可以是生成器甚至无限序列；用有界的线程池发送，
+同一时刻最多只有window个请求在途，内存占用与参数个数无关，结果按参数的顺序产出。
+"""
+
+from collections import deque
+
+
+def sweep(api, params, max_workers=8, window=None):
+    """用一组参数逐个展开Api并发送
+
+    Args:
+        api: 模板Api，路径可以是'/users/{id}'形式的模板
+        params: 参数字典的可迭代对象
+        max_workers: 并发数
+        window: 在途请求上限，默认为max_workers的4倍
+
+    Yields:
+        tuple: (参数, ApiResult, 异常)，请求成功时异常为None，失败时ApiResult为None
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    window = window or max_workers * 4
+
+    def send(each):
+        try:
+            return each, api.expand(each).send(), None
+        except Exception as e:
+            return each, None, e
+
+    pending = deque()
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        for each in params:
+            if len(pending) >= window:
+                yield pending.popleft().result()
+            pending.append(executor.submit(send, each))
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # 提前结束迭代时不再发送还没有开始的请求
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,153 @@
+"""
+URL模块
+
+路径模板(如'/users/{id}')只解析一次，之后每次展开只做参数替换和编码；查询参数按application/x-www-form-urlencoded编码，
+列表和元组值展开为同名的多个参数，编码过的键值对被缓存，大量请求共享相同的参数时不会重复编码。
+"""
+
+import re
+from functools import lru_cache
+from urllib.parse import quote, quote_plus
+
+# 路径模板中的占位符，如{id}
+PLACEHOLDER = re.compile(r'\{([A-Za-z_][A-Za-z0-9_]*)\}')
+
+
+class PathTemplate:
+    """编译后的路径模板
+
+    Attributes:
+        template: 路径模板
+        fields: 占位符名称，按出现顺序
+    """
+    __slots__ = ('template', 'fields', '__literal', '__pairs')
+
+    def __init__(self, template):
+        """解析路径模板
+
+        Args:
+            template: 路径模板，如'/users/{id}/orders/{order_id}'
+        """
+        self.template = template
+        parts = PLACEHOLDER.split(template)
+        # 偶数位置为字面量，奇数位置为占位符名称，预先组成(占位符, 之后的字面量)对
+        self.__literal = parts[0]
+        self.__pairs = tuple(zip(parts[1::2], parts[2::2]))
+        self.fields = tuple(parts[1::2])
+
+    def expand(self, params):
+        """展开路径模板
+
+        Args:
+            params: 参数字典，值按路径片段编码，'/'也会被编码
+
+        Returns:
+            str: 展开后的路径
+
+        Raises:
+            ValueError: 缺少占位符对应的参数
+        """
+        if not self.__pairs:
+            return self.__literal
+        values = [self.__literal]
+        for field, literal in self.__pairs:
+            try:
+                values.append(quote_segment(params[field]))
+            except KeyError:
+                raise ValueError(f'missing path parameter {field!r} for {self.template!r}') from None
+            values.append(literal)
+        return ''.join(values)
+
+
+def quote_segment(value):
+    """把值编码为一个路径片段，'/'也会被编码
+
+    Args:
+        value: 参数值
+
+    Returns:
+        str: 编码后的片段
+    """
+    text = str(value)
+    if text.isascii() and text.isalnum():
+        # 数字和字母不需要编码，跳过quote
+        return text
+    return quote(text, safe='')
+
+
+def join_url(protocol, netloc, path, query, fragment):
+    """拼接URL，结果与urlunparse相同
+
+    Args:
+        protocol: 协议
+        netloc: 主机和端口
+        path: 路径
+        query: 查询字符串
+        fragment: URL片段
+
+    Returns:
+        str: 完整URL
+    """
+    if path and path[:1] != '/':
+        path = '/' + path
+    url = f'{protocol}://{netloc}{path}' if protocol else f'//{netloc}{path}'
+    if query:
+        url = f'{url}?{query}'
+    if fragment:
+        url = f'{url}#{fragment}'
+    return url
+
+
+@lru_cache(maxsize=256)
+def compile_path(template):
+    """编译路径模板，相同的模板只解析一次
+
+    Args:
+        template: 路径模板
+
+    Returns:
+        PathTemplate: 编译后的路径模板
+    """
+    return PathTemplate(template)
+
+
+# typed=True：True、1和1.0的哈希相同，不区分类型时会互相返回对方的编码结果
+@lru_cache(maxsize=4096, typed=True)
+def _encode_pair(key, value):
+    """编码一个查询参数键值对
+
+    Args:
+        key: 参数名
+        value: 参数值，可哈希
+
+    Returns:
+        str: 'key=value'形式的编码结果
+    """
+    return f'{quote_plus(str(key))}={quote_plus(str(value))}'
+
+
+def _encode(key, value):
+    try:
+        return _encode_pair(key, value)
+    except TypeError:
+        # 不可哈希的值不缓存
+        return f'{quote_plus(str(key))}={quote_plus(str(value))}'
+
+
+def encode_query(query):
+    """编码查询参数
+
+    Args:
+        query: 参数字典或(键, 值)列表，值为列表或元组时展开为同名的多个参数
+
+    Returns:
+        str: 编码后的查询字符串
+    """
+    items = query.items() if isinstance(query, dict) else query
+    pairs = []
+    for key, value in items:
+        if isinstance(value, (list, tuple)):
+            pairs.extend(_encode(key, each) for each in value)
+        else:
+            pairs.append(_encode(key, value))
+    return '&'.join(pairs)
@@ -0,0 +1,71 @@
+"""
+JSON编解码器基准测试
+
+比较已安装的各个编解码器编码请求体和解析响应的耗时，结果以JSON输出
+
+用法: python -m benchmarks.bench_codec [--records 10000] [--repeat 20]
+"""
+
+import argparse
+import json
+import time
+
+from api.codec import CODEC_CLASSES, get_codec
+
+
+def make_payload(records):
+    """生成测试数据
+
+    Args:
+        records: 记录条数
+
+    Returns:
+        list: 记录列表
+    """
+    return [{'id': i, 'name': f'user-{i}', 'score': i * 0.5, 'active': i % 2 == 0,
+             'tags': ['a', 'b', 'c'], 'profile': {'city': '上海', 'age': i % 90}} for i in range(records)]
+
+
+def bench(codec, payload, repeat):
+    """测量一个编解码器
+
+    Args:
+        codec: JsonCodec对象
+        payload: 测试数据
+        repeat: 重复次数
+
+    Returns:
+        dict: 每次编码和解码的最短耗时(秒)及编码后的字节数
+    """
+    encoded = codec.dumps(payload)
+    dumps_times = []
+    loads_times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        codec.dumps(payload)
+        dumps_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        codec.loads(encoded)
+        loads_times.append(time.perf_counter() - start)
+    return {'dumps': min(dumps_times), 'loads': min(loads_times), 'bytes': len(encoded)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark json codecs')
+    parser.add_argument('--records', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    payload = make_payload(args.records)
+    results = {}
+    for name in CODEC_CLASSES:
+        try:
+            codec = get_codec(name)
+        except ImportError:
+            continue
+        results[name] = bench(codec, payload, args.repeat)
+    print(json.dumps({'records': args.records, 'repeat': args.repeat, 'results': results}, indent=4))
+
+
+if __name__ == '__main__':
+    main()
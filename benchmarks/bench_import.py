@@ -0,0 +1,67 @@
+"""
+导入耗时基准测试
+
+在新的解释器进程中反复导入模块，以-X importtime统计冷启动耗时，并检查重依赖是否被提前导入，结果以JSON输出。
+指定--check时有重依赖被导入则以非0状态退出，可以在CI中防止冷启动耗时回退
+
+用法: python -m benchmarks.bench_import [--module api.api] [--repeat 10] [--check]
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# 导入api.api时不应该加载的模块，它们在首次使用时才导入
+HEAVY_MODULES = ('requests', 'urllib3', 'bs4', 'aiohttp', 'asyncio', 'concurrent.futures', 'http.cookiejar')
+
+_PROBE = '''
+import json, sys
+before = set(sys.modules)
+import {module}
+print(json.dumps(sorted(set(sys.modules) - before)))
+'''
+
+
+def measure(module):
+    """在新进程中导入一次模块
+
+    Args:
+        module: 模块名
+
+    Returns:
+        tuple: (模块的累计导入耗时(秒), 导入过程中新加载的模块列表)
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', _PROBE.format(module=module)],
+                          capture_output=True, text=True, check=True)
+    cumulative = None
+    for line in proc.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[2].strip() == module:
+            cumulative = int(parts[1]) / 1e6
+    return cumulative, json.loads(proc.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark module import time')
+    parser.add_argument('--module', default='api.api')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--check', action='store_true', help='exit with 1 if a heavy module is imported eagerly')
+    args = parser.parse_args()
+
+    times = []
+    loaded = []
+    for i in range(args.repeat):
+        cumulative, loaded = measure(args.module)
+        times.append(cumulative)
+    eager = [name for name in HEAVY_MODULES if name in loaded]
+    print(json.dumps({'module': args.module, 'repeat': args.repeat, 'min': min(times),
+                      'median': statistics.median(times), 'modules_loaded': len(loaded), 'eager_heavy_modules': eager},
+                     indent=4))
+    if args.check and eager:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""
+基准测试用的本地HTTP/1.1服务
+
+响应延迟、响应体大小和错误率可以在启动时设置，也可以用查询参数latency、size、error_rate按请求覆盖。
+可以在当前进程的后台线程中运行，也可以作为子进程运行，避免服务端占用被测进程的GIL
+
+用法: python -m benchmarks.server [--port 8000] [--latency 0] [--payload 256] [--error-rate 0]
+"""
+
+import argparse
+import json
+import random
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class BenchHandler(BaseHTTPRequestHandler):
+    """返回固定大小JSON响应的请求处理器"""
+    protocol_version = 'HTTP/1.1'
+    # 响应头和响应体分两次写出，不关闭Nagle算法时会与客户端的延迟确认叠加出约40ms的延迟
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.reply()
+
+    def do_POST(self):
+        self.reply()
+
+    def reply(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        params = parse_qs(urlparse(self.path).query)
+        latency = float(params.get('latency', [self.server.latency])[0])
+        size = int(params.get('size', [self.server.payload])[0])
+        error_rate = float(params.get('error_rate', [self.server.error_rate])[0])
+        if latency:
+            time.sleep(latency)
+        status = 500 if error_rate and random.random() < error_rate else 200
+        data = self.server.payloads.get(size)
+        if data is None:
+            data = self.server.payloads[size] = json.dumps({'data': 'x' * max(0, size - 12)}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class BenchServer:
+    """在后台线程中运行的基准测试服务
+
+    Attributes:
+        host: 监听地址
+        port: 监听端口
+    """
+
+    def __init__(self, latency=0.0, payload=256, error_rate=0.0, host='127.0.0.1', port=0):
+        """启动服务
+
+        Args:
+            latency: 每个响应的延迟(秒)
+            payload: 响应体字节数
+            error_rate: 返回500的比例
+            host: 监听地址
+            port: 监听端口，为0时自动选择
+        """
+        self.httpd = ThreadingHTTPServer((host, port), BenchHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.latency = latency
+        self.httpd.payload = payload
+        self.httpd.error_rate = error_rate
+        self.httpd.payloads = {}
+        self.host, self.port = self.httpd.server_address[:2]
+        self.__thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.__thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """停止服务"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class SubprocessServer:
+    """在子进程中运行的基准测试服务
+
+    Attributes:
+        host: 监听地址
+        port: 监听端口
+    """
+
+    def __init__(self, latency=0.0, payload=256, error_rate=0.0, host='127.0.0.1'):
+        """启动子进程，等待其输出监听端口
+
+        Args:
+            latency: 每个响应的延迟(秒)
+            payload: 响应体字节数
+            error_rate: 返回500的比例
+            host: 监听地址
+        """
+        self.process = subprocess.Popen([sys.executable, '-m', 'benchmarks.server', '--host', host,
+                                         '--latency', str(latency), '--payload', str(payload),
+                                         '--error-rate', str(error_rate)], stdout=subprocess.PIPE, text=True)
+        self.host = host
+        self.port = json.loads(self.process.stdout.readline())['port']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """停止子进程"""
+        self.process.terminate()
+        self.process.wait()
+        self.process.stdout.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='local http server for benchmarks')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--payload', type=int, default=256)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = BenchServer(args.latency, args.payload, args.error_rate, args.host, args.port)
+    print(json.dumps({'host': server.host, 'port': server.port}), flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.close()
+
+
+if __name__ == '__main__':
+    main()
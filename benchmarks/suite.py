@@ -0,0 +1,295 @@
+"""
+Api性能基准测试套件
+
+对本地服务测量Api.send的单请求开销、请求链和请求组的吞吐量、send_parallel随线程数的扩展性、生成Api的耗时以及JSON编解码耗时。
+结果以JSON输出，可以保存为基线，之后的运行与基线比较，性能回退超过容差时以非0状态退出
+
+用法: python -m benchmarks.suite [--requests 500] [--latency 0] [--payload 256] [--error-rate 0]
+                                 [--server thread|process] [--output result.json]
+                                 [--baseline benchmarks/baseline.json] [--tolerance 0.25] [--save-baseline]
+
+指标名以_per_sec结尾的越大越好，其余(耗时)越小越好。耗时是绝对值，只有在同一台机器上比较才有意义：
+基线需要在运行比较的机器上用--save-baseline重新生成，平台信息与基线不同时会输出警告
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+from api import log
+from api.api import Api, Env
+from benchmarks.bench_codec import bench as bench_codec, make_payload
+from benchmarks.server import BenchServer, SubprocessServer
+
+DEFAULT_BASELINE = 'benchmarks/baseline.json'
+PARALLEL_THREADS = (1, 2, 4, 8)
+# 只用于参考、不与基线比较的指标：差值和尾延迟在两次运行之间波动太大
+INFORMATIONAL_SUFFIXES = ('length', 'size', 'overhead_us', '_p99_ms')
+
+
+def _per_request_us(func, count, rounds=3):
+    """测量函数的平均耗时
+
+    Args:
+        func: 无参数函数
+        count: 每轮调用次数
+        rounds: 轮数，取平均耗时最短的一轮以减少干扰
+
+    Returns:
+        float: 每次调用的平均耗时(微秒)
+    """
+    func()
+    best = None
+    for i in range(rounds):
+        start = time.perf_counter()
+        for j in range(count):
+            func()
+        elapsed = (time.perf_counter() - start) / count * 1e6
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _interleaved_us(funcs, count, rounds=5):
+    """交替测量多个函数的平均耗时
+
+    每轮依次运行每个函数，机器负载和连接状态的变化对各个函数的影响相同
+
+    Args:
+        funcs: 无参数函数列表
+        count: 每个函数每轮的调用次数
+        rounds: 轮数，每个函数取平均耗时最短的一轮
+
+    Returns:
+        list: 每个函数每次调用的平均耗时(微秒)
+    """
+    for func in funcs:
+        for i in range(min(count, 10)):
+            func()
+    best = [None] * len(funcs)
+    for i in range(rounds):
+        for index, func in enumerate(funcs):
+            start = time.perf_counter()
+            for j in range(count):
+                func()
+            elapsed = (time.perf_counter() - start) / count * 1e6
+            best[index] = elapsed if best[index] is None else min(best[index], elapsed)
+    return best
+
+
+def bench_send(env, count):
+    """测量Api.send相对于直接使用requests.Session的额外开销
+
+    直接请求使用Api本身从连接池取得的Session，适配器、连接池和连接都相同，两者交替测量
+
+    Args:
+        env: Env对象
+        count: 请求次数
+
+    Returns:
+        dict: 指标
+    """
+    api = Api(env).path('/send')
+    session = api.get_session()
+    url = api.get_url()
+    raw_us, api_us = _interleaved_us([lambda: session.get(url).content, api.send], max(1, count // 5))
+    return {'raw_session_us': raw_us, 'api_send_us': api_us, 'overhead_us': api_us - raw_us}
+
+
+def bench_chain(env, count, length=5):
+    """测量请求链的吞吐量
+
+    Args:
+        env: Env对象
+        count: 请求链执行次数
+        length: 请求链长度
+
+    Returns:
+        dict: 指标
+    """
+    head = Api(env).path('/chain/0')
+    tail = head
+    for i in range(1, length):
+        tail = tail.then(Api(env).path(f'/chain/{i}').callback(lambda resp, prev: {'status': resp.status_code}))
+    chain_us = _per_request_us(head.send, count)
+    return {'length': length, 'chain_us': chain_us, 'chain_requests_per_sec': length / chain_us * 1e6}
+
+
+def bench_group(env, count, size=8):
+    """测量请求组的吞吐量
+
+    Args:
+        env: Env对象
+        count: 请求组执行次数
+        size: 请求组成员数
+
+    Returns:
+        dict: 指标
+    """
+    head = Api(env).path('/group')
+    head.then([Api(env).path(f'/group/{i}') for i in range(size)])
+    group_us = _per_request_us(head.send, count)
+    return {'size': size, 'group_us': group_us, 'group_requests_per_sec': (size + 1) / group_us * 1e6}
+
+
+def bench_parallel(env, count):
+    """测量send_parallel在不同线程数下的吞吐量
+
+    Args:
+        env: Env对象
+        count: 每种线程数下的请求总数
+
+    Returns:
+        dict: 指标
+    """
+    api = Api(env).path('/parallel')
+    results = {}
+    for threads in PARALLEL_THREADS:
+        report = api.send_parallel(count_request=count, count_thread=threads)
+        results[f't{threads}_per_sec'] = report.get_throughput()
+        results[f't{threads}_p99_ms'] = report.latency.percentile(99) * 1000
+    return results
+
+
+def bench_build(env, count):
+    """测量为每条数据生成一个Api的耗时：新建Api、从模板派生以及展开路径模板并编译请求
+
+    Args:
+        env: Env对象
+        count: 生成次数
+
+    Returns:
+        dict: 指标
+    """
+    template = Api(env).path('/items').headers({'X-Tenant': 'bench'}).logger(None)
+    init_us = _per_request_us(lambda: Api(env).path('/items/1').headers({'X-Tenant': 'bench'}).logger(None), count)
+    with_us = _per_request_us(lambda: template.with_(path='/items/1'), count)
+    path_template = Api(env).path('/items/{id}').headers({'X-Tenant': 'bench'}).logger(None)
+    expand_us = _per_request_us(lambda: path_template.expand(id=1, fields='name').prepare(), count)
+    return {'api_init_us': init_us, 'with_us': with_us, 'expand_prepare_us': expand_us}
+
+
+def bench_json(records=2000, repeat=10):
+    """测量已安装的JSON编解码器
+
+    Args:
+        records: 测试数据的记录条数
+        repeat: 重复次数
+
+    Returns:
+        dict: 指标
+    """
+    from api.codec import CODEC_CLASSES, get_codec
+
+    payload = make_payload(records)
+    results = {}
+    for name in CODEC_CLASSES:
+        try:
+            codec = get_codec(name)
+        except ImportError:
+            continue
+        result = bench_codec(codec, payload, repeat)
+        results[f'{name}_dumps_us'] = result['dumps'] * 1e6
+        results[f'{name}_loads_us'] = result['loads'] * 1e6
+    return results
+
+
+def flatten(results):
+    """把两层的结果展开为'分组.指标'形式
+
+    Args:
+        results: {分组: {指标: 值}}字典
+
+    Returns:
+        dict: {'分组.指标': 值}，只包括数值
+    """
+    return {f'{group}.{name}': value for group, metrics in results.items() for name, value in metrics.items()
+            if isinstance(value, (int, float))}
+
+
+def compare(results, baseline, tolerance):
+    """与基线比较
+
+    Args:
+        results: 本次结果
+        baseline: 基线结果
+        tolerance: 允许的相对变化，如0.25表示25%
+
+    Returns:
+        list: 回退的指标，每项为{'metric', 'baseline', 'current', 'change'}
+    """
+    current = flatten(results)
+    regressions = []
+    for metric, base_value in flatten(baseline).items():
+        value = current.get(metric)
+        if value is None or not base_value or metric.endswith(INFORMATIONAL_SUFFIXES):
+            continue
+        change = (value - base_value) / base_value
+        worse = -change if metric.endswith('_per_sec') else change
+        if worse > tolerance:
+            regressions.append({'metric': metric, 'baseline': base_value, 'current': value, 'change': change})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark suite for api.api')
+    parser.add_argument('--requests', type=int, default=500, help='requests per measurement')
+    parser.add_argument('--latency', type=float, default=0.0, help='server latency in seconds')
+    parser.add_argument('--payload', type=int, default=256, help='response body size in bytes')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of 500 responses')
+    parser.add_argument('--server', choices=('thread', 'process'), default='process')
+    parser.add_argument('--output', help='write results to this file as well as stdout')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    args = parser.parse_args()
+
+    log.configure(echo=False)
+    server_class = SubprocessServer if args.server == 'process' else BenchServer
+    with server_class(args.latency, args.payload, args.error_rate) as server:
+        env = Env(host=server.host, port=server.port)
+        results = {
+            'send': bench_send(env, args.requests),
+            'chain': bench_chain(env, max(1, args.requests // 5)),
+            'group': bench_group(env, max(1, args.requests // 9)),
+            'parallel': bench_parallel(env, args.requests * 2),
+            'build': bench_build(env, args.requests * 20),
+            'json': bench_json()
+        }
+    output = {
+        'config': {'requests': args.requests, 'latency': args.latency, 'payload': args.payload,
+                   'error_rate': args.error_rate, 'server': args.server},
+        'platform': {'python': platform.python_version(), 'machine': platform.machine(), 'cpus': os.cpu_count()},
+        'results': results
+    }
+
+    regressions = []
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as file:
+            json.dump(output, file, indent=4)
+    else:
+        try:
+            with open(args.baseline, encoding='utf-8') as file:
+                baseline = json.load(file)
+        except FileNotFoundError:
+            baseline = None
+        if baseline is not None:
+            if baseline.get('platform') != output['platform']:
+                print(f'warning: baseline was recorded on {baseline.get("platform")}, this run is on '
+                      f'{output["platform"]}; regenerate it with --save-baseline on this machine', file=sys.stderr)
+            regressions = compare(results, baseline['results'], args.tolerance)
+            output['regressions'] = regressions
+
+    text = json.dumps(output, indent=4)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(text)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
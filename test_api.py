@@ -1,5 +1,140 @@
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
 import unittest
-from api.api import Api
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from urllib.parse import parse_qs, urlparse
+
+from api.api import Api, Env
+from api.session_pool import SessionPool
+
+# 可选依赖，没有安装时跳过相关测试
+HAS_ORJSON = importlib.util.find_spec('orjson') is not None
+HAS_AIOHTTP = importlib.util.find_spec('aiohttp') is not None
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    """
+    本地测试服务，以JSON返回请求信息
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.reply()
+
+    def do_POST(self):
+        self.reply()
+
+    def reply(self):
+        self.server.requests += 1
+        params = parse_qs(urlparse(self.path).query)
+        if 'delay' in params:
+            time.sleep(float(params['delay'][0]))
+        if 'ndjson' in params:
+            self.reply_ndjson(int(params['ndjson'][0]))
+            return
+        if 'pages' in params:
+            self.reply_page(params)
+            return
+        body = self.read_body().decode()
+        headers = {'Content-Type': 'application/json'}
+        if 'max_age' in params:
+            headers['Cache-Control'] = f'max-age={params["max_age"][0]}'
+        if 'etag' in params:
+            headers['ETag'] = params['etag'][0]
+            if self.headers.get('If-None-Match') == params['etag'][0]:
+                self.send_response(304)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+        status = int(params.get('status', ['200'])[0])
+        if 'fail' in params:
+            # 同一路径的前fail次请求返回503
+            self.server.attempts[self.path] = self.server.attempts.get(self.path, 0) + 1
+            if self.server.attempts[self.path] <= int(params['fail'][0]):
+                status = 503
+        data = json.dumps({'method': self.command, 'path': self.path, 'body': body, **self.server.extra}).encode()
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            body = b''
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                body += self.rfile.read(size + 2)[:size]
+                if not size:
+                    return body
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def reply_ndjson(self, count):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for i in range(count):
+            data = (json.dumps({'id': i, 'name': '名称'}) + '\n').encode()
+            self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def reply_page(self, params):
+        # 共total条数据，按cursor或offset分页，同时返回下一页游标和Link响应头
+        total = int(params['pages'][0])
+        offset = int(params.get('offset', params.get('cursor', ['0']))[0])
+        limit = int(params.get('limit', ['1'])[0])
+        next_offset = offset + limit if offset + limit < total else None
+        data = json.dumps({'data': list(range(offset, min(offset + limit, total))),
+                           'next_cursor': next_offset}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if next_offset is not None:
+            path = urlparse(self.path).path
+            self.send_header('Link', f'<{path}?pages={total}&offset={next_offset}&limit={limit}>; rel="next"')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalServer:
+    """
+    在后台线程中运行的本地HTTP服务
+    """
+
+    def __init__(self, handler=EchoHandler):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.httpd.connections = 0
+        self.httpd.requests = 0
+        self.httpd.attempts = {}
+        # 合并到每个JSON响应中的字段，用于模拟不同环境的响应差异
+        self.httpd.extra = {}
+        self.env = Env(host='127.0.0.1', port=self.httpd.server_address[1])
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
 
 
 class TestApi(unittest.TestCase):
@@ -44,3 +179,652 @@ class TestApi(unittest.TestCase):
 
     def test_query(self):
         Api('https://www.baidu.com').query({'a':'b'}).send_and_print()
+
+
+class TestLocalApi(unittest.TestCase):
+    """
+    使用本地服务测试Api
+    """
+
+    def setUp(self):
+        self.server = LocalServer()
+        self.pool = SessionPool()
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.close()
+
+    def test_session_reuse(self):
+        for i in range(5):
+            resp = Api(self.server.env).path(f'/items/{i}').session_pool(self.pool).send().get_resp()
+            self.assertEqual(resp.json()['path'], f'/items/{i}')
+        self.assertEqual(len(self.pool), 1)
+        self.assertEqual(self.server.httpd.connections, 1)
+
+    def test_group_concurrent(self):
+        def make(name, delay):
+            def callback(resp, api_result):
+                return {name: resp.json()['path']}
+            return Api(self.server.env).path(f'/{name}').query({'delay': delay}).callback(callback)
+
+        def last_callback(resp, api_result):
+            collected.update(api_result.get_callback_result())
+            collected['count'] = len(api_result.get_resp())
+
+        collected = {}
+        start = time.monotonic()
+        Api(self.server.env).then([make('a', 0.3), make('b', 0.1), make('c', 0.3)]) \
+            .then(Api(self.server.env).callback(last_callback)).send()
+        self.assertLess(time.monotonic() - start, 0.6)
+        self.assertEqual(list(collected), ['a', 'b', 'c', 'count'])
+        self.assertEqual(collected['count'], 3)
+
+    def test_group_collect_all(self):
+        def fail(resp, api_result):
+            raise ValueError('broken branch')
+
+        ok = Api(self.server.env).path('/ok').callback(lambda resp, api_result: {'ok': True})
+        broken = Api(self.server.env).path('/broken').callback(fail)
+        head = Api(self.server.env).then([broken, ok], group_mode='collect_all')
+        result = head.send()
+        self.assertEqual(result.get_callback_result(), {'ok': True})
+        self.assertIsNone(result.get_resp()[0])
+        self.assertIsInstance(result.get_errors()[0][1], ValueError)
+        with self.assertRaises(ValueError):
+            head.group_mode('fail_fast').send()
+
+    @unittest.skipUnless(HAS_AIOHTTP, 'aiohttp is not installed')
+    def test_send_async(self):
+        import asyncio
+        from api import aio
+
+        async def async_callback(resp, api_result):
+            await asyncio.sleep(0)
+            return {resp.json()['path']: api_result.get_callback_result()}
+
+        async def run():
+            head = Api(self.server.env).path('/head').callback(lambda resp, api_result: 'head')
+            tail_results = []
+            tail = Api(self.server.env).path('/tail') \
+                .callback(lambda resp, api_result: tail_results.append(api_result.get_callback_result()))
+            head.then([Api(self.server.env).path('/a').callback(async_callback),
+                       Api(self.server.env).path('/b').callback(async_callback)]).then(tail)
+            chains = [Api(self.server.env).path(f'/item/{i}').send_async() for i in range(50)]
+            results = await asyncio.gather(head.send_async(), *chains)
+            await aio.close_all()
+            return results, tail_results
+
+        results, tail_results = asyncio.run(run())
+        self.assertEqual(results[0].get_callback_result(), {'/a': 'head', '/b': 'head'})
+        self.assertEqual(tail_results, [{'/a': 'head', '/b': 'head'}])
+        self.assertEqual(results[50].get_resp().json()['path'], '/item/49')
+
+    def test_deep_chain(self):
+        counter = []
+        head = Api().callback(lambda resp, api_result: counter.append(1))
+        for i in range(3000):
+            head.then(Api().callback(lambda resp, api_result: counter.append(1)))
+        head.send()
+        self.assertEqual(len(counter), 3001)
+        dag_result = head.send_dag()
+        self.assertEqual(len(counter), 6002)
+        self.assertEqual(len(dag_result.get_nodes()), 3001)
+
+    def test_dag_diamond(self):
+        from api.dag import Dag
+
+        def make(name, delay):
+            return Api(self.server.env).path(f'/{name}').query({'delay': delay}) \
+                .callback(lambda resp, api_result: {name: api_result.get_callback_result()})
+
+        a, b, c = make('a', 0), make('b', 0.3), make('c', 0.3)
+        d = make('d', 0.1)
+        dag_result = Dag().add(a).add(b, [a]).add(c, [a]).add(d, [b, c]).run(max_workers=4)
+        self.assertEqual(dag_result.get_result(d).get_callback_result(),
+                         {'d': {'b': {'a': None}, 'c': {'a': None}}})
+        self.assertLess(dag_result.get_elapsed(), 0.65)
+        path = [node.api for node in dag_result.get_critical_path()]
+        self.assertEqual(path[0], a)
+        self.assertEqual(path[-1], d)
+        self.assertGreater(dag_result.get_critical_path_time(), 0.4)
+
+    def test_dag_repeated_api(self):
+        head = Api(self.server.env).path('/head').logger(None)
+        member = Api(self.server.env).path('/member').logger(None)
+        head.then([member] * 5)
+        requests_before = self.server.httpd.requests
+        dag_result = head.send_dag()
+        self.assertEqual(self.server.httpd.requests - requests_before, 6)
+        merged = [node for node in dag_result.get_nodes() if node.api is None][0]
+        self.assertEqual([resp.json()['path'] for resp in merged.result.get_resp()], ['/member'] * 5)
+
+    def test_send_parallel_exact_count(self):
+        paths = []
+        api = Api(self.server.env).path('/load').callback(lambda resp, api_result: paths.append(resp.status_code))
+        report = api.send_parallel(count_request=37, count_thread=8)
+        self.assertEqual(report.get_count(), 37)
+        self.assertEqual(len(paths), 37)
+        self.assertEqual(report.status_counts, {200: 37})
+
+    def test_send_parallel_open_loop_rate(self):
+        # 响应耗时0.2秒，开环模式仍按每秒50个的速率派发
+        api = Api(self.server.env).path('/load').query({'delay': 0.2})
+        start = time.monotonic()
+        report = api.send_parallel(count_request=25, count_thread=20, rate=50, mode='open')
+        elapsed = time.monotonic() - start
+        self.assertEqual(report.get_count(), 25)
+        self.assertGreaterEqual(report.latency.percentile(50), 0.2)
+        self.assertGreater(elapsed, 0.65)
+        self.assertLess(elapsed, 1.0)
+
+    def test_token_bucket(self):
+        from api.load import TokenBucket
+        bucket = TokenBucket(rate=200)
+        start = time.monotonic()
+        for i in range(41):
+            bucket.acquire()
+        self.assertAlmostEqual(time.monotonic() - start, 0.2, delta=0.05)
+
+    def test_timing(self):
+        timing = Api(self.server.env).path('/timing').session_pool(self.pool).send().get_timing()
+        self.assertGreater(timing.connect, 0)
+        self.assertGreaterEqual(timing.total, timing.ttfb)
+        self.assertEqual(Api(self.server.env).path('/timing').session_pool(self.pool).send().get_timing().connect, 0)
+
+    def test_histogram(self):
+        from api.stats import LatencyHistogram
+        first, second = LatencyHistogram(), LatencyHistogram()
+        for i in range(1, 501):
+            first.record(i / 1000)
+            second.record((i + 500) / 1000)
+        merged = LatencyHistogram.from_dict(first.to_dict()).merge(second)
+        self.assertEqual(merged.get_count(), 1000)
+        self.assertAlmostEqual(merged.percentile(50), 0.5, delta=0.005)
+        self.assertAlmostEqual(merged.percentile(99), 0.99, delta=0.01)
+        self.assertEqual(merged.percentile(100), 1.0)
+        self.assertEqual(merged.get_min(), 0.001)
+
+    def test_template_untouched(self):
+        api = Api(self.server.env).path('/items').method('post').body({'id': 1}) \
+            .query(lambda prev_result: {'page': 2}) \
+            .before_send(lambda prev_result, working: working.headers({'X-Trace': '1'}))
+        bodies = []
+        api.callback(lambda resp, api_result: bodies.append(resp.json()['body']))
+        api.send_parallel(count_request=20, count_thread=5)
+        self.assertEqual(set(bodies), {'{"id": 1}'})
+        self.assertEqual(api.get_body(), {'id': 1})
+        self.assertEqual(api.get_query(), '')
+        self.assertNotIn('X-Trace', api.get_headers())
+
+    def test_prepare_cache(self):
+        api = Api(self.server.env).path('/items').body({'id': 1})
+        prepared = api.prepare()
+        self.assertIs(api.prepare(), prepared)
+        self.assertEqual(prepared.body, b'{"id": 1}')
+        self.assertEqual(api.send().get_resp().json()['body'], '{"id": 1}')
+        self.assertIs(api.prepare(), prepared)
+        api.query({'page': 2})
+        self.assertIsNot(api.prepare(), prepared)
+        self.assertTrue(api.prepare().url.endswith('/items?page=2'))
+
+    def test_response_cache(self):
+        import tempfile
+        from api.cache import ResponseCache
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResponseCache(max_entries=1, directory=directory)
+            fresh = Api(self.server.env).path('/config').query({'max_age': 60}).cache(cache)
+            self.assertEqual(fresh.send().get_cache_status(), 'miss')
+            result = fresh.send()
+            self.assertEqual(result.get_cache_status(), 'hit')
+            self.assertEqual(result.get_resp().json()['path'], '/config?max_age=60')
+            self.assertEqual(self.server.httpd.requests, 1)
+
+            # max_entries为1，新条目把上一个条目挤出内存，之后从磁盘读取
+            stale = Api(self.server.env).path('/token').query({'etag': '"v1"'}).cache(cache)
+            self.assertEqual(stale.send().get_cache_status(), 'miss')
+            result = stale.send()
+            self.assertEqual(result.get_cache_status(), 'revalidated')
+            self.assertEqual(result.get_resp().status_code, 200)
+            self.assertEqual(result.get_resp().json()['path'], '/token?etag=%22v1%22')
+            # 304的Content-Length: 0不会覆盖缓存的响应体长度
+            self.assertEqual(int(result.get_resp().headers['Content-Length']), len(result.get_resp().content))
+            self.assertEqual(fresh.send().get_cache_status(), 'hit')
+            self.assertEqual(self.server.httpd.requests, 3)
+            # 再次验证时存储的条目仍然是原来的长度
+            self.assertEqual(int(stale.send().get_resp().headers['Content-Length']), len(result.get_resp().content))
+
+    def test_single_flight(self):
+        from api.singleflight import SingleFlight
+
+        results = []
+        api = Api(self.server.env).path('/reference').query({'delay': 0.3}).single_flight(True) \
+            .callback(lambda resp, api_result: results.append(resp.json()['path']))
+        Api().then([api] * 5).send()
+        self.assertEqual(len(results), 5)
+        self.assertEqual(self.server.httpd.requests, 1)
+
+        # 条件请求和Range请求不与普通请求合并
+        single_flight = SingleFlight()
+        plain = Api(self.server.env).path('/slow').prepare()
+        keys = {single_flight.key(plain)}
+        for header in ({'If-None-Match': '"v1"'}, {'If-Modified-Since': 'Wed, 21 Oct 2015 07:28:00 GMT'},
+                       {'Range': 'bytes=0-9'}):
+            keys.add(single_flight.key(Api(self.server.env).path('/slow').headers(header).prepare()))
+        self.assertEqual(len(keys), 4)
+
+    def test_stream_mode(self):
+        def callback(resp_stream, api_result):
+            return {'ids': sum(record['id'] for record in resp_stream), 'status': resp_stream.resp.status_code}
+
+        api = Api(self.server.env).path('/export').query({'ndjson': 2000}).stream_mode('ndjson', chunk_size=7)
+        self.assertEqual(api.callback(callback).send().get_callback_result(), {'ids': 1999000, 'status': 200})
+        lines = api.iter_stream('lines', chunk_size=5)
+        self.assertEqual(json.loads(next(lines)), {'id': 0, 'name': '名称'})
+        lines.close()
+        # 流式输出时返回本次请求的结果，只发送一次
+        output = io.StringIO()
+        requests_before = self.server.httpd.requests
+        with contextlib.redirect_stdout(output):
+            result = api.query({'ndjson': 3}).send_and_print()
+        self.assertEqual(self.server.httpd.requests - requests_before, 1)
+        self.assertEqual(result.get_resp().status_code, 200)
+        self.assertIsNotNone(result.get_timing())
+        self.assertEqual(output.getvalue().count('\n'), 3)
+
+    def test_stream_body(self):
+        import tempfile
+        from api.json_util import iter_json_array
+
+        records = ({'id': i} for i in range(1000))
+        api = Api(self.server.env).path('/bulk').method('post').body(iter_json_array(records, chunk_size=100))
+        body = api.send().get_resp().json()['body']
+        self.assertEqual(json.loads(body), [{'id': i} for i in range(1000)])
+        with tempfile.TemporaryFile() as file:
+            file.write(b'{"from": "file"}')
+            file.seek(0)
+            body = Api(self.server.env).path('/upload').method('post').body(file).send().get_resp().json()['body']
+        self.assertEqual(body, '{"from": "file"}')
+
+    @unittest.skipUnless(HAS_ORJSON, 'orjson is not installed')
+    def test_codec(self):
+        from api.codec import get_codec
+
+        api = Api(self.server.env).path('/items').method('post').body({'name': '名称'}).codec('orjson')
+        self.assertEqual(api.prepare().body, '{"name":"名称"}'.encode())
+        self.assertEqual(json.loads(api.send_and_get_json()['body']), {'name': '名称'})
+        self.assertIn(get_codec('auto').name, ('orjson', 'ujson', 'json'))
+
+    def test_lazy_import(self):
+        code = 'import sys, api.api; print(sorted(m for m in ("requests", "bs4", "asyncio", "concurrent.futures") ' \
+               'if m in sys.modules))'
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), '[]')
+
+    def test_request_log(self):
+        import logging
+        from api.log import RequestLogger
+
+        class ListHandler(logging.Handler):
+            def __init__(self):
+                super().__init__()
+                self.events = []
+
+            def emit(self, record):
+                self.events.append(record.event)
+
+        handler = ListHandler()
+        logger = RequestLogger(echo=False, handlers=[handler])
+        first = Api(self.server.env).path('/first').logger(logger)
+        first.then([Api(self.server.env).path('/member').logger(logger) for i in range(3)])
+        result = first.send()
+        logger.stop()
+        self.assertEqual(len(handler.events), 4)
+        self.assertEqual({event['chain_id'] for event in handler.events}, {result.get_chain_id()})
+        self.assertEqual(handler.events[0]['status'], 200)
+        self.assertIsNotNone(handler.events[0]['total'])
+
+        # 采样率为0时只记录失败的请求
+        handler.events.clear()
+        logger.sample_rate = 0
+        Api(self.server.env).path('/ok').logger(logger).send()
+        Api(self.server.env).path('/missing').query('status=404').logger(logger).send()
+        logger.stop()
+        self.assertEqual([event['status'] for event in handler.events], [404])
+
+    def test_retry_and_circuit_breaker(self):
+        from api.retry import CircuitBreakerRegistry, CircuitOpenError, RetryBudget, RetryPolicy
+
+        policy = RetryPolicy(max_retries=3, backoff=0.01)
+        result = Api(self.server.env).path('/flaky').query('fail=2').retry(policy).send()
+        self.assertEqual(result.get_resp().status_code, 200)
+        self.assertEqual(result.get_timing().retries, 2)
+
+        # POST不是幂等方法，不重试
+        result = Api(self.server.env).path('/post').query('fail=1').method('post').retry(policy).send()
+        self.assertEqual(result.get_resp().status_code, 503)
+
+        # 预算耗尽后不再重试
+        budget = RetryBudget(ratio=0, min_per_second=0, max_tokens=1)
+        result = Api(self.server.env).path('/budget').query('fail=5').retry(policy).retry_budget(budget).send()
+        self.assertEqual((result.get_resp().status_code, result.get_timing().retries), (503, 1))
+
+        # 连续失败后熔断，不再访问后端
+        breakers = CircuitBreakerRegistry(failure_threshold=2, recovery_timeout=60)
+        api = Api(self.server.env).path('/down').query('status=500').circuit_breaker(breakers)
+        api.send()
+        api.send()
+        requests_before = self.server.httpd.requests
+        with self.assertRaises(CircuitOpenError):
+            api.send()
+        self.assertEqual(self.server.httpd.requests, requests_before)
+
+        # 半开状态只由试探请求的结果改变，打开之前发出的请求成功不会关闭熔断器
+        from types import SimpleNamespace
+        from api.retry import CircuitBreaker
+
+        breaker = CircuitBreaker(('http', 'localhost', 80), failure_threshold=1, recovery_timeout=0)
+        stale = breaker.before_call()
+        breaker.record(error=OSError())
+        probe = breaker.before_call()
+        breaker.record(SimpleNamespace(status_code=200), probe=stale)
+        self.assertEqual(breaker.get_state(), 'half_open')
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+        breaker.record(SimpleNamespace(status_code=200), probe=probe)
+        self.assertEqual(breaker.get_state(), 'closed')
+
+    def test_bulk_runner(self):
+        import os
+        import tempfile
+        from api.__main__ import main
+
+        with tempfile.TemporaryDirectory() as directory:
+            input_path = os.path.join(directory, 'requests.jsonl')
+            output_path = os.path.join(directory, 'results.jsonl')
+            with open(input_path, 'w', encoding='utf-8') as file:
+                for i in range(6):
+                    spec = {'id': f'r{i}', 'path': f'/bulk/{i}', 'query': {'delay': (6 - i) / 100}}
+                    file.write(json.dumps(spec) + '\n')
+                file.write('\n{"path": "/missing", "query": "status=404"}\n')
+            args = [input_path, '-o', output_path, '--host', '127.0.0.1', '--port', str(self.server.env.port)]
+            self.assertEqual(main(['bulk', *args, '--workers', '4', '--window', '4']), 0)
+            with open(output_path, encoding='utf-8') as file:
+                records = [json.loads(line) for line in file]
+            # 结果按输入顺序写出
+            self.assertEqual([record['line'] for record in records], list(range(7)))
+            self.assertEqual([record['id'] for record in records[:2]], ['r0', 'r1'])
+            self.assertEqual([record['status'] for record in records], [200] * 6 + [404])
+            self.assertEqual(len(records[0]['sha256']), 64)
+
+            # 中断时只写了一半的行被截掉，已完成的请求不会重新发送
+            with open(output_path, 'r+', encoding='utf-8') as file:
+                lines = file.readlines()
+                file.seek(0)
+                file.truncate()
+                file.writelines(lines[:3])
+                file.write(lines[3][:10])
+            requests_before = self.server.httpd.requests
+            main(['bulk', *args, '--body', 'body'])
+            self.assertEqual(self.server.httpd.requests - requests_before, 4)
+            with open(output_path, encoding='utf-8') as file:
+                records = [json.loads(line) for line in file]
+            self.assertEqual([record['line'] for record in records], list(range(7)))
+            self.assertEqual(json.loads(records[3]['body'])['path'], '/bulk/3?delay=0.03')
+
+    def test_cassette(self):
+        import os
+        import tempfile
+        from api import cassette
+
+        def run_chain(env):
+            first = Api(env).path('/first').callback(lambda resp, prev: {'first': resp.json()['path']})
+            first.then(Api(env).path('/second').method('post').body({'id': 1})
+                       .callback(lambda resp, prev: {**prev.get_callback_result(), 'second': resp.json()['body']}))
+            return first.send().get_callback_result()
+
+        server = LocalServer()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'chain.jsonl')
+            with cassette.use(path, cassette.MODE_RECORD):
+                recorded = run_chain(server.env)
+            server.close()
+
+            # 回放时服务已经关闭，不访问网络
+            with cassette.use(path) as tape:
+                self.assertEqual(len(tape), 2)
+                self.assertEqual(run_chain(server.env), recorded)
+                with self.assertRaises(cassette.CassetteMissError):
+                    Api(server.env).path('/unknown').send()
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'requires os.fork')
+    def test_fork_resets_locks(self):
+        import signal
+
+        from api.cache import ResponseCache
+        from api.cassette import MODE_AUTO, Cassette
+        from api.retry import CircuitBreakerRegistry, RetryBudget
+        from api.singleflight import SingleFlight
+
+        cache, single_flight, budget = ResponseCache(), SingleFlight(), RetryBudget()
+        breakers, tape = CircuitBreakerRegistry(), Cassette(mode=MODE_AUTO)
+        api = Api(self.server.env).path('/fork').logger(None).cache(cache).single_flight(single_flight) \
+            .retry(True).retry_budget(budget).circuit_breaker(breakers).cassette(tape)
+        snapshot = api.prepare()
+        breaker = breakers.get(snapshot.protocol, snapshot.host, snapshot.port)
+        # 模拟fork时其他线程正持有锁
+        locks = [cache._ResponseCache__lock, single_flight._SingleFlight__lock, budget._RetryBudget__lock,
+                 breakers._CircuitBreakerRegistry__lock, breaker._CircuitBreaker__lock, tape._Cassette__lock]
+        for lock in locks:
+            lock.acquire()
+        try:
+            pid = os.fork()
+            if pid == 0:
+                signal.alarm(10)
+                try:
+                    os._exit(0 if api.send().get_resp().status_code == 200 else 1)
+                finally:
+                    os._exit(2)
+        finally:
+            for lock in locks:
+                lock.release()
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+
+    def test_send_parallel_processes(self):
+        api = Api(self.server.env).path('/processes').logger(None)
+        requests_before = self.server.httpd.requests
+        report = api.send_parallel(count_request=41, count_thread=2, processes=3)
+        self.assertEqual(report.get_count(), 41)
+        self.assertEqual(report.status_counts[200], 41)
+        self.assertEqual(self.server.httpd.requests - requests_before, 41)
+        self.assertGreater(report.latency.percentile(99), 0)
+
+    def test_fan_out(self):
+        other = LocalServer()
+        try:
+            self.server.httpd.extra = {'version': 1, 'build': 'a'}
+            other.httpd.extra = {'version': 2, 'build': 'b'}
+            head = Api(self.server.env).path('/compare').logger(None)
+            # 完整URL的Api不随环境切换，两个环境的请求链都访问self.server
+            head.then(Api(f'{self.server.env.get_env()}/fixed').logger(None))
+            comparison = head.fan_out([self.server.env, other.env], ignore=('$.version', '$.build'))
+            self.assertEqual([len(each.results) for each in comparison.get_results()], [2, 2])
+            self.assertEqual([each.error for each in comparison.get_results()], [None, None])
+            self.assertEqual(self.server.httpd.requests, 3)
+            self.assertEqual(other.httpd.requests, 1)
+            self.assertIs(head.get_env(), self.server.env)
+            self.assertTrue(comparison.is_consistent())
+            self.assertEqual(comparison.get_latency_deltas()[0], 0)
+
+            comparison = Api(self.server.env).path('/compare').logger(None).fan_out(
+                [self.server.env, other.env], ignore=('$.build',))
+            self.assertEqual(comparison.get_diffs()[0], [])
+            diff, = comparison.get_diffs()[1]
+            self.assertEqual((diff['step'], diff['index']), (0, 0))
+            self.assertIsNone(diff['status'])
+            self.assertEqual(diff['body'], [{'path': '$.version', 'kind': 'changed', 'baseline': 1, 'value': 2}])
+            summary = comparison.summary()
+            self.assertFalse(summary['consistent'])
+            self.assertEqual(summary['envs'][1]['env'], other.env.get_env())
+            self.assertEqual(summary['envs'][1]['status'], [[200]])
+        finally:
+            other.close()
+
+    def test_paginate(self):
+        from api.paginate import CursorPaginator, LinkPaginator, OffsetPaginator
+
+        api = Api(self.server.env).path('/pages').query({'pages': 5}).logger(None)
+        cursor = CursorPaginator(items='data')
+        self.assertEqual(list(api.paginate(cursor, items=True)), [0, 1, 2, 3, 4])
+        self.assertEqual(self.server.httpd.requests, 5)
+        self.assertEqual(api.get_query(), 'pages=5')
+
+        pages = [result.get_resp().json()['data'] for result in
+                 api.paginate(OffsetPaginator(limit=2, items='data'), prefetch=3)]
+        self.assertEqual(pages, [[0, 1], [2, 3], [4]])
+        self.assertEqual(self.server.httpd.requests, 8)
+        self.assertEqual(list(api.paginate(LinkPaginator(items='data'), items=True, max_pages=3)), [0, 1, 2])
+        self.assertEqual(self.server.httpd.requests, 11)
+
+        # 不预取时提前结束只发送已经处理的页
+        for item in api.paginate(cursor, prefetch=0, items=True):
+            break
+        self.assertEqual(self.server.httpd.requests, 12)
+        # 预取时最多多发送prefetch页
+        for item in api.paginate(cursor, prefetch=1, items=True):
+            break
+        time.sleep(0.2)
+        self.assertLessEqual(self.server.httpd.requests, 14)
+
+    def test_retention(self):
+        import hashlib
+
+        from api.retention import ResponseSummary
+
+        api = Api(self.server.env).path('/retain').session_pool(self.pool).logger(None)
+        full = api.send()
+        self.assertFalse(hasattr(full, '__dict__'))
+        self.assertFalse(hasattr(full.get_timing(), '__dict__'))
+
+        seen = []
+        result = api.retention('digest').callback(lambda resp, prev: seen.append(resp.json()['path'])).send()
+        summary = result.get_resp()
+        self.assertIsInstance(summary, ResponseSummary)
+        self.assertEqual(seen, ['/retain'])
+        self.assertEqual(summary.status_code, 200)
+        self.assertEqual(summary.headers['Content-Type'], 'application/json')
+        self.assertEqual(summary.digest, hashlib.sha256(full.get_resp().content).hexdigest())
+        self.assertEqual(summary.size, len(full.get_resp().content))
+        self.assertEqual(self.server.httpd.connections, 1)
+
+        head = Api(self.server.env).path('/retain').logger(None).retention('headers')
+        head.then([Api(self.server.env).path(f'/retain/{i}').logger(None).retention('none') for i in range(3)])
+        group = head.send()
+        self.assertEqual([resp.status_code for resp in group.get_resp()], [200] * 3)
+        self.assertIsNone(group.get_resp()[0].headers)
+        with self.assertRaises(ValueError):
+            api.retention('body')
+        # stream_mode的callback已经读取了响应体，大小和摘要未知
+        consumed = Api(self.server.env).path('/retain').query({'ndjson': 3}).logger(None).retention('digest')
+        result = consumed.stream_mode('ndjson').callback(lambda stream, prev: len(list(stream))).send()
+        self.assertEqual(result.get_callback_result(), 3)
+        self.assertEqual((result.get_resp().size, result.get_resp().digest), (None, None))
+
+        results = []
+        report = Api(self.server.env).path('/retain').logger(None).send_parallel(
+            count_request=5, retention='none', future_callback=lambda future: results.append(future.result()))
+        self.assertEqual(report.status_counts[200], 5)
+        self.assertTrue(all(isinstance(each.get_resp(), ResponseSummary) for each in results))
+
+    def test_with_clone(self):
+        template = Api(self.server.env).path('/items').headers({'X-Tenant': 'a'}).logger(None)
+        template.prepare()
+        derived = [template.with_(query={'id': i}) for i in range(3)]
+        self.assertEqual([api.send().get_resp().json()['path'] for api in derived],
+                         ['/items?id=0', '/items?id=1', '/items?id=2'])
+        self.assertEqual(template.get_query(), '')
+        self.assertEqual(template.prepare().url, f'{self.server.env.get_env()}/items')
+        # HTTP头在派生的Api和模板之间写时复制
+        self.assertIs(derived[0].get_headers(), template.get_headers())
+        other = template.with_(headers={'X-Tenant': 'b'})
+        self.assertEqual(other.get_headers()['X-Tenant'], 'b')
+        self.assertEqual(template.get_headers()['X-Tenant'], 'a')
+        template.headers({'X-Trace': '1'})
+        self.assertNotIn('X-Trace', derived[0].get_headers())
+        # None的含义与setter相同：path忽略None，logger被清除
+        quiet = Api(self.server.env).path('/items').with_(path=None, logger=None)
+        self.assertEqual(quiet.get_path(), '/items')
+        self.assertIsNone(quiet.get_logger())
+        with self.assertRaises(TypeError):
+            template.with_(pathh='/typo')
+
+    def test_working_copy_leaves_template(self):
+        template = Api(self.server.env).path('/items').headers({'X-Tenant': 'a'}).logger(None) \
+            .query(lambda prev_result: {'page': 2})
+        before = dict(template.__dict__)
+        threads = [threading.Thread(target=lambda: [template.send() for _ in range(5)]) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        lines = template.iter_stream('lines')
+        next(lines)
+        lines.close()
+        self.assertEqual(template.__dict__, before)
+        for key, value in before.items():
+            self.assertIs(template.__dict__[key], value)
+
+    def test_url_template_and_sweep(self):
+        import itertools
+
+        from api.url import encode_query
+
+        # 哈希相同但类型不同的值各自编码，结果与调用顺序无关
+        self.assertEqual([encode_query({'flag': value}) for value in (True, 1, 1.0, 1)],
+                         ['flag=True', 'flag=1', 'flag=1.0', 'flag=1'])
+        api = Api(self.server.env).path('/users/{id}/orders').query({'fields': 'id', 'page': 1}).logger(None)
+        self.assertEqual(api.get_query(), 'fields=id&page=1')
+        expanded = api.expand({'id': 'a b/c', 'page': 2}, tag=['x', 'y z'])
+        self.assertEqual(expanded.send().get_resp().json()['path'],
+                         '/users/a%20b%2Fc/orders?fields=id&page=2&tag=x&tag=y+z')
+        self.assertEqual(api.get_path_params(), None)
+        self.assertEqual(api.get_query(), 'fields=id&page=1')
+        with self.assertRaises(ValueError):
+            api.with_(path_params={'user': 1}).send()
+
+        results = list(api.sweep({'id': i} for i in range(20)))
+        self.assertEqual([params['id'] for params, result, error in results], list(range(20)))
+        self.assertEqual([result.get_resp().json()['path'] for params, result, error in results],
+                         [f'/users/{i}/orders?fields=id&page=1' for i in range(20)])
+
+        # 无限参数序列只读取已经处理的和在途的
+        before = self.server.httpd.requests
+        consumed = itertools.count()
+        for params, result, error in api.sweep(({'id': next(consumed)} for _ in itertools.repeat(None)),
+                                               max_workers=2, window=4):
+            self.assertIsNone(error)
+            if params['id'] == 5:
+                break
+        time.sleep(0.2)
+        self.assertLessEqual(next(consumed), 11)
+        self.assertLessEqual(self.server.httpd.requests - before, 11)
+
+    def test_retention_internal_readers(self):
+        from api import retention
+        from api.bulk import BulkRunner
+        from api.paginate import CursorPaginator
+
+        retention.set_default_retention('headers')
+        try:
+            api = Api(self.server.env).path('/pages').query({'pages': 3}).logger(None)
+            self.assertEqual(list(api.paginate(CursorPaginator(items='data'), items=True)), [0, 1, 2])
+            self.assertEqual(api.send_and_get_json()['data'], [0])
+            stream_api = Api(self.server.env).path('/stream').query({'ndjson': 2}).logger(None)
+            self.assertEqual([record['id'] for record in stream_api.iter_stream('ndjson')], [0, 1])
+            record = BulkRunner(env=self.server.env).run_one(0, json.dumps({'path': '/bulk'}))
+            self.assertNotIn('error', record)
+            self.assertEqual((record['status'], len(record['sha256'])), (200, 64))
+            self.assertGreater(record['size'], 0)
+        finally:
+            retention.set_default_retention('full')